@@ -0,0 +1,161 @@
+# app/cli.py
+"""Maintenance commands run next to the app, with the same DATABASE_URL.
+
+    python -m app.cli import-members TOKEN members.csv
+    python -m app.cli export-members TOKEN --format ndjson --output members.ndjson
+    python -m app.cli compress-static
+    python -m app.cli create-outbox-tables [--print]
+"""
+from sqlalchemy import select
+from app.dependencies import database_names, dispose_engines, session_scope, store_session
+from app.models.cliente import Cliente
+from app.services.compression import precompress_directory
+from app.services.members import (
+    MEMBER_IMPORT_BATCH, csv_lines, export_members, import_members, iter_csv_rows, iter_ndjson_rows, ndjson_lines,
+    reject_record,
+)
+from app.services.outbox import create_outbox_tables, outbox_ddl
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 64 * 1024
+
+
+async def _file_chunks(path: str):
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_CHUNK):
+            yield chunk
+
+
+async def _store_table(db, token: str) -> str:
+    query = select(Cliente.dbnome).where(Cliente.token_registrazione == token, Cliente.active == 1)
+    table_name = (await db.execute(query)).scalar_one_or_none()
+    if table_name is None:
+        raise SystemExit(f"No active store found for token: {token}")
+    return table_name
+
+
+def _detect_format(path: str, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+async def import_command(args) -> int:
+    checkpoint_path = args.checkpoint or args.file + ".progress"
+    rejects_path = args.rejects or args.file + ".rejects.ndjson"
+    skip = 0
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            skip = json.load(f)["rows_done"]
+        logger.info("Resuming import of %s after line %s", args.file, skip)
+
+    chunks = _file_chunks(args.file)
+    rows = iter_ndjson_rows(chunks) if _detect_format(args.file, args.format) == "ndjson" else iter_csv_rows(chunks)
+
+    with open(rejects_path, "a") as rejects_file:
+        async def save(progress, rejects):
+            # Rejects first: a crash in between only repeats a batch's rejects, never loses them
+            for reject in rejects:
+                rejects_file.write(json.dumps(reject_record(*reject), default=str) + "\n")
+            rejects_file.flush()
+            with open(checkpoint_path + ".tmp", "w") as f:
+                json.dump({"file": args.file, **progress.to_dict()}, f)
+            os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+        async with session_scope() as db:
+            table_name = await _store_table(db, args.token)
+            async with store_session(db, table_name) as store_db:
+                progress = await import_members(store_db, table_name, rows, skip=skip, batch_size=args.batch_size,
+                                                on_batch=save)
+
+    print(json.dumps({"table": table_name, **progress.to_dict(), "rejects_file": rejects_path}))
+    return 1 if progress.stopped else 0
+
+
+async def export_command(args) -> int:
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        async with session_scope() as db:
+            table_name = await _store_table(db, args.token)
+        async with session_scope(table_name) as db:
+            rows = export_members(db, table_name, claimed_only=not args.all)
+            async for chunk in (csv_lines(rows) if args.format == "csv" else ndjson_lines(rows)):
+                out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+async def compress_static_command(args) -> int:
+    for path in precompress_directory(args.directory):
+        print(path)
+    return 0
+
+
+async def create_outbox_tables_command(args) -> int:
+    if not args.print:
+        await create_outbox_tables(session_scope, database_names())
+        print("\n".join(database_names()))
+        return 0
+    for name in database_names():
+        async with session_scope(shard=name) as db:
+            dialect = await db.run_sync(lambda session: session.get_bind().dialect)
+        print(f"-- database: {name}")
+        for statement in outbox_ddl(dialect):
+            print(statement + "\n")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import-members", help="load a CSV/NDJSON member list into a store's free cards")
+    importer.add_argument("token", help="the store's registration token")
+    importer.add_argument("file")
+    importer.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file extension")
+    importer.add_argument("--batch-size", type=int, default=MEMBER_IMPORT_BATCH)
+    importer.add_argument("--rejects", help="NDJSON file rejected rows are appended to (default: FILE.rejects.ndjson)")
+    importer.add_argument("--checkpoint", help="resume point file (default: FILE.progress)")
+
+    exporter = commands.add_parser("export-members", help="stream a store's members as CSV/NDJSON")
+    exporter.add_argument("token", help="the store's registration token")
+    exporter.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    exporter.add_argument("--all", action="store_true", help="include free (unassigned) cards")
+    exporter.add_argument("--output", help="default: stdout")
+
+    compressor = commands.add_parser("compress-static", help="write .gz/.br siblings of the static assets")
+    compressor.add_argument("--directory", default="app/static")
+
+    outbox = commands.add_parser("create-outbox-tables", help="create registration_outbox on every database")
+    outbox.add_argument("--print", action="store_true", help="print the DDL per database instead of running it")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), stream=sys.stderr)
+    command = {
+        "import-members": import_command,
+        "export-members": export_command,
+        "compress-static": compress_static_command,
+        "create-outbox-tables": create_outbox_tables_command,
+    }[args.command]
+
+    async def run():
+        try:
+            return await command(args)
+        finally:
+            await dispose_engines()
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
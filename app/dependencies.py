@@ -1,40 +1,163 @@
 # app/dependencies.py
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from fastapi import Header, HTTPException, Request
+from app.services.shards import DEFAULT_SHARD, ShardRouter, parse_routes, parse_shards
+from app.settings import get_settings
+from contextlib import asynccontextmanager, AsyncExitStack, ExitStack
+import asyncio
+import math
 import os
 import logging
+import secrets
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Loaded once per process (this also loads .env); required values are checked by create_app()
+settings = get_settings()
+DATABASE_URL = settings.database_url
 
-if not DATABASE_URL:
-    logger.error("DATABASE_URL not found in environment variables")
-    raise ValueError("DATABASE_URL is required")
+# Use the async engine for request handlers unless DB_ASYNC=0 selects the sync fallback
+DB_ASYNC = settings.db_async
 
-# Create SQLAlchemy engine
-try:
-    engine = create_engine(DATABASE_URL, echo=True)  # echo=True for SQL query logging
-    logger.info("Database engine created successfully")
-except Exception as e:
-    logger.error(f"Failed to create database engine: {str(e)}")
-    raise
+# Async drivers matching the sync ones we support in DATABASE_URL
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def async_database_url(url: str) -> str:
+    """Derive the async driver URL from a sync one, e.g. mysql+pymysql:// -> mysql+aiomysql://."""
+    parsed = make_url(url)
+    if parsed.get_dialect().is_async:
+        return url
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if not driver:
+        raise ValueError(f"No async driver known for {parsed.drivername}; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+# Engine and connection pool settings; pools are per worker process, so size MySQL
+# max_connections for (DB_POOL_SIZE + DB_MAX_OVERFLOW) x workers x replicas
+DB_ECHO = settings.db_echo
+DB_POOL_SIZE = settings.db_pool_size
+DB_MAX_OVERFLOW = settings.db_max_overflow
+DB_POOL_TIMEOUT = settings.db_pool_timeout
+DB_POOL_RECYCLE = settings.db_pool_recycle  # below MySQL's wait_timeout
+DB_POOL_PRE_PING = settings.db_pool_pre_ping
+# Connections opened by the startup hook so the first requests don't pay for connecting
+DB_POOL_WARMUP = settings.db_pool_warmup
+
+# Store tables can live on other databases ("shards"): DB_SHARDS names them, DB_SHARD_ROUTES maps
+# cliente.dbnome patterns to them, and each shard's pool is capped by the DB_SHARD_* sizes
+DB_SHARDS = parse_shards(settings.db_shards)
+DB_SHARD_ROUTES = parse_routes(settings.db_shard_routes)
+DB_SHARD_POOL_SIZE = int(os.getenv("DB_SHARD_POOL_SIZE", str(DB_POOL_SIZE)))
+DB_SHARD_MAX_OVERFLOW = int(os.getenv("DB_SHARD_MAX_OVERFLOW", str(DB_MAX_OVERFLOW)))
+
+def engine_options(url: str, pool_size: int | None = None, max_overflow: int | None = None) -> dict:
+    """Keyword arguments for create_engine/create_async_engine built from the DB_* settings."""
+    options = {
+        "echo": DB_ECHO,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if make_url(url).get_backend_name() == "sqlite":
+        # SQLite connections are handed between threadpool threads by SyncSessionAdapter;
+        # its default pools don't take the sizing options below
+        options["connect_args"] = {"check_same_thread": False}
+        return options
+    options.update(
+        pool_size=DB_POOL_SIZE if pool_size is None else pool_size,
+        max_overflow=DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+def create_db_engine(url: str, **pool_sizes):
+    return create_engine(url, **engine_options(url, **pool_sizes))
+
+def create_async_db_engine(url: str, **pool_sizes):
+    return create_async_engine(url, **engine_options(url, **pool_sizes))
+
+def create_shard_engine(url: str):
+    return create_db_engine(url, pool_size=DB_SHARD_POOL_SIZE, max_overflow=DB_SHARD_MAX_OVERFLOW)
+
+def create_async_shard_engine(url: str):
+    return create_async_db_engine(async_database_url(url), pool_size=DB_SHARD_POOL_SIZE,
+                                  max_overflow=DB_SHARD_MAX_OVERFLOW)
+
+# Routes store tables to their shard; shard engines are created on first use
+shard_router = ShardRouter(DB_SHARDS, DB_SHARD_ROUTES, create_shard_engine, create_async_shard_engine)
 
 # Testing session factory (optional, for tests)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
+# Engines are created on first use (normally by the startup hook's warm-up), so importing
+# this module opens nothing and the sync fallback doesn't need an async driver installed
+engine = None
+SessionLocal = None
+async_engine = None
+AsyncSessionLocal = None
+
+def get_engine():
+    global engine, SessionLocal
+    if engine is None:
+        if not DATABASE_URL:
+            logger.error("DATABASE_URL not found in environment variables")
+            raise ValueError("DATABASE_URL is required")
+        try:
+            engine = create_db_engine(DATABASE_URL)
+            logger.info("Database engine created successfully")
+        except Exception as e:
+            logger.error("Failed to create database engine: %s", e)
+            raise
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return engine
+
+def get_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        url = settings.async_database_url or async_database_url(DATABASE_URL)
+        try:
+            async_engine = create_async_db_engine(url)
+            logger.info("Async database engine created successfully")
+        except Exception as e:
+            logger.error("Failed to create async database engine: %s", e)
+            raise
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+def _reset_pools_after_fork():
+    # Connections inherited from the parent (e.g. gunicorn --preload) must not be shared
+    # with it; drop them without closing so the parent's sockets stay intact
+    if engine is not None:
+        engine.dispose(close=False)
+    if async_engine is not None:
+        async_engine.sync_engine.dispose(close=False)
+    shard_router.reset_after_fork()
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+def pool_status(db_engine) -> dict:
+    """Checked-out/overflow counters of an engine's pool, for the /health/db probe."""
+    pool = db_engine.pool
+    status = {"pool": type(pool).__name__}
+    for counter in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, counter):
+            status[counter] = getattr(pool, counter)()
+    return status
+
 # Base class for models
 Base = declarative_base()
 
 # Dependency to get DB session
 def get_db():
+    get_engine()
     db = SessionLocal()
     logger.debug("Database session opened")
     try:
@@ -42,3 +165,194 @@ def get_db():
     finally:
         db.close()
         logger.debug("Database session closed")
+
+class SyncSessionAdapter:
+    """Awaitable facade over a sync Session for the DB_ASYNC=0 fallback.
+
+    Exposes the subset of the AsyncSession API used by the routers and runs each
+    blocking call in the threadpool, so handlers are written once against
+    `await db.execute(...)` and never block the event loop in either mode.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    @property
+    def bind(self):
+        return self.sync_session.get_bind()
+
+    async def execute(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, *args, **kwargs)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    def expunge(self, instance):
+        self.sync_session.expunge(instance)
+
+# Dependency used by the routers: AsyncSession, or the sync session behind an adapter
+async def get_session():
+    if DB_ASYNC:
+        get_async_engine()
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    get_engine()
+    db = SyncSessionAdapter(SessionLocal())
+    logger.debug("Database session opened (sync fallback)")
+    try:
+        yield db
+    finally:
+        await db.close()
+        logger.debug("Database session closed")
+
+# Session for work outside a request (background tasks), same mode as get_session;
+# given a store table (or a shard name), the session is on the database holding it
+@asynccontextmanager
+async def session_scope(table_name: str | None = None, shard: str | None = None):
+    if shard is None:
+        shard = DEFAULT_SHARD if table_name is None else shard_router.shard_for(table_name)
+    if DB_ASYNC:
+        if shard == DEFAULT_SHARD:
+            get_async_engine()
+            session_factory = AsyncSessionLocal
+        else:
+            session_factory = shard_router.async_session_factory(shard)
+        async with session_factory() as db:
+            yield db
+        return
+    if shard == DEFAULT_SHARD:
+        get_engine()
+        session_factory = SessionLocal
+    else:
+        session_factory = shard_router.session_factory(shard)
+    db = SyncSessionAdapter(session_factory())
+    try:
+        yield db
+    finally:
+        await db.close()
+
+# Session for queries on a store table: the request's own session when the table is on
+# the primary database, else one on the table's shard for the duration of the block
+@asynccontextmanager
+async def store_session(db, table_name: str):
+    if shard_router.is_default(table_name):
+        yield db
+        return
+    async with session_scope(table_name) as shard_db:
+        yield shard_db
+
+def database_names() -> list[str]:
+    """The primary database plus every configured shard."""
+    return [DEFAULT_SHARD, *shard_router.shards]
+
+async def warm_up_engines(connections: int | None = None):
+    """Create the primary engines and open `connections` pooled connections on the one serving requests.
+
+    The connections are opened concurrently and returned to the pool, so the first
+    requests after a (re)start find them ready. A database that is down is logged,
+    not raised: the app still starts and /health/db reports it.
+    """
+    get_engine()
+    connections = DB_POOL_WARMUP if connections is None else connections
+    if connections <= 0:
+        return
+    try:
+        if DB_ASYNC:
+            await _open_async_connections(get_async_engine(), connections)
+        else:
+            await run_in_threadpool(_open_connections, engine, connections)
+        logger.info("Warmed up %s database connection(s)", connections)
+    except Exception as e:
+        logger.error("Database warm-up failed: %s", e)
+
+async def _open_async_connections(db_engine, connections: int):
+    # Held open together, so the pool ends up keeping `connections` of them
+    async with AsyncExitStack() as stack:
+        opened = await asyncio.gather(*(stack.enter_async_context(db_engine.connect()) for _ in range(connections)))
+        await asyncio.gather(*(conn.exec_driver_sql("SELECT 1") for conn in opened))
+
+def _open_connections(db_engine, connections: int):
+    with ExitStack() as stack:
+        for _ in range(connections):
+            stack.enter_context(db_engine.connect()).exec_driver_sql("SELECT 1")
+
+async def dispose_engines():
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        engine.dispose()
+    await shard_router.dispose()
+    logger.info("Database engines disposed")
+
+# Dependency returning the reCAPTCHA verifier created at startup in app.main
+def get_recaptcha_verifier(request: Request):
+    return request.app.state.recaptcha
+
+# Dependency returning the per-store slot pools created at startup (None when SLOT_POOL_ENABLED=0)
+def get_slot_pools(request: Request):
+    return request.app.state.slot_pools
+
+# Dependency returning the per-store phone filters (None when PHONE_FILTER_ENABLED=0)
+def get_phone_filters(request: Request):
+    return request.app.state.phone_filters
+
+# Dependency returning the rate limiter (None when RATE_LIMIT_ENABLED=0)
+def get_rate_limiter(request: Request):
+    return request.app.state.rate_limiter
+
+# Clients behind our own proxy all share its address unless the forwarded one is trusted.
+# Only the entries appended by our own proxies can be trusted: the client controls the rest,
+# so the address is taken RATE_LIMIT_TRUSTED_HOPS entries from the right
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0").lower() in ("1", "true", "yes")
+RATE_LIMIT_TRUSTED_HOPS = int(os.getenv("RATE_LIMIT_TRUSTED_HOPS", "1"))
+
+def client_ip(request: Request) -> str | None:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",") if entry.strip()]
+        if forwarded:
+            return forwarded[-min(max(RATE_LIMIT_TRUSTED_HOPS, 1), len(forwarded))]
+    return request.client.host if request.client else None
+
+# Route dependency: answers 429 before the handler opens a session or calls reCAPTCHA
+async def enforce_rate_limit(request: Request):
+    limiter = request.app.state.rate_limiter
+    if limiter is None:
+        return
+    retry_after = await limiter.check(client_ip(request), request.path_params.get("token"))
+    if retry_after > 0:
+        logger.warning("Rate limited %s %s from %s", request.method, request.url.path, client_ip(request))
+        raise HTTPException(status_code=429, detail="Too many requests, please retry later",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+
+# Dependency guarding the /admin endpoints with a shared API key
+ADMIN_API_KEY = settings.admin_api_key
+
+def require_admin(x_admin_key: str | None = Header(default=None)):
+    if not ADMIN_API_KEY:
+        logger.warning("Admin endpoint called but ADMIN_API_KEY is not configured")
+        raise HTTPException(status_code=403, detail="Admin API disabled")
+    if not x_admin_key or not secrets.compare_digest(x_admin_key, ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+# Dependency guarding /metrics: scrapers send METRICS_TOKEN as a bearer token, operators may use the admin key
+METRICS_TOKEN = settings.metrics_token
+
+def require_metrics_access(authorization: str | None = Header(default=None),
+                           x_admin_key: str | None = Header(default=None)):
+    scheme, _, token = (authorization or "").partition(" ")
+    if METRICS_TOKEN and scheme.lower() == "bearer" and secrets.compare_digest(token.strip().encode(), METRICS_TOKEN.encode()):
+        return
+    require_admin(x_admin_key)
@@ -1,49 +1,121 @@
 # app/main.py
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse  # Add this import
-from app.routers import vip
+from fastapi.responses import JSONResponse, RedirectResponse
+from app.settings import get_settings
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("app.log"),  # Log to a file
-        logging.StreamHandler()          # Also log to console
-    ]
-)
+# Configure logging (queue-based, see app/logging_config.py; set up by create_app)
 logger = logging.getLogger(__name__)
 
-# Initialize FastAPI app
-app = FastAPI(title="Registration")
 
-# Mount static files and templates
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+def create_app() -> FastAPI:
+    """Build the application: check settings, set up logging, mount routes and lifecycle hooks.
 
-# Include routers
-app.include_router(vip.router)
+    Routers and services are imported here rather than at module level, so importing
+    app.main stays cheap for tools; long-lived components and database connections
+    are created by the startup hook. Run with `uvicorn --factory app.main:create_app`
+    (or `uvicorn app.main:app`, which builds the app on first access).
+    """
+    settings = get_settings()
+    settings.validate()
 
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Application starting up...")
+    from app.dependencies import database_names, dispose_engines, session_scope, store_session, warm_up_engines
+    from app.logging_config import setup_logging
+    from app.routers import admin, health, metrics, vip
+    from app.services.compression import PrecompressedStaticFiles
+    from app.services.idempotency import IDEMPOTENCY_ENABLED, IdempotencyStore
+    from app.services.metrics import METRICS_ENABLED, MetricsMiddleware, record_error
+    from app.services.outbox import create_outbox_worker
+    from app.services.phone_filter import create_phone_filters
+    from app.services.phones import check_phone_indexes
+    from app.services.rate_limit import create_rate_limiter
+    from app.services.recaptcha import create_recaptcha_verifier
+    from app.services.slot_pool import SLOT_POOL_ENABLED, SlotPoolManager
+    from app.services.store_tables import load_store_tables
+    from app.services.workers import WorkerPoolSaturated, create_worker_pool
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("Application shutting down...")
+    setup_logging()
 
-# # Root endpoint for testing
-# @app.get("/")
-# async def root():
-#     logger.info("Root endpoint accessed")
-#     return {"message": "Welcome to Registraction"}
+    # Initialize FastAPI app
+    app = FastAPI(title="Registration")
 
-# Updated root endpoint to redirect to registration
-@app.get("/")
-async def root():
-    logger.info("Root endpoint accessed, redirecting to /vip/register")
-    return RedirectResponse(url="/vip/register")
-
+    # Mount static files (templates are loaded by the routers rendering them)
+    app.mount("/static", PrecompressedStaticFiles(directory="app/static"), name="static")
+
+    # Include routers
+    app.include_router(vip.router)
+    app.include_router(admin.router)
+    app.include_router(health.router)
+    if METRICS_ENABLED:
+        app.include_router(metrics.router)
+        app.add_middleware(MetricsMiddleware)
+
+    @app.on_event("startup")
+    async def startup_event():
+        logger.info("Application starting up...")
+        # Connect before anything else queries, so the first requests find warm pools
+        await warm_up_engines()
+        app.state.recaptcha = create_recaptcha_verifier()
+        app.state.rate_limiter = create_rate_limiter()
+        app.state.idempotency = IdempotencyStore() if IDEMPOTENCY_ENABLED else None
+        app.state.slot_pools = SlotPoolManager(session_scope) if SLOT_POOL_ENABLED else None
+        app.state.workers = create_worker_pool()
+        await vip.prerender_pages(app)
+        app.state.phone_filters = create_phone_filters(session_scope)
+        app.state.outbox = create_outbox_worker(session_scope, database_names)
+        if app.state.outbox is not None:
+            await app.state.outbox.start()
+        try:
+            async with session_scope() as db:
+                await load_store_tables(db, store_session)
+        except Exception as e:
+            logger.error("Loading store tables failed: %s", e)
+        if settings.check_phone_indexes:
+            try:
+                async with session_scope() as db:
+                    await check_phone_indexes(db, store_session)
+            except Exception as e:
+                logger.error("Phone index check failed: %s", e)
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        logger.info("Application shutting down...")
+        await app.state.recaptcha.aclose()
+        if app.state.rate_limiter is not None:
+            await app.state.rate_limiter.aclose()
+        if app.state.slot_pools is not None:
+            await app.state.slot_pools.aclose()
+        app.state.workers.shutdown()
+        if app.state.phone_filters is not None:
+            await app.state.phone_filters.aclose()
+        if app.state.outbox is not None:
+            await app.state.outbox.aclose()
+        await dispose_engines()
+
+    # CPU-heavy work is shed with a cheap 503 when the worker pool queue is full
+    @app.exception_handler(WorkerPoolSaturated)
+    async def worker_pool_saturated_handler(request, exc):
+        record_error("worker_pool_saturated")
+        return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"},
+                            headers={"Retry-After": "1"})
+
+    # Updated root endpoint to redirect to registration
+    @app.get("/")
+    async def root():
+        logger.info("Root endpoint accessed, redirecting to /vip/register")
+        return RedirectResponse(url="/vip/register")
+
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # `app.main:app` (uvicorn, tests) builds the application on first access, once per process
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,32 @@
+# app/models/outbox.py
+from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime, Index
+from app.dependencies import Base
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class OutboxEvent(Base):
+    """Side effect of a registration (welcome SMS, email, ...) waiting to be carried out.
+
+    Rows are written in the same transaction as the card they belong to, so they live
+    on the same database as the store table; each database has its own outbox.
+    """
+    __tablename__ = "registration_outbox"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    kind = Column(String(32), nullable=False)  # e.g. welcome_sms, welcome_email
+    store_table = Column(String(64), nullable=False)
+    IDvip = Column(BigInteger, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String(16), nullable=False, default="pending")  # pending, sent, logged, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("idx_registration_outbox_due", "status", "next_attempt_at"),)
+
+    def __repr__(self):
+        return f"<OutboxEvent(id={self.id}, kind={self.kind}, IDvip={self.IDvip}, status={self.status})>"
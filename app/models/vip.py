@@ -1,5 +1,6 @@
 # app/models/vip.py
-from sqlalchemy import Column, BigInteger, String, Integer, Boolean, DECIMAL, TIMESTAMP, LargeBinary
+from sqlalchemy import Column, BigInteger, String, Integer, Boolean, DECIMAL, TIMESTAMP, LargeBinary, Table
+from sqlalchemy.orm import deferred
 from app.dependencies import Base
 import logging
 
@@ -49,7 +50,7 @@ class Vip(Base):
     un = Column(String(255), default="")
     lotteria = Column(String(20), default="")
     statoanno = Column(String(10), default="")
-    img = Column(LargeBinary, nullable=True)  # mediumblob for images
+    img = deferred(Column(LargeBinary, nullable=True))  # mediumblob for images, only loaded on access
     n = Column(String(255), default="")
     SCOscadenza = Column(String(20), default="")
     stato = Column(Boolean, default=False)  # tinyint as Boolean
@@ -57,4 +58,19 @@ class Vip(Base):
     def __repr__(self):
         return f"<Vip(IDvip={self.IDvip}, code={self.code}, cellulare={self.cellulare}, stato={self.stato})>"
 
-logger.info("Vip model defined")
+# Columns the registration flow never needs; left out of default projections
+HEAVY_COLUMNS = frozenset(
+    attr.key for attr in Vip.__mapper__.column_attrs if attr.deferred
+)
+
+def vip_columns(table: Table, *columns: str) -> list:
+    """Columns of a store table to select, checked against the Vip model.
+
+    With no arguments, every column except the heavy (deferred) ones.
+    """
+    if not columns:
+        columns = tuple(c.name for c in Vip.__table__.columns if c.name not in HEAVY_COLUMNS)
+    for name in columns:
+        if name not in Vip.__table__.columns:
+            raise ValueError(f"Unknown Vip column: {name}")
+    return [table.c[name] for name in columns]
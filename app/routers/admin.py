@@ -0,0 +1,186 @@
+# app/routers/admin.py
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import dependencies
+from app.dependencies import (
+    get_phone_filters, get_session, get_slot_pools, require_admin, session_scope, store_session,
+)
+from app.routers.vip import NDJSON_CONTENT_TYPES, get_table_name_from_token
+from app.services.members import (
+    csv_lines, export_members, import_members, iter_csv_rows, iter_ndjson_rows, ndjson_lines, reject_record,
+)
+from app.services.page_cache import page_cache
+from app.services.phones import check_phone_indexes
+from app.services.slots import SlotContention
+from app.services.store_cache import store_cache
+from app.services.store_tables import store_table, store_tables
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rejected rows echoed back by one import call; the counters cover all of them
+IMPORT_REJECTS_REPORTED = int(os.getenv("IMPORT_REJECTS_REPORTED", "1000"))
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+@router.get("/cache/stores", response_model=dict)
+async def store_cache_stats():
+    return store_cache.stats()
+
+# The store cache is per process: these only clear the worker answering the call, the
+# others drop their copy when it expires (STORE_CACHE_TTL)
+@router.delete("/cache/stores", response_model=dict)
+async def clear_store_cache():
+    return {"invalidated": store_cache.clear()}
+
+@router.delete("/cache/stores/by-id/{id_negozio}", response_model=dict)
+async def invalidate_store(id_negozio: int):
+    # Call this after deactivating a store so its tokens stop resolving immediately
+    return {"invalidated": store_cache.invalidate_store(id_negozio)}
+
+@router.delete("/cache/stores/{token}", response_model=dict)
+async def invalidate_token(token: str):
+    return {"invalidated": int(store_cache.invalidate(token))}
+
+@router.get("/cache/pages", response_model=dict)
+async def page_cache_stats():
+    return page_cache.stats()
+
+@router.delete("/cache/pages", response_model=dict)
+async def clear_page_cache():
+    return {"invalidated": page_cache.clear()}
+
+@router.get("/cache/tables", response_model=dict)
+async def store_table_stats():
+    return store_tables.stats()
+
+@router.get("/slots", response_model=dict)
+async def slot_pool_stats(slot_pools=Depends(get_slot_pools)):
+    if slot_pools is None:
+        raise HTTPException(status_code=404, detail="Slot pools are disabled")
+    return slot_pools.stats()
+
+@router.get("/stores/{token}/stock", response_model=dict)
+async def store_stock(token: str, db: AsyncSession = Depends(get_session), slot_pools=Depends(get_slot_pools)):
+    # Exact count of free cards, for when the pool's low-stock estimate needs confirming
+    table_name = await get_table_name_from_token(token, db)
+    async with store_session(db, table_name) as store_db:
+        table = store_table(table_name)
+        query = select(func.count()).select_from(table).where(table.c.stato == 1)
+        free = (await store_db.execute(query)).scalar()
+    pool = slot_pools.pool(table_name).stats() if slot_pools is not None else None
+    return {"table": table_name, "free": free, "pool": pool}
+
+@router.delete("/slots/{table_name}", response_model=dict)
+async def reset_slot_pool(table_name: str, slot_pools=Depends(get_slot_pools)):
+    # Forget prefetched cards, e.g. after a new batch of cards was loaded into the table
+    if slot_pools is not None:
+        slot_pools.invalidate(table_name)
+    return {"reset": table_name}
+
+@router.get("/idempotency", response_model=dict)
+async def idempotency_stats(request: Request):
+    store = request.app.state.idempotency
+    if store is None:
+        raise HTTPException(status_code=404, detail="Idempotent registration is disabled")
+    return store.stats()
+
+@router.get("/rate-limits", response_model=dict)
+async def rate_limit_stats(request: Request):
+    limiter = request.app.state.rate_limiter
+    if limiter is None:
+        raise HTTPException(status_code=404, detail="Rate limiting is disabled")
+    return limiter.stats()
+
+@router.get("/shards", response_model=dict)
+async def shard_stats():
+    # Which shard each store table seen by this worker was routed to, and which shard pools are open
+    return dependencies.shard_router.stats()
+
+@router.get("/outbox", response_model=dict)
+async def outbox_stats(request: Request):
+    # Delivery counters of this worker, plus pending/dead events per database
+    outbox = request.app.state.outbox
+    if outbox is None:
+        raise HTTPException(status_code=404, detail="The outbox is disabled")
+    return {**outbox.stats(), "backlog": await outbox.backlog()}
+
+@router.post("/outbox/{database}/requeue", response_model=dict)
+async def requeue_outbox(request: Request, database: str):
+    # Retry dead events, e.g. once a gateway outage or misconfiguration is fixed
+    outbox = request.app.state.outbox
+    if outbox is None:
+        raise HTTPException(status_code=404, detail="The outbox is disabled")
+    if database not in dependencies.database_names():
+        raise HTTPException(status_code=404, detail=f"Unknown database: {database}")
+    return {"database": database, "requeued": await outbox.requeue_dead(database)}
+
+@router.get("/workers", response_model=dict)
+async def worker_pool_stats(request: Request):
+    return request.app.state.workers.stats()
+
+@router.get("/stores/phone-indexes", response_model=dict)
+async def phone_indexes(db: AsyncSession = Depends(get_session)):
+    # Store tables mapped to whether cellulare is indexed; missing ones are also logged as warnings
+    return await check_phone_indexes(db, store_session)
+
+@router.get("/phone-filters", response_model=dict)
+async def phone_filter_stats(phone_filters=Depends(get_phone_filters)):
+    # Per-store size, memory footprint and expected false-positive rate
+    if phone_filters is None:
+        raise HTTPException(status_code=404, detail="Phone filters are disabled")
+    return phone_filters.stats()
+
+@router.post("/stores/{token}/members/import", response_model=dict)
+async def import_store_members(request: Request, token: str, skip: int = 0, db: AsyncSession = Depends(get_session),
+                               slot_pools=Depends(get_slot_pools), phone_filters=Depends(get_phone_filters)):
+    """Stream a CSV (default) or NDJSON member list into the store's free cards.
+
+    Pass the returned `rows_done` as `skip` to resume an import that stopped early.
+    """
+    table_name = await get_table_name_from_token(token, db)
+    if request.headers.get("content-type", "").startswith(NDJSON_CONTENT_TYPES):
+        rows = iter_ndjson_rows(request.stream())
+    else:
+        rows = iter_csv_rows(request.stream())
+
+    rejects = []
+    async def collect(progress, batch_rejects):
+        room = IMPORT_REJECTS_REPORTED - len(rejects)
+        rejects.extend(reject_record(*reject) for reject in batch_rejects[:max(room, 0)])
+
+    try:
+        async with store_session(db, table_name) as store_db:
+            progress = await import_members(store_db, table_name, rows, skip=skip, on_batch=collect)
+    except SlotContention:
+        raise HTTPException(status_code=503, detail="Registration busy, please retry")
+    finally:
+        # Imported numbers and claimed cards are not known to the per-worker caches
+        if slot_pools is not None:
+            slot_pools.invalidate(table_name)
+        if phone_filters is not None:
+            phone_filters.invalidate(table_name)
+    return {"table": table_name, **progress.to_dict(), "rejects": rejects}
+
+@router.get("/stores/{token}/members/export")
+async def export_store_members(token: str, format: str = "csv", claimed_only: bool = True,
+                               db: AsyncSession = Depends(get_session)):
+    """Stream the store's members (or every card with claimed_only=false) as CSV or NDJSON."""
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    table_name = await get_table_name_from_token(token, db)
+
+    async def body():
+        # The request session is closed before the body streams, so use our own
+        async with session_scope(table_name) as export_db:
+            rows = export_members(export_db, table_name, claimed_only=claimed_only)
+            async for chunk in (csv_lines(rows) if format == "csv" else ndjson_lines(rows)):
+                yield chunk
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{table_name}.{format}"'}
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
@@ -0,0 +1,38 @@
+# app/routers/health.py
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import dependencies
+from app.dependencies import get_session, pool_status
+import logging
+import os
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+@router.get("/db")
+async def health_db(db: AsyncSession = Depends(get_session)):
+    """Round-trip to the database plus this worker's pool counters."""
+    started = time.perf_counter()
+    try:
+        await db.execute(text("SELECT 1"))
+        status_code, status = 200, "ok"
+    except Exception as e:
+        logger.error("Database health check failed: %s", e)
+        status_code, status = 503, "unavailable"
+
+    pools = {"sync": pool_status(dependencies.get_engine())}
+    if dependencies.async_engine is not None:
+        pools["async"] = pool_status(dependencies.async_engine.sync_engine)
+    for shard, kind, engine in dependencies.shard_router.engines():
+        pools[f"{shard}:{kind}"] = pool_status(engine)
+    return JSONResponse(status_code=status_code, content={
+        "status": status,
+        "latency_ms": round(1000 * (time.perf_counter() - started), 2),
+        "pid": os.getpid(),
+        "pools": pools,
+    })
@@ -0,0 +1,19 @@
+# app/routers/metrics.py
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import Response
+from app.dependencies import require_metrics_access
+from app.services.metrics import CONTENT_TYPE, render_metrics
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_access)])
+async def metrics(request: Request):
+    """Prometheus text exposition of this worker's request, stage, DB and cache metrics.
+
+    Labels name store tables, so scrapers need METRICS_TOKEN (or the admin key).
+    """
+    return Response(render_metrics(request.app.state), media_type=CONTENT_TYPE)
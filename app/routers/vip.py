@@ -1,105 +1,295 @@
 # app/routers/vip.py
 from fastapi import APIRouter, Depends, HTTPException, Request, Form
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.dependencies import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from app.dependencies import (
+    enforce_rate_limit, get_phone_filters, get_recaptcha_verifier, get_session, get_slot_pools, session_scope,
+    store_session,
+)
 from app.models.vip import Vip  # Note: We'll need to handle dynamic tables
 from app.models.cliente import Cliente
-from app.schemas.vip import VipCheckPhone, VipResponse
-from fastapi.responses import HTMLResponse
+from app.schemas.vip import VipCheckPhone, VipCheckPhones, VipResponse, normalize_phone
+from app.services.barcodes import BARCODE_FORMAT, BARCODE_MAX_AGE, MEDIA_TYPES, barcode_cache, barcode_etag, render_barcode
+from app.services.compression import etag_matches
+from app.services.idempotency import fingerprint
+from app.services.metrics import StageTimer, record_error
+from app.services.outbox import registration_events, write_events
+from app.services.page_cache import CachedPage, page_cache
+from app.services.phone_filter import PhoneFilterRegistry
+from app.services.phones import PHONE_LOOKUP_CHUNK, chunked, find_existing_phones, phone_exists
+from app.services.recaptcha import RecaptchaOverloaded, RecaptchaUnavailable, RecaptchaVerifier
+from app.services.shards import InvalidStoreTable, validate_table_name
+from app.services.slot_pool import SlotPoolManager
+from app.services.slots import NoFreeSlot, SlotContention, claim_slot, claimed_card_exists
+from app.services.store_cache import store_cache, token_expires_in
+from app.services.workers import WorkerPoolSaturated
+from app.settings import get_settings
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from pydantic import ValidationError
+from typing import NamedTuple
+import functools
+import json
 import logging
-from barcode import Code128
-from barcode.writer import ImageWriter
 import os
 import re
-import requests
-from dotenv import load_dotenv
-from io import BytesIO
-import base64
 
 # Configure logging
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
-# Load environment variables
-load_dotenv()
-RECAPTCHA_SECRET_KEY = os.getenv("RECAPTCHA_SECRET_KEY")
-RECAPTCHA_SITE_KEY = os.getenv("RECAPTCHA_SITE_KEY")
+# Rendered into the form; presence of the keys is checked by create_app()
+RECAPTCHA_SITE_KEY = get_settings().recaptcha_site_key
 
-if not RECAPTCHA_SECRET_KEY or not RECAPTCHA_SITE_KEY:
-    logger.error("reCAPTCHA keys not found in environment variables")
-    raise ValueError("RECAPTCHA_SITE_KEY and RECAPTCHA_SECRET_KEY are required")
+# Upper bound on distinct numbers accepted by one bulk phone check
+BULK_CHECK_MAX = int(os.getenv("BULK_CHECK_MAX", "50000"))
+# Longest NDJSON line (bytes) a bulk phone check buffers; a number or {"cellulare": ...} needs far less
+BULK_CHECK_MAX_LINE = int(os.getenv("BULK_CHECK_MAX_LINE", "1024"))
 
 router = APIRouter(prefix="/vip", tags=["vip"])
 templates = Jinja2Templates(directory="app/templates")
 
-# Helper function to get the table name from token
-def get_table_name_from_token(token: str, db: Session) -> str:
-    query = text("SELECT dbnome FROM cliente WHERE token_registrazione = :token AND active = 1")
-    result = db.execute(query, {"token": token}).fetchone()
-    if not result:
-        logger.error(f"No active store found for token: {token}")
+async def render_template(name: str, context: dict) -> HTMLResponse:
+    """Render a template on the worker pool instead of the event loop thread."""
+    workers = context["request"].app.state.workers
+    html = await workers.run(templates.get_template(name).render, context, thread_only=True)
+    return HTMLResponse(html)
+
+def _render_page(name: str, context: dict) -> CachedPage:
+    return CachedPage(templates.get_template(name).render(context))
+
+# Form variants that don't echo user input, cached as rendered (and compressed) pages
+INVALID_TOKEN_PAGE = ("register.html", "invalid-token")
+
+def register_form_context(request: Request, token: str | None = None, warning: str | None = None) -> dict:
+    context = {"request": request, "warning": warning, "form_data": {}, "recaptcha_site_key": RECAPTCHA_SITE_KEY}
+    if token is not None:
+        context["token"] = token
+    return context
+
+async def cached_page(request: Request, key, context: dict) -> CachedPage:
+    """The page cached under `key`, rendering it on the worker pool on a miss."""
+    page = page_cache.get(key)
+    if page is None:
+        page = page_cache.set(key, await request.app.state.workers.run(_render_page, key[0], context, thread_only=True))
+    return page
+
+async def prerender_pages(app):
+    """Render the shared warning variants at startup, before the first burst arrives."""
+    scope = {"type": "http", "app": app, "headers": []}
+    request = Request(scope)
+    await cached_page(request, INVALID_TOKEN_PAGE, register_form_context(request, warning="Invalid or inactive store token"))
+
+# Helper function to resolve a token to its store, going through the store cache
+async def get_store_from_token(token: str, db: AsyncSession) -> Cliente:
+    found, cliente = store_cache.get(token)
+    if not found:
+        query = select(Cliente).where(Cliente.token_registrazione == token, Cliente.active == 1)
+        cliente = (await db.execute(query)).scalar_one_or_none()
+        if cliente is not None:
+            try:
+                validate_table_name(cliente.dbnome)
+            except InvalidStoreTable as e:
+                # The name would end up in SQL; treat the store as unusable until it is fixed
+                logger.error("Store %s is misconfigured: %s", cliente.id_negozio, e)
+                cliente = None
+        if cliente is None:
+            store_cache.set_missing(token)
+        else:
+            db.expunge(cliente)  # Detach so the row can be shared across sessions
+            store_cache.set(token, cliente)
+
+    if cliente is None:
+        logger.error("No active store found for token: %s", token)
         raise HTTPException(status_code=404, detail="Store not found or inactive")
-    table_name = result[0]
-    logger.info(f"Resolved token {token} to table name: {table_name}")
+
+    remaining = token_expires_in(cliente)
+    if remaining is not None and remaining <= 0:
+        logger.error("Registration token expired for store %s: %s", cliente.id_negozio, token)
+        raise HTTPException(status_code=404, detail="Store not found or inactive")
+    return cliente
+
+# Helper function to get the table name from token
+async def get_table_name_from_token(token: str, db: AsyncSession) -> str:
+    table_name = (await get_store_from_token(token, db)).dbnome
+    logger.info("Resolved token %s to table name: %s", token, table_name)
     return table_name
 
-@router.post("/{token}/check-phone", response_model=dict)
-async def check_phone(token: str, phone: VipCheckPhone, db: Session = Depends(get_db)):
-    logger.info(f"Starting phone check for token: {token}, phone: {phone.cellulare}")
+@router.post("/{token}/check-phone", response_model=dict, dependencies=[Depends(enforce_rate_limit)])
+async def check_phone(token: str, phone: VipCheckPhone, db: AsyncSession = Depends(get_session),
+                      phone_filters: PhoneFilterRegistry | None = Depends(get_phone_filters)):
+    logger.info("Starting phone check for token: %s, phone: %s", token, phone.cellulare)
+    stages = StageTimer("check_phone")
 
     # Step 1: Store Identification
     try:
-        table_name = get_table_name_from_token(token, db)
+        table_name = await get_table_name_from_token(token, db)
     except HTTPException as e:
-        logger.error(f"Store identification failed: {str(e)}")
+        logger.error("Store identification failed: %s", e)
         raise e
+    stages.lap("store")
 
-    # Step 2: Check if phone exists in the store's table
-    query = text(f"SELECT 1 FROM {table_name} WHERE cellulare = :cellulare LIMIT 1")
-    result = db.execute(query, {"cellulare": phone.cellulare}).fetchone()
-    exists = bool(result)
+    # Step 2: Check if phone exists in the store's table, unless the store's filter rules it out
+    if phone_filters is not None and not phone_filters.might_contain(table_name, phone.cellulare):
+        exists = False
+    else:
+        async with store_session(db, table_name) as store_db:
+            exists = await phone_exists(store_db, table_name, phone.cellulare)
+    stages.lap("lookup")
 
     if exists:
-        logger.debug(f"Phone number {phone.cellulare} found in table {table_name}")
+        logger.debug("Phone number %s found in table %s", phone.cellulare, table_name)
     else:
-        logger.debug(f"Phone number {phone.cellulare} not found in table {table_name}")
+        logger.debug("Phone number %s not found in table %s", phone.cellulare, table_name)
 
     return {"exists": exists}
 
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+
+def _ndjson_number(line: bytes):
+    # Each line is a JSON string/number or an object with a "cellulare" field
+    try:
+        value = json.loads(line)
+    except ValueError:
+        return line.decode("utf-8", "replace")
+    if isinstance(value, dict):
+        value = value.get("cellulare")
+    return value
+
+async def _iter_bulk_numbers(request: Request):
+    """Yield raw numbers from a JSON {"numbers": [...]} body or an NDJSON stream, parsed as it arrives."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(NDJSON_CONTENT_TYPES):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            if len(buffer) > BULK_CHECK_MAX_LINE or any(len(line) > BULK_CHECK_MAX_LINE for line in lines):
+                raise HTTPException(status_code=413, detail=f"Lines are limited to {BULK_CHECK_MAX_LINE} bytes")
+            for line in lines:
+                if line.strip():
+                    yield _ndjson_number(line)
+        if buffer.strip():
+            yield _ndjson_number(buffer)
+        return
+
+    try:
+        body = VipCheckPhones.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    for number in body.numbers:
+        yield number
+
+@router.post("/{token}/check-phones", dependencies=[Depends(enforce_rate_limit)])
+async def check_phones(request: Request, token: str, db: AsyncSession = Depends(get_session),
+                       phone_filters: PhoneFilterRegistry | None = Depends(get_phone_filters)):
+    """Bulk variant of check-phone; streams one NDJSON result line per distinct number."""
+    table_name = await get_table_name_from_token(token, db)
+
+    numbers, seen, invalid = [], set(), []
+    async for raw in _iter_bulk_numbers(request):
+        try:
+            number = normalize_phone(str(raw))
+        except ValueError:
+            number = None
+        if number in seen:
+            continue
+        # Invalid entries are echoed back one line each, so they count toward the limit too
+        if len(numbers) + len(invalid) >= BULK_CHECK_MAX:
+            raise HTTPException(status_code=413, detail=f"At most {BULK_CHECK_MAX} numbers per request")
+        if number is None:
+            invalid.append(raw)
+            continue
+        seen.add(number)
+        numbers.append(number)
+    logger.info("Bulk phone check for token %s: %s number(s), %s invalid", token, len(numbers), len(invalid))
+
+    async def results():
+        for raw in invalid:
+            yield json.dumps({"input": raw, "error": "Cellulare must be a 10-digit Italian number"}) + "\n"
+        # The request session is closed before the body streams, so use our own
+        async with session_scope(table_name) as stream_db:
+            for chunk in chunked(numbers, PHONE_LOOKUP_CHUNK):
+                candidates = chunk
+                if phone_filters is not None:
+                    candidates = [n for n in chunk if phone_filters.might_contain(table_name, n)]
+                existing = await find_existing_phones(stream_db, table_name, candidates) if candidates else set()
+                yield "".join(json.dumps({"cellulare": n, "exists": n in existing}) + "\n" for n in chunk)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @router.get("/{token}/register", response_class=HTMLResponse)
-async def get_register_form(request: Request, token: str, db: Session = Depends(get_db)):
-    logger.info(f"Rendering registration form for token: {token}")
+async def get_register_form(request: Request, token: str, db: AsyncSession = Depends(get_session)):
+    logger.info("Rendering registration form for token: %s", token)
 
-    # Verify token exists
+    # Verify token exists (a store cache hit when the token is hot)
     try:
-        get_table_name_from_token(token, db)
+        await get_table_name_from_token(token, db)
     except HTTPException as e:
-        logger.error(f"Invalid token {token}: {str(e)}")
-        return templates.TemplateResponse(
-            "register.html",
-            {
-                "request": request,
-                "warning": "Invalid or inactive store token",
-                "form_data": {},
-                "recaptcha_site_key": RECAPTCHA_SITE_KEY
-            }
-        )
+        logger.error("Invalid token %s: %s", token, e)
+        page = await cached_page(request, INVALID_TOKEN_PAGE,
+                                 register_form_context(request, warning="Invalid or inactive store token"))
+        return page.response(request)
 
-    return templates.TemplateResponse(
-        "register.html",
-        {
-            "request": request,
-            "warning": None,
-            "form_data": {},
-            "recaptcha_site_key": RECAPTCHA_SITE_KEY,
-            "token": token  # Pass token to template if needed
-        }
-    )
+    # The empty form only varies by token, so repeat GETs are served from the page cache
+    page = await cached_page(request, ("register.html", "form", token), register_form_context(request, token))
+    return page.response(request)
+
+class CompletedRegistration(NamedTuple):
+    """What a duplicate submission is answered with: the card handed out and its rendered dashboard."""
+    IDvip: int
+    code: str
+    barcode_url: str
+    html: bytes
+
+# Longest client-supplied idempotency key accepted; longer ones are ignored
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+def registration_key(token: str, idempotency_key: str | None):
+    """The client's key (register.html generates one per form load), or None.
+
+    Only this unguessable key identifies a retry: the same phone and name posted by
+    someone else must get "already registered", never the member's card.
+    """
+    if idempotency_key and len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        return ("key", token, idempotency_key)
+    return None
+
+def idempotent_registration(handler):
+    """Answer repeated submissions of the same registration with the first one's result.
+
+    A double-tapped submit waits for the request already in flight, and a retry after
+    it completed gets the stored dashboard at once, instead of running reCAPTCHA and
+    the duplicate check again and ending on "already registered". Only submissions
+    carrying the client's idempotency key are matched; submissions without one, or
+    whose values differ from the original, are handled normally.
+    """
+    @functools.wraps(handler)
+    async def wrapper(**kwargs):
+        request = kwargs["request"]
+        store = request.app.state.idempotency
+        key = registration_key(kwargs["token"], kwargs["idempotency_key"])
+        if store is None or key is None:
+            return await handler(**kwargs)
+
+        try:
+            phone = normalize_phone(kwargs["cellulare"])
+        except ValueError:
+            return await handler(**kwargs)
+        submitted = fingerprint(kwargs["token"], phone, *(kwargs[field] for field in (
+            "Nome", "cognome", "nascita", "Email", "Indirizzo", "Citta", "Prov", "Cap", "sms", "omail")))
+        def keep(response):
+            return getattr(request.state, "registration", None)
+
+        result, replayed = await store.run(key, submitted, lambda: handler(**kwargs), keep)
+        if replayed:
+            logger.info("Replaying registration of IDvip %s for token %s", result.IDvip, kwargs["token"])
+            return HTMLResponse(result.html)
+        return result
+    return wrapper
 
 # Replace the register_vip function in app/routers/vip.py with this version
-@router.post("/{token}/register", response_class=HTMLResponse)
+@router.post("/{token}/register", response_class=HTMLResponse, dependencies=[Depends(enforce_rate_limit)])
+@idempotent_registration
 async def register_vip(
     request: Request,
     token: str,
@@ -112,21 +302,51 @@ async def register_vip(
     Citta: str = Form(None),
     Prov: str = Form(None),
     Cap: str = Form(None),
+    sms: bool = Form(False),
+    omail: bool = Form(False),
     recaptcha_response: str = Form(...),
-    db: Session = Depends(get_db)
+    idempotency_key: str = Form(None),
+    db: AsyncSession = Depends(get_session),
+    recaptcha: RecaptchaVerifier = Depends(get_recaptcha_verifier),
+    slot_pools: SlotPoolManager | None = Depends(get_slot_pools),
+    phone_filters: PhoneFilterRegistry | None = Depends(get_phone_filters)
 ):
-    logger.info(f"Starting VIP registration for token: {token}, phone: {cellulare}")
+    logger.info("Starting VIP registration for token: %s, phone: %s", token, cellulare)
+    stages = StageTimer("register_vip")
 
     # Step 1: Store Identification
     try:
-        table_name = get_table_name_from_token(token, db)
+        table_name = await get_table_name_from_token(token, db)
     except HTTPException as e:
-        logger.error(f"Store identification failed: {str(e)}")
-        return templates.TemplateResponse(
+        logger.error("Store identification failed: %s", e)
+        # Nothing can be submitted to an invalid store, so don't bother echoing the form back
+        page = await cached_page(request, INVALID_TOKEN_PAGE,
+                                 register_form_context(request, warning="Invalid or inactive store token"))
+        return page.response(request, cacheable=False)
+
+    stages.lap("store")
+
+    # Step 2: Verify reCAPTCHA v3
+    try:
+        verified = await recaptcha.verify(recaptcha_response, remote_ip=request.client.host if request.client else None)
+    except RecaptchaOverloaded as e:
+        logger.warning("reCAPTCHA verification shed for token %s: %s", token, e)
+        record_error("recaptcha_overloaded")
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    except RecaptchaUnavailable as e:
+        logger.error("reCAPTCHA verification failed for token %s: %s", token, e)
+        record_error("recaptcha_unavailable")
+        raise HTTPException(status_code=500, detail="CAPTCHA verification error")
+
+    stages.lap("recaptcha")
+    if not verified:
+        logger.warning("reCAPTCHA failed for token %s", token)
+        record_error("recaptcha_rejected")
+        return await render_template(
             "register.html",
             {
                 "request": request,
-                "warning": "Invalid or inactive store token",
+                "warning": "CAPTCHA verification failed. Are you a bot?",
                 "form_data": {
                     "cellulare": cellulare,
                     "Nome": Nome,
@@ -136,55 +356,20 @@ async def register_vip(
                     "Indirizzo": Indirizzo,
                     "Citta": Citta,
                     "Prov": Prov,
-                    "Cap": Cap
+                    "Cap": Cap,
+                    "sms": sms,
+                    "omail": omail
                 },
                 "recaptcha_site_key": RECAPTCHA_SITE_KEY
             }
         )
 
-    # Step 2: Verify reCAPTCHA v3
-    verification_url = "https://www.google.com/recaptcha/api/siteverify"
-    payload = {
-        "secret": RECAPTCHA_SECRET_KEY,
-        "response": recaptcha_response
-    }
-    try:
-        response = requests.post(verification_url, data=payload)
-        result = response.json()
-        logger.debug(f"reCAPTCHA response for token {token}: {result}")
-
-        RECAPTCHA_THRESHOLD = float(os.getenv("RECAPTCHA_THRESHOLD", "0.3"))  # Adjusted threshold
-        if not result.get("success") or result.get("score", 0) < RECAPTCHA_THRESHOLD:
-            logger.warning(f"reCAPTCHA failed for token {token}: success={result.get('success')}, score={result.get('score')}")
-            return templates.TemplateResponse(
-                "register.html",
-                {
-                    "request": request,
-                    "warning": "CAPTCHA verification failed. Are you a bot?",
-                    "form_data": {
-                        "cellulare": cellulare,
-                        "Nome": Nome,
-                        "cognome": cognome,
-                        "nascita": nascita,
-                        "Email": Email,
-                        "Indirizzo": Indirizzo,
-                        "Citta": Citta,
-                        "Prov": Prov,
-                        "Cap": Cap
-                    },
-                    "recaptcha_site_key": RECAPTCHA_SITE_KEY
-                }
-            )
-    except Exception as e:
-        logger.error(f"reCAPTCHA verification failed for token {token}: {str(e)}")
-        raise HTTPException(status_code=500, detail="CAPTCHA verification error")
-
     # Step 3: Validate phone number (Italian, 10 digits)
-    cellulare_cleaned = re.sub(r"^\+?39", "", cellulare.strip())
-    cellulare_cleaned = re.sub(r"\D", "", cellulare_cleaned)
-    if not re.match(r"^\d{10}$", cellulare_cleaned):
-        logger.warning(f"Invalid phone number format for token {token}: {cellulare}")
-        return templates.TemplateResponse(
+    try:
+        cellulare_cleaned = normalize_phone(cellulare)
+    except ValueError:
+        logger.warning("Invalid phone number format for token %s: %s", token, cellulare)
+        return await render_template(
             "register.html",
             {
                 "request": request,
@@ -198,18 +383,24 @@ async def register_vip(
                     "Indirizzo": Indirizzo,
                     "Citta": Citta,
                     "Prov": Prov,
-                    "Cap": Cap
+                    "Cap": Cap,
+                    "sms": sms,
+                    "omail": omail
                 },
                 "recaptcha_site_key": RECAPTCHA_SITE_KEY
             }
         )
 
+    stages.lap("validate")
+
     # Step 4: Check if phone exists in the store's table
-    query = text(f"SELECT 1 FROM {table_name} WHERE cellulare = :cellulare LIMIT 1")
-    existing = db.execute(query, {"cellulare": cellulare_cleaned}).fetchone()
+    # Always asked of the database: the phone filter may lag behind other workers' registrations
+    async with store_session(db, table_name) as store_db:
+        existing = await phone_exists(store_db, table_name, cellulare_cleaned)
+    stages.lap("duplicate_check")
     if existing:
-        logger.warning(f"Phone {cellulare_cleaned} already registered in table {table_name}")
-        return templates.TemplateResponse(
+        logger.warning("Phone %s already registered in table %s", cellulare_cleaned, table_name)
+        return await render_template(
             "register.html",
             {
                 "request": request,
@@ -223,26 +414,16 @@ async def register_vip(
                     "Indirizzo": Indirizzo,
                     "Citta": Citta,
                     "Prov": Prov,
-                    "Cap": Cap
+                    "Cap": Cap,
+                    "sms": sms,
+                    "omail": omail
                 },
                 "recaptcha_site_key": RECAPTCHA_SITE_KEY
             }
         )
 
-    # Step 5: Find available row (stato = 1)
-    query = text(f"SELECT * FROM {table_name} WHERE stato = 1 ORDER BY IDvip ASC LIMIT 1")
-    available_vip = db.execute(query).fetchone()
-    if not available_vip:
-        logger.error(f"No available VIP rows in table {table_name} for token {token}")
-        raise HTTPException(status_code=400, detail="No available VIP slots")
-
-    # Access Row data using _mapping for named access
-    logger.debug(f"Found available VIP row in {table_name} with IDvip: {available_vip._mapping['IDvip']}")
-
-    # Step 6: Clean the row and update it
-    fields_to_clean = ["nascita", "cellulare", "Nome", "cognome", "Email", "Indirizzo", "Citta", "Prov", "Cap"]
-    update_data = {field: "" for field in fields_to_clean}  # Clean fields
-    update_data.update({
+    # Step 5/6: Atomically claim the first available row (stato = 1) and fill it in
+    update_data = {
         "nascita": nascita,
         "cellulare": cellulare_cleaned,
         "Nome": Nome,
@@ -252,45 +433,91 @@ async def register_vip(
         "Citta": Citta,
         "Prov": Prov,
         "Cap": Cap,
-        "stato": 0  # Mark as taken
-    })
-
-    update_query = text(f"""
-        UPDATE {table_name}
-        SET nascita = :nascita, cellulare = :cellulare, Nome = :Nome, cognome = :cognome,
-            Email = :Email, Indirizzo = :Indirizzo, Citta = :Citta, Prov = :Prov, Cap = :Cap, stato = :stato
-        WHERE IDvip = :IDvip
-    """)
-    db.execute(update_query, {**update_data, "IDvip": available_vip._mapping["IDvip"]})
-    db.commit()
-    logger.info(f"Updated VIP row in {table_name} with IDvip: {available_vip._mapping['IDvip']}")
-
-    # Step 7: Fetch the updated row for dashboard
-    select_query = text(f"SELECT * FROM {table_name} WHERE IDvip = :IDvip")
-    updated_vip = db.execute(select_query, {"IDvip": available_vip._mapping["IDvip"]}).fetchone()
-
-    # Step 8: Generate barcode in memory
+        "sms": sms,
+        "omail": omail
+    }
+    # Welcome messages the member opted in to are queued in the claim's transaction and sent by the outbox worker
+    outbox = request.app.state.outbox
+    async def queue_events(store_db, card):
+        await write_events(store_db, registration_events(table_name, card.IDvip, update_data, card.code, token))
+
+    before_commit = queue_events if outbox is not None else None
     try:
-        barcode = Code128(updated_vip._mapping["code"], writer=ImageWriter())
-        buffer = BytesIO()
-        barcode.write(buffer)
-        barcode_data = buffer.getvalue()
-        buffer.close()
-        barcode_base64 = base64.b64encode(barcode_data).decode('utf-8')
-        barcode_data_url = f"data:image/png;base64,{barcode_base64}"
-        logger.info(f"Barcode generated for code: {updated_vip._mapping['code']} in table {table_name}")
-    except Exception as e:
-        logger.error(f"Barcode generation failed for token {token}: {str(e)}")
+        async with store_session(db, table_name) as store_db:
+            if slot_pools is not None:
+                card = await slot_pools.claim(store_db, table_name, update_data, before_commit)
+            else:
+                card = await claim_slot(store_db, table_name, update_data, before_commit=before_commit)
+    except NoFreeSlot:
+        logger.error("No available VIP rows in table %s for token %s", table_name, token)
+        record_error("no_free_slot")
+        raise HTTPException(status_code=400, detail="No available VIP slots")
+    except SlotContention:
+        logger.error("Could not claim a VIP row in table %s for token %s: too much contention", table_name, token)
+        record_error("slot_contention")
+        raise HTTPException(status_code=503, detail="Registration busy, please retry")
+    stages.lap("claim")
+    logger.info("Updated VIP row in %s with IDvip: %s", table_name, card.IDvip)
+    if outbox is not None:
+        outbox.notify()
+    if phone_filters is not None:
+        phone_filters.add(table_name, cellulare_cleaned)
+
+    # Step 7: Build the dashboard data from the values just written; no need to read the row back
+    updated_vip = {**update_data, "IDvip": card.IDvip, "code": card.code}
+
+    # Step 8: Point the dashboard at the cached barcode endpoint instead of inlining the image
+    if not updated_vip["code"]:
+        logger.error("Barcode generation failed for token %s: IDvip %s has no code", token, card.IDvip)
+        record_error("barcode_failed")
         raise HTTPException(status_code=500, detail="Barcode generation failed")
+    barcode_url = request.app.url_path_for("get_barcode", token=token, code=updated_vip["code"], fmt=BARCODE_FORMAT)
+    stages.lap("barcode")
 
     # Step 9: Render dashboard
-    return templates.TemplateResponse(
+    response = await render_template(
         "dashboard.html",
         {
             "request": request,
-            "vip": updated_vip._mapping,  # Pass the mapping directly
-            "barcode_data_url": barcode_data_url,
+            "vip": updated_vip,
+            "barcode_url": barcode_url,
             "token": token
         }
-    )
-
+    )
+    stages.lap("render")
+    request.state.registration = CompletedRegistration(card.IDvip, card.code, barcode_url, response.body)
+    return response
+
+
+# Codes printed on our cards; anything else is rejected before rendering
+BARCODE_CODE_PATTERN = re.compile(r"^[0-9A-Za-z-]{1,32}$")
+
+@router.get("/{token}/barcode/{code}.{fmt}", name="get_barcode", dependencies=[Depends(enforce_rate_limit)])
+async def get_barcode(request: Request, token: str, code: str, fmt: str, db: AsyncSession = Depends(get_session)):
+    if fmt not in MEDIA_TYPES or not BARCODE_CODE_PATTERN.match(code):
+        raise HTTPException(status_code=404, detail="Barcode not found")
+    table_name = (await get_store_from_token(token, db)).dbnome
+    # Only the codes of this store's member cards, not whatever matches the pattern
+    async with store_session(db, table_name) as store_db:
+        if not await claimed_card_exists(store_db, table_name, code):
+            raise HTTPException(status_code=404, detail="Barcode not found")
+
+    # The image for a code never changes, but it is a member credential: no shared caches
+    etag = barcode_etag(code, fmt)
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={BARCODE_MAX_AGE}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    # Checked here, not in the worker: with a process pool the children's memory is out of reach
+    barcode = barcode_cache.get(code, fmt)
+    if barcode is None:
+        try:
+            barcode = await request.app.state.workers.run(render_barcode, code, fmt)
+        except WorkerPoolSaturated:
+            raise
+        except Exception as e:
+            logger.error("Barcode generation failed for code %s: %s", code, e)
+            record_error("barcode_failed")
+            raise HTTPException(status_code=500, detail="Barcode generation failed")
+        barcode_cache.set(code, fmt, barcode)
+    return Response(content=barcode.content, media_type=barcode.media_type, headers=headers)
@@ -6,20 +6,29 @@ import logging
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def normalize_phone(v: str) -> str:
+    """Normalize an Italian mobile number to its 10 digits, raising ValueError if it isn't one."""
+    # Remove any country code (+39 or 39) and non-digit chars
+    v = re.sub(r"^\+?39", "", v.strip())
+    v = re.sub(r"\D", "", v)
+    if not re.match(r"^\d{10}$", v):
+        logger.error("Invalid Italian phone number: %s", v)
+        raise ValueError("Cellulare must be a 10-digit Italian number")
+    return v
+
 class VipCheckPhone(BaseModel):
     cellulare: str
 
     @validator("cellulare")
     def validate_phone(cls, v):
-        # Remove any country code (+39 or 39) and non-digit chars
-        v = re.sub(r"^\+?39", "", v.strip())
-        v = re.sub(r"\D", "", v)
-        if not re.match(r"^\d{10}$", v):
-            logger.error(f"Invalid Italian phone number: {v}")
-            raise ValueError("Cellulare must be a 10-digit Italian number")
-        logger.debug(f"Validated phone number: {v}")
+        v = normalize_phone(v)
+        logger.debug("Validated phone number: %s", v)
         return v
 
+class VipCheckPhones(BaseModel):
+    # Raw numbers: each one is normalized on its own so one bad entry doesn't fail the batch
+    numbers: list[str]
+
 class VipCreate(BaseModel):
     nascita: str  # Will use date widget in front-end
     cellulare: str
@@ -33,24 +42,19 @@ class VipCreate(BaseModel):
 
     @validator("cellulare")
     def validate_phone(cls, v):
-        v = re.sub(r"^\+?39", "", v.strip())
-        v = re.sub(r"\D", "", v)
-        if not re.match(r"^\d{10}$", v):
-            logger.error(f"Invalid Italian phone number: {v}")
-            raise ValueError("Cellulare must be a 10-digit Italian number")
-        return v
+        return normalize_phone(v)
 
     @validator("Nome", "cognome")
     def no_special_chars(cls, v):
         if not re.match(r"^[a-zA-Z\s]+$", v):
-            logger.error(f"Special characters found in field: {v}")
+            logger.error("Special characters found in field: %s", v)
             raise ValueError("Nome and cognome must contain only letters and spaces")
         return v
 
     @validator("Email", pre=True, always=True)
     def validate_email(cls, v):
         if v and not re.match(r"[^@]+@[^@]+\.[^@]+", v):
-            logger.error(f"Invalid email format: {v}")
+            logger.error("Invalid email format: %s", v)
             raise ValueError("Invalid email format")
         return v
 
@@ -64,4 +68,3 @@ class VipResponse(BaseModel):
     class Config:
         from_attributes = True
 
-logger.info("Pydantic schemas defined")
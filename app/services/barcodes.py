@@ -0,0 +1,151 @@
+# app/services/barcodes.py
+from collections import OrderedDict
+from typing import NamedTuple
+import hashlib
+import logging
+import os
+import struct
+import threading
+import zlib
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+BARCODE_FORMAT = os.getenv("BARCODE_FORMAT", "svg")
+BARCODE_CACHE_SIZE = int(os.getenv("BARCODE_CACHE_SIZE", "4096"))
+# A barcode is a member credential: only the member's browser may keep it, and not for long
+BARCODE_MAX_AGE = int(os.getenv("BARCODE_MAX_AGE", "86400"))
+
+MEDIA_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+# Rendering geometry, in pixels (PNG) or user units (SVG)
+MODULE_WIDTH = 2
+BAR_HEIGHT = 80
+QUIET_ZONE = 10  # blank modules on each side, required by scanners
+
+# Bump when the rendering changes so clients holding old ETags get the new image
+RENDER_VERSION = f"1:{MODULE_WIDTH}:{BAR_HEIGHT}:{QUIET_ZONE}"
+
+
+class RenderedBarcode(NamedTuple):
+    content: bytes
+    media_type: str
+    etag: str
+
+
+def barcode_etag(code: str, fmt: str) -> str:
+    """ETag of a rendered barcode, known without rendering it."""
+    return '"' + hashlib.sha1(f"{RENDER_VERSION}:{fmt}:{code}".encode()).hexdigest() + '"'
+
+
+def barcode_modules(code: str) -> str:
+    """Code128 module pattern for `code`: one character per module, '1' = bar."""
+    from barcode import Code128  # imported on first render, not at app import
+
+    return Code128(code).build()[0]
+
+
+def _bar_runs(modules: str):
+    """Yield (start, width) in modules for each run of consecutive bars."""
+    start = None
+    for i, module in enumerate(modules + "0"):
+        if module == "1" and start is None:
+            start = i
+        elif module == "0" and start is not None:
+            yield start, i - start
+            start = None
+
+
+def render_svg(modules: str) -> bytes:
+    """Compact SVG: a single path with one rectangle per run of bars."""
+    width = (len(modules) + 2 * QUIET_ZONE) * MODULE_WIDTH
+    path = "".join(
+        f"M{(QUIET_ZONE + start) * MODULE_WIDTH} 0h{run * MODULE_WIDTH}v{BAR_HEIGHT}h-{run * MODULE_WIDTH}z"
+        for start, run in _bar_runs(modules)
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{BAR_HEIGHT}" '
+        f'viewBox="0 0 {width} {BAR_HEIGHT}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/><path d="{path}" fill="#000"/></svg>'
+    ).encode("ascii")
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def render_png(modules: str) -> bytes:
+    """1-bit grayscale PNG written with zlib alone, so Pillow is not needed."""
+    pixels = "".join(("0" if module == "1" else "1") * MODULE_WIDTH for module in "0" * QUIET_ZONE + modules + "0" * QUIET_ZONE)
+    width = len(pixels)
+    pixels += "1" * (-width % 8)  # pad the row to whole bytes
+    row = b"\x00" + int(pixels, 2).to_bytes(len(pixels) // 8, "big")  # filter type 0 + packed bits
+    header = struct.pack(">IIBBBBB", width, BAR_HEIGHT, 1, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(row * BAR_HEIGHT, 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+RENDERERS = {
+    "svg": render_svg,
+    "png": render_png,
+}
+
+
+def render_barcode(code: str, fmt: str = BARCODE_FORMAT) -> RenderedBarcode:
+    """Render `code` as Code128 in `fmt`; runs on the worker pool, see BarcodeCache for caching."""
+    if fmt not in RENDERERS:
+        raise ValueError(f"Unsupported barcode format: {fmt}")
+    content = RENDERERS[fmt](barcode_modules(code))
+    logger.debug("Rendered %s barcode for code: %s", fmt, code)
+    return RenderedBarcode(content, MEDIA_TYPES[fmt], barcode_etag(code, fmt))
+
+
+class BarcodeCache:
+    """Bounded LRU of rendered barcodes, per (code, format).
+
+    It lives in the process serving requests and is checked before anything is
+    dispatched to the worker pool: with a process pool, a cache inside the
+    children would still cost a round trip per request.
+    """
+
+    def __init__(self, maxsize: int = BARCODE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._barcodes: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, code: str, fmt: str) -> RenderedBarcode | None:
+        with self._lock:
+            barcode = self._barcodes.get((code, fmt))
+            if barcode is None:
+                self.misses += 1
+                return None
+            self._barcodes.move_to_end((code, fmt))
+            self.hits += 1
+            return barcode
+
+    def set(self, code: str, fmt: str, barcode: RenderedBarcode) -> RenderedBarcode:
+        if self.maxsize <= 0:
+            return barcode
+        with self._lock:
+            self._barcodes[(code, fmt)] = barcode
+            self._barcodes.move_to_end((code, fmt))
+            while len(self._barcodes) > self.maxsize:
+                self._barcodes.popitem(last=False)
+        return barcode
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._barcodes)
+        return {"size": size, "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+barcode_cache = BarcodeCache()
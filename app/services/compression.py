@@ -0,0 +1,128 @@
+# app/services/compression.py
+from functools import lru_cache
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+import gzip
+import logging
+import mimetypes
+import os
+
+try:  # optional: brotli is only used when installed
+    import brotli
+except ImportError:
+    brotli = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Preferred first; file suffix of the precompressed sibling of a static asset
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# Compressing these again gains nothing
+COMPRESSIBLE_SUFFIXES = (".css", ".js", ".html", ".svg", ".json", ".txt", ".map")
+
+
+def compress(data: bytes) -> dict[str, bytes]:
+    """Every encoding available here, keyed by Content-Encoding name."""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return variants
+
+
+def accepted_encoding(accept_encoding: str | None, available) -> str | None:
+    """The preferred encoding in `available` the client accepts, if any (q=0 means refused)."""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    for encoding in ENCODINGS:
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match: str | None, etag: str | None) -> bool:
+    """Whether an If-None-Match list names `etag`: `*` matches anything, `W/` tags compare weakly."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+@lru_cache(maxsize=1024)
+def _precompressed(full_path: str, mtime: float) -> dict:
+    # Keyed on the original's mtime, so a rebuilt asset is looked up again
+    found = {}
+    for encoding, suffix in ENCODINGS.items():
+        try:
+            stat_result = os.stat(full_path + suffix)
+        except OSError:
+            continue
+        if stat_result.st_mtime >= mtime:  # stale siblings are ignored
+            found[encoding] = (full_path + suffix, stat_result)
+    return found
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves `name.br` / `name.gz` next to `name` to clients accepting them.
+
+    Generate the siblings with `python -m app.cli compress-static`; assets without
+    one are served as usual.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        variants = _precompressed(str(full_path), stat_result.st_mtime)
+        encoding = accepted_encoding(request_headers.get("accept-encoding"), variants)
+        if encoding is None:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            if variants:
+                response.headers["Vary"] = "Accept-Encoding"
+            return response
+
+        path, compressed_stat = variants[encoding]
+        response = FileResponse(
+            path,
+            status_code=status_code,
+            stat_result=compressed_stat,
+            media_type=mimetypes.guess_type(str(full_path))[0] or "text/plain",
+            headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def is_not_modified(self, response_headers, request_headers) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is None:
+            return super().is_not_modified(response_headers, request_headers)
+        # If-Modified-Since is ignored when If-None-Match is sent
+        return etag_matches(if_none_match, response_headers.get("etag"))
+
+
+def precompress_directory(directory: str) -> list[str]:
+    """Write .gz (and .br when brotli is installed) next to each compressible asset."""
+    written = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            for encoding, content in compress(data).items():
+                if len(content) >= len(data):
+                    continue
+                with open(path + ENCODINGS[encoding], "wb") as f:
+                    f.write(content)
+                written.append(path + ENCODINGS[encoding])
+    logger.info("Precompressed %s static file variant(s) in %s", len(written), directory)
+    return written
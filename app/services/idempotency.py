@@ -0,0 +1,107 @@
+# app/services/idempotency.py
+from collections import OrderedDict
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "1").lower() not in ("0", "false", "no")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+
+def fingerprint(*values) -> str:
+    """Digest of a submission's values; a replay is only served for an identical submission."""
+    return hashlib.sha256("\x1f".join("" if v is None else str(v) for v in values).encode()).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future, expires_at: float):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """Bounded TTL store of completed results, with in-flight duplicates coalesced.
+
+    `run(key, fingerprint, fn, keep)` calls `fn()` for the first submission under `key`.
+    A duplicate arriving while it runs waits for it instead of starting its own, and
+    later duplicates get the stored result straight away. `keep(value)` turns the
+    outcome into what is stored for replay, or None for outcomes that must not be
+    replayed (errors, rejected submissions); of the duplicates waiting on such an
+    outcome, one runs `fn()` and the others wait for it in turn.
+    A duplicate with a different fingerprint is never answered from the store.
+
+    The store lives in one worker process. A retry that reaches another worker is not
+    recognised: it goes through the whole flow again and is normally answered by the
+    duplicate phone check ("already registered") rather than with the stored card.
+    """
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_MAX_ENTRIES, ttl: float = IDEMPOTENCY_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self.replayed = 0
+        self.coalesced = 0
+        self.mismatched = 0
+
+    async def run(self, key, fingerprint: str, fn, keep):
+        """Returns (value, replayed): fn()'s value, or the stored result of an earlier submission."""
+        while (entry := self._lookup(key)) is not None:
+            if entry.fingerprint != fingerprint:
+                self.mismatched += 1
+                return await fn(), False
+            if entry.future.done():
+                stored = entry.future.result()
+                if stored is None:
+                    break
+            else:
+                self.coalesced += 1
+                stored = await asyncio.shield(entry.future)
+            if stored is not None:
+                self.replayed += 1
+                return stored, True
+            # The submission we waited for kept nothing: the first waiter to resume finds
+            # no entry and takes over below, the ones after it wait for that attempt
+
+        entry = _Entry(fingerprint, asyncio.get_running_loop().create_future(), self._clock() + self.ttl)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        stored = None
+        try:
+            value = await fn()
+            stored = keep(value)
+            return value, False
+        finally:
+            entry.future.set_result(stored)
+            if stored is None and self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        return entry
+
+    def stats(self) -> dict:
+        pending = sum(1 for entry in self._entries.values() if not entry.future.done())
+        return {
+            "entries": len(self._entries),
+            "pending": pending,
+            "maxsize": self.maxsize,
+            "replayed": self.replayed,
+            "coalesced": self.coalesced,
+            "mismatched": self.mismatched,
+        }
@@ -0,0 +1,275 @@
+# app/services/members.py
+from sqlalchemy import select
+from pydantic import ValidationError
+from app.models.vip import vip_columns
+from app.schemas.vip import VipCreate
+from app.services.phones import find_existing_phones
+from app.services.slots import (
+    CLAIM_FIELDS, SLOT_CLAIM_ATTEMPTS, NoFreeSlot, SlotContention, claim_params, claim_update_query, use_skip_locked,
+)
+from app.services.store_tables import store_table
+import codecs
+import csv
+import io
+import json
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MEMBER_IMPORT_BATCH = int(os.getenv("MEMBER_IMPORT_BATCH", "500"))
+MEMBER_EXPORT_BATCH = int(os.getenv("MEMBER_EXPORT_BATCH", "1000"))
+
+# Spreadsheet headers are matched to the form fields case-insensitively
+_FIELD_NAMES = {field.lower(): field for field in CLAIM_FIELDS}
+
+
+class ImportProgress:
+    """Counters of an import; `rows_done` is the resume point (input rows fully committed)."""
+
+    def __init__(self, rows_done: int = 0):
+        self.rows_done = rows_done
+        self.imported = 0
+        self.rejected = 0
+        self.batches = 0
+        self.stopped = None  # reason the import ended early, e.g. no free cards left
+
+    def to_dict(self) -> dict:
+        return {
+            "rows_done": self.rows_done,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "stopped": self.stopped,
+        }
+
+
+def member_from_row(raw: dict) -> dict:
+    """Validate and normalize one input row with the registration form's rules."""
+    values = {}
+    for key, value in raw.items():
+        field = _FIELD_NAMES.get(str(key).strip().lower())
+        if field is not None:
+            value = value.strip() if isinstance(value, str) else value
+            values[field] = value if value not in ("", None) else None
+    for field in ("Nome", "cognome", "nascita", "cellulare"):
+        values.setdefault(field, None)
+    member = VipCreate.model_validate(values)
+    return claim_params(member.model_dump())
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors(include_url=False))
+
+
+async def _lines(chunks):
+    """Split an async stream of bytes/str chunks into lines.
+
+    Bytes are decoded incrementally, so a multibyte character split across two
+    chunks (any read size, any request body chunking) is decoded whole.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def iter_csv_rows(chunks):
+    """Yield (line number, row dict) from a CSV stream; the first record is the header.
+
+    Quoted fields may span lines: a record is parsed once its quotes are balanced.
+    """
+    header, record, line_no = None, "", 0
+    async for line in _lines(chunks):
+        line_no += 1
+        record += line + "\n"
+        if record.count('"') % 2:
+            continue
+        values, record = next(csv.reader(io.StringIO(record))), ""
+        if not values or not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = values
+            continue
+        yield line_no, dict(zip(header, values))
+
+
+async def iter_ndjson_rows(chunks):
+    """Yield (line number, row) from an NDJSON stream; unparsable lines yield the error text."""
+    line_no = 0
+    async for line in _lines(chunks):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = f"Invalid JSON: {e}"
+        yield line_no, row if isinstance(row, (dict, str)) else "Each line must be a JSON object"
+
+
+async def _claim_batch(db, table_name: str, members: list[dict], max_attempts: int = SLOT_CLAIM_ATTEMPTS) -> int:
+    """Fill `members` into free cards of `table_name` in one transaction; returns how many fit.
+
+    Cards are taken from the top of the table (highest IDvip first) so bulk imports
+    don't compete with live registrations, which hand out cards from the bottom. The
+    conditional UPDATE is sent as one executemany; if a concurrent registration took
+    one of the chosen cards the whole batch is rolled back and retried.
+    """
+    dialect = db.bind.dialect
+    table = store_table(table_name)
+    select_query = (
+        select(*vip_columns(table, "IDvip")).where(table.c.stato == 1).order_by(table.c.IDvip.desc())
+        .limit(len(members))
+    )
+    if use_skip_locked(dialect.name):
+        select_query = select_query.with_for_update(skip_locked=True)
+
+    for attempt in range(1, max_attempts + 1):
+        cards = (await db.execute(select_query)).scalars().all()
+        if not cards:
+            await db.rollback()
+            raise NoFreeSlot(table_name)
+
+        params = [claim_params(member, card_id=id_vip) for member, id_vip in zip(members, cards)]
+        result = await db.execute(claim_update_query(table_name), params)
+        if dialect.supports_sane_multi_rowcount:
+            claimed = result.rowcount == len(params)
+        else:
+            ids = [p["card_id"] for p in params]
+            verify_query = select(table.c.IDvip, table.c.cellulare).where(table.c.IDvip.in_(ids))
+            written = dict((await db.execute(verify_query)).all())
+            claimed = all(written.get(p["card_id"]) == p["cellulare"] for p in params)
+        if claimed:
+            await db.commit()
+            return len(params)
+
+        await db.rollback()
+        logger.info("Bulk claim in %s lost a card to a concurrent registration, retrying (attempt %s)",
+                    table_name, attempt)
+
+    raise SlotContention(table_name)
+
+
+async def import_members(db, table_name: str, rows, skip: int = 0, batch_size: int = MEMBER_IMPORT_BATCH,
+                         on_batch=None) -> ImportProgress:
+    """Import (line number, row) pairs into free cards of a store table.
+
+    Rows are validated like the registration form; invalid ones, numbers repeated in
+    the input and numbers already registered are rejected. Valid rows are written in
+    batches of `batch_size`, one transaction each. After every batch `on_batch(progress,
+    rejects)` is awaited with that batch's rejected rows, so callers can persist the
+    resume point and the rejects together. Input rows up to `skip` are ignored (resuming
+    an interrupted import). Stops early, with `progress.stopped` set, when the table runs
+    out of free cards.
+    """
+    progress = ImportProgress(rows_done=skip)
+    seen = set()
+    batch, rejects = [], []
+    consumed = skip
+
+    async def flush():
+        nonlocal batch, rejects
+        members = batch
+        if members:
+            existing = await find_existing_phones(db, table_name, [m["cellulare"] for _, m, _ in members])
+            rejects += [(line, raw, "Phone number already registered")
+                        for line, m, raw in members if m["cellulare"] in existing]
+            members = [entry for entry in members if entry[1]["cellulare"] not in existing]
+        try:
+            fitted = await _claim_batch(db, table_name, [m for _, m, _ in members]) if members else 0
+        except NoFreeSlot:
+            fitted = 0
+        if fitted < len(members):
+            # The table ran out of cards: resume from the first row that didn't fit
+            first_left = members[fitted][0]
+            rejects = [r for r in rejects if r[0] < first_left]
+            progress.rows_done = first_left - 1
+            progress.stopped = "No available VIP slots"
+        else:
+            progress.rows_done = consumed
+        progress.imported += fitted
+        progress.rejected += len(rejects)
+        progress.batches += 1
+        if on_batch is not None:
+            await on_batch(progress, rejects)
+        batch, rejects = [], []
+
+    async for line_no, raw in rows:
+        if line_no <= skip:
+            continue
+        consumed = line_no
+        if isinstance(raw, str):
+            rejects.append((line_no, None, raw))
+            continue
+        try:
+            member = member_from_row(raw)
+        except ValidationError as e:
+            rejects.append((line_no, raw, _validation_message(e)))
+            continue
+        if member["cellulare"] in seen:
+            rejects.append((line_no, raw, "Phone number repeated in the input"))
+            continue
+        seen.add(member["cellulare"])
+        batch.append((line_no, member, raw))
+        if len(batch) >= batch_size:
+            await flush()
+            if progress.stopped:
+                break
+    else:
+        if batch or rejects:
+            await flush()
+
+    logger.info("Imported %s member(s) into %s, %s rejected, resume point %s",
+                progress.imported, table_name, progress.rejected, progress.rows_done)
+    return progress
+
+
+async def export_members(db, table_name: str, batch_size: int = MEMBER_EXPORT_BATCH, claimed_only: bool = True):
+    """Yield the rows of a store table as mappings, paging by keyset on IDvip.
+
+    Memory stays bounded by `batch_size` whatever the table size, and the img blob is
+    never read.
+    """
+    table = store_table(table_name)
+    query = select(*vip_columns(table)).order_by(table.c.IDvip.asc()).limit(batch_size)
+    if claimed_only:
+        query = query.where(table.c.stato == 0)
+    last_id = -1
+    while True:
+        rows = (await db.execute(query.where(table.c.IDvip > last_id))).mappings().all()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]["IDvip"]
+        # Don't hold a transaction open (and MVCC snapshot) for the whole export
+        await db.rollback()
+
+
+async def csv_lines(rows):
+    header = None
+    async for row in rows:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header is None:
+            header = list(row.keys())
+            writer.writerow(header)
+        writer.writerow(["" if value is None else value for value in row.values()])
+        yield buffer.getvalue()
+
+
+async def ndjson_lines(rows):
+    async for row in rows:
+        yield json.dumps(dict(row), default=str) + "\n"
+
+
+def reject_record(line: int, raw, reason: str) -> dict:
+    return {"line": line, "row": raw, "error": reason}
@@ -0,0 +1,320 @@
+# app/services/metrics.py
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import dependencies
+from app.dependencies import pool_status
+from app.services.barcodes import barcode_cache
+from app.services.page_cache import page_cache
+from app.services.store_cache import store_cache
+from app.services.store_tables import store_tables
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# Seconds; the usual Prometheus client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def gauge_lines(name: str, help: str, samples, labelnames=(), kind: str = "gauge") -> list[str]:
+    """Exposition lines for values read at scrape time: `samples` is [(label values, value), ...]."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+    return lines
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by endpoint and status.", ("method", "endpoint", "status"))
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "endpoint")
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "Database statements executed per request.", ("endpoint",), buckets=QUERY_COUNT_BUCKETS
+)
+UNHANDLED_ERRORS = Counter(
+    "http_unhandled_exceptions_total", "Requests that ended with an unhandled exception.", ("endpoint", "exception")
+)
+STAGE_LATENCY = Histogram(
+    "request_stage_duration_seconds", "Time spent in each stage of a request pipeline.", ("endpoint", "stage")
+)
+DB_QUERIES = Counter("db_queries_total", "Database statements executed, inside or outside requests.")
+ERRORS = Counter("app_errors_total", "Handled failures by kind (reCAPTCHA, slot claims, rendering...).", ("kind",))
+
+
+class RequestStats:
+    """Mutable per-request state shared with worker threads through a context variable."""
+
+    __slots__ = ("queries",)
+
+    def __init__(self):
+        self.queries = 0
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERIES.inc()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+
+
+class StageTimer:
+    """Lap timer for a request pipeline: call lap(stage) at the end of each stage.
+
+    Each lap records the time since the previous one, so stages skipped by an early
+    return simply don't show up.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        if METRICS_ENABLED:
+            STAGE_LATENCY.observe(now - self._last, self.endpoint, stage)
+        self._last = now
+
+
+def record_error(kind: str) -> None:
+    if METRICS_ENABLED:
+        ERRORS.inc(kind)
+
+
+def _endpoint_name(scope) -> str:
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    return getattr(endpoint, "__name__", type(endpoint).__name__)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and counting its database statements.
+
+    Requests are labelled by endpoint function name (not path) so per-token URLs don't
+    create a series each.
+    """
+
+    def __init__(self, app, exclude_paths=("/metrics",)):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            UNHANDLED_ERRORS.inc(_endpoint_name(scope), type(e).__name__)
+            raise
+        finally:
+            _current.reset(token)
+            # The router fills in scope["endpoint"] once it has matched the request
+            endpoint = _endpoint_name(scope)
+            REQUESTS.inc(scope["method"], endpoint, str(status))
+            REQUEST_LATENCY.observe(time.perf_counter() - started, scope["method"], endpoint)
+            REQUEST_QUERIES.observe(stats.queries, endpoint)
+
+
+def _component_lines(state) -> list[str]:
+    """Counters kept by the app's long-lived components, read at scrape time."""
+    lines = []
+    cache = store_cache.stats()
+    barcodes = barcode_cache.stats()
+    pages = page_cache.stats()
+    tables = store_tables.stats()
+    lines += gauge_lines("cache_hits_total", "Cache hits.",
+                         [(("store",), cache["hits"]), (("barcode",), barcodes["hits"]), (("page",), pages["hits"])],
+                         ("cache",), kind="counter")
+    lines += gauge_lines("cache_misses_total", "Cache misses.",
+                         [(("store",), cache["misses"]), (("barcode",), barcodes["misses"]), (("page",), pages["misses"])],
+                         ("cache",), kind="counter")
+    lines += gauge_lines("cache_entries", "Entries currently cached.",
+                         [(("store",), cache["size"]), (("barcode",), barcodes["size"]), (("page",), pages["size"]),
+                          (("table",), tables["size"])],
+                         ("cache",))
+    lines += gauge_lines("store_cache_negative_hits_total", "Store cache hits on unknown or inactive tokens.",
+                         [((), cache["negative_hits"])], kind="counter")
+
+    pools = []
+    if dependencies.engine is not None:
+        pools.append((("sync", "default"), pool_status(dependencies.engine)))
+    if dependencies.async_engine is not None:
+        pools.append((("async", "default"), pool_status(dependencies.async_engine.sync_engine)))
+    pools += [((kind, shard), pool_status(engine)) for shard, kind, engine in dependencies.shard_router.engines()]
+    for field in ("checkedout", "checkedin", "overflow"):
+        lines += gauge_lines(f"db_pool_{field}", f"Connection pool {field} connections.",
+                             [(labels, status[field]) for labels, status in pools if field in status],
+                             ("engine", "shard"))
+
+    recaptcha = getattr(state, "recaptcha", None)
+    if recaptcha is not None:
+        lines += gauge_lines("recaptcha_verifications_total", "reCAPTCHA verifications by outcome.",
+                             [((outcome,), value) for outcome, value in recaptcha.stats().items()],
+                             ("outcome",), kind="counter")
+
+    rate_limiter = getattr(state, "rate_limiter", None)
+    if rate_limiter is not None:
+        stats = rate_limiter.stats()
+        lines += gauge_lines("rate_limit_decisions_total", "Rate limiter decisions by outcome.",
+                             [((outcome,), stats[outcome]) for outcome in ("allowed", "limited_ip", "limited_token")],
+                             ("outcome",), kind="counter")
+        lines += gauge_lines("rate_limit_backend_errors_total", "Rate limiter backend failures (requests let through).",
+                             [((), stats["backend_errors"])], kind="counter")
+
+    idempotency = getattr(state, "idempotency", None)
+    if idempotency is not None:
+        stats = idempotency.stats()
+        lines += gauge_lines("registration_replays_total", "Duplicate registration submissions answered from the store.",
+                             [((), stats["replayed"])], kind="counter")
+        lines += gauge_lines("registration_coalesced_total", "Duplicates that waited for the submission in flight.",
+                             [((), stats["coalesced"])], kind="counter")
+
+    workers = getattr(state, "workers", None)
+    if workers is not None:
+        stats = workers.stats()
+        lines += gauge_lines("worker_pool_pending", "Jobs queued or running on the worker pool.",
+                             [((), stats["pending"])])
+        lines += gauge_lines("worker_pool_jobs_total", "Worker pool jobs by outcome.",
+                             [((outcome,), stats[outcome]) for outcome in ("completed", "rejected", "failed")],
+                             ("outcome",), kind="counter")
+
+    slot_pools = getattr(state, "slot_pools", None)
+    if slot_pools is not None:
+        stores = slot_pools.stats()
+        lines += gauge_lines("slot_pool_depth", "Prefetched free cards per store table.",
+                             [((name,), pool["depth"]) for name, pool in stores.items()], ("table",))
+        lines += gauge_lines("slot_pool_low_stock", "1 when a store table is running out of free cards.",
+                             [((name,), pool["low_stock"]) for name, pool in stores.items()], ("table",))
+
+    outbox = getattr(state, "outbox", None)
+    if outbox is not None:
+        stats = outbox.stats()
+        lines += gauge_lines("outbox_events_total", "Outbox deliveries by outcome (sent, retried, dead).",
+                             [((outcome,), stats[outcome]) for outcome in ("sent", "retried", "dead")],
+                             ("outcome",), kind="counter")
+        lines += gauge_lines("outbox_deliveries_total", "Outbox events delivered by kind.",
+                             [((kind,), value) for kind, value in sorted(stats["sent_by_kind"].items())],
+                             ("kind",), kind="counter")
+
+    phone_filters = getattr(state, "phone_filters", None)
+    if phone_filters is not None:
+        stats = phone_filters.stats()
+        lines += gauge_lines("phone_filter_skipped_queries_total", "Phone lookups answered by a Bloom filter.",
+                             [((), stats["skipped_queries"])], kind="counter")
+    return lines
+
+
+def render_metrics(state=None) -> str:
+    """The text exposition format, for this worker process only."""
+    lines = []
+    for metric in (REQUESTS, REQUEST_LATENCY, REQUEST_QUERIES, UNHANDLED_ERRORS, STAGE_LATENCY, DB_QUERIES, ERRORS):
+        lines += metric.expose()
+    lines += _component_lines(state)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,119 @@
+# app/services/notifications.py
+import asyncio
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Outbox event kinds and the channel that delivers each
+CHANNELS = {"welcome_sms": "sms", "welcome_email": "email"}
+
+
+class SendFailed(Exception):
+    """The gateway refused the message for good (e.g. invalid recipient); retrying won't help."""
+
+
+# Gateway answers that mean "try again later" rather than "this message is invalid"
+RETRYABLE_STATUS = {408, 429}
+
+
+def mask_recipient(recipient: str | None) -> str:
+    """Recipient for log lines: only the last 3 characters, so logs don't collect phone numbers or addresses."""
+    if not recipient:
+        return "-"
+    return "***" + recipient[-3:]
+
+
+class LogSender:
+    """Default sender: logs that a message would be sent, without delivering it (no gateway configured).
+
+    `delivers` is False, so the outbox never marks a card's sms/omail flag for it.
+    """
+
+    delivers = False
+
+    def __init__(self, channel: str):
+        self.channel = channel
+
+    async def send(self, recipient: str, template: str, data: dict) -> None:
+        logger.info("[%s] %s to %s (not delivered: no gateway configured)", self.channel, template,
+                    mask_recipient(recipient))
+
+    async def aclose(self):
+        pass
+
+
+class FakeSender:
+    """Local stand-in for tests: records messages, optionally failing the first `fail_times` calls.
+
+    Pass delivers=True to have the outbox treat it like a real gateway (set the card's flags).
+    """
+
+    def __init__(self, fail_times: int = 0, error: Exception | None = None, delay: float = 0.0,
+                 delivers: bool = False):
+        self.delivers = delivers
+        self.fail_times = fail_times
+        self.error = error or ConnectionError("gateway unavailable")
+        self.delay = delay
+        self.calls = []
+        self.sent = []
+
+    async def send(self, recipient: str, template: str, data: dict) -> None:
+        self.calls.append(recipient)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if len(self.calls) <= self.fail_times:
+            raise self.error
+        self.sent.append((recipient, template, data))
+
+    async def aclose(self):
+        pass
+
+
+class WebhookSender:
+    """POSTs {"to", "template", "data"} as JSON to an SMS/email gateway over a pooled HTTP client.
+
+    4xx answers are permanent failures (SendFailed), except 408 and 429; those, timeouts,
+    network errors and 5xx answers are raised as they are and retried by the outbox.
+    """
+
+    delivers = True
+
+    def __init__(self, url: str, token: str | None = None, timeout: float = 5.0, max_connections: int = 10):
+        import httpx  # only needed with the webhook backend; keeps it out of app import time
+
+        self.url = url
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 2.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers=headers,
+        )
+
+    async def send(self, recipient: str, template: str, data: dict) -> None:
+        response = await self.client.post(self.url, json={"to": recipient, "template": template, "data": data})
+        if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_STATUS:
+            raise SendFailed(f"{response.status_code} from gateway: {response.text[:200]}")
+        response.raise_for_status()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def create_sender(channel: str):
+    """Sender for `channel` ("sms" or "email") from NOTIFY_<CHANNEL>_BACKEND=log|fake|webhook."""
+    prefix = f"NOTIFY_{channel.upper()}"
+    backend_name = os.getenv(f"{prefix}_BACKEND", "log").lower()
+    if backend_name == "log":
+        return LogSender(channel)
+    if backend_name == "fake":
+        logger.warning("Using fake %s sender: nothing is delivered", channel)
+        return FakeSender()
+    if backend_name == "webhook":
+        url = os.getenv(f"{prefix}_URL")
+        if not url:
+            raise ValueError(f"{prefix}_URL is required with {prefix}_BACKEND=webhook")
+        return WebhookSender(url, token=os.getenv(f"{prefix}_TOKEN"),
+                             timeout=float(os.getenv("NOTIFY_TIMEOUT", "5.0")))
+    raise ValueError(f"Unknown {prefix}_BACKEND: {backend_name}")
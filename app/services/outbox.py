@@ -0,0 +1,268 @@
+# app/services/outbox.py
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, insert, select, update
+from app.models.outbox import OutboxEvent
+from app.services.notifications import CHANNELS, SendFailed, create_sender
+import asyncio
+import json
+import logging
+import os
+import random
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Off until a gateway is configured (NOTIFY_*_BACKEND=webhook)
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "0").lower() not in ("0", "false", "no")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "10"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "5.0"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+# Claimed events are hidden from other workers this long; a worker that dies mid-batch releases them on expiry
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "60"))
+
+# Opt-in flag of the card (set from the registration form) each welcome message requires
+CONSENT_FLAGS = {"welcome_sms": "sms", "welcome_email": "omail"}
+
+outbox_table = OutboxEvent.__table__
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def registration_events(table_name: str, card_id: int, member: dict, code: str | None, token: str,
+                        now: datetime | None = None) -> list[dict]:
+    """Outbox rows for a registration: the welcome SMS and email the member opted in to (sms/omail)."""
+    now = now or utcnow()
+    payload = json.dumps({
+        "token": token,
+        "code": code,
+        "cellulare": member.get("cellulare"),
+        "Email": member.get("Email"),
+        "Nome": member.get("Nome"),
+        "cognome": member.get("cognome"),
+    })
+    recipients = {"welcome_sms": member.get("cellulare"), "welcome_email": member.get("Email")}
+    kinds = [kind for kind, flag in CONSENT_FLAGS.items() if member.get(flag) and recipients[kind]]
+    return [
+        {"kind": kind, "store_table": table_name, "IDvip": card_id, "payload": payload, "status": "pending",
+         "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for kind in kinds
+    ]
+
+
+async def write_events(db, rows: list[dict]) -> None:
+    """Add outbox rows to `db`'s open transaction; they are committed (or not) with it."""
+    if rows:
+        await db.execute(insert(outbox_table), rows)
+
+
+def backoff_delay(attempts: int, base: float = OUTBOX_BACKOFF_BASE, cap: float = OUTBOX_BACKOFF_MAX) -> float:
+    """Seconds before retry number `attempts`: exponential, capped, with jitter so failures don't retry in lockstep."""
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _create_table(session):
+    outbox_table.create(session.connection(), checkfirst=True)
+
+
+async def create_outbox_tables(session_factory, databases: list[str]) -> None:
+    """Create the outbox table on each database where it is missing: a deploy step, never run at startup."""
+    for name in databases:
+        async with session_factory(shard=name) as db:
+            await db.run_sync(_create_table)
+            await db.commit()
+
+
+def outbox_ddl(dialect) -> list[str]:
+    """CREATE TABLE/INDEX statements of the outbox for `dialect`, for DBAs applying it by hand."""
+    from sqlalchemy.schema import CreateIndex, CreateTable
+
+    statements = [CreateTable(outbox_table)] + [CreateIndex(index) for index in outbox_table.indexes]
+    return [str(statement.compile(dialect=dialect)).strip() + ";" for statement in statements]
+
+
+class OutboxWorker:
+    """Drains the registration outbox of every database in the background.
+
+    Due events are claimed in batches by pushing their next_attempt_at one lease into
+    the future with a conditional UPDATE, so several worker processes can drain the
+    same outbox without sending an event twice. Claimed events are delivered
+    concurrently through the channel's sender. Delivered events are kept with status
+    "sent" (or "logged" when the sender only logs) and their sent_at time; the card's
+    sms/omail columns are the member's opt-ins and are never written here. Failed ones
+    are retried with exponential backoff, and after `max_attempts` (or a permanent
+    SendFailed) they are kept with status "dead" for inspection and requeueing.
+
+    The registration_outbox table is not created here: run
+    `python -m app.cli create-outbox-tables` (or apply its --print DDL) once per database.
+    """
+
+    def __init__(self, session_factory, databases, senders: dict, batch_size: int = OUTBOX_BATCH_SIZE,
+                 concurrency: int = OUTBOX_CONCURRENCY, poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, lease: float = OUTBOX_LEASE, backoff=backoff_delay,
+                 clock=utcnow):
+        self.session_factory = session_factory  # session_factory(shard=name): a session on that database
+        self.databases = databases  # callable returning the database (shard) names to drain
+        self.senders = senders
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.backoff = backoff
+        self._clock = clock
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self.counts = {"sent": 0, "retried": 0, "dead": 0}
+        self.sent_by_kind: dict[str, int] = {}
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        """Wake the drain loop now instead of at the next poll (called after a registration commits)."""
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            processed = 0
+            for name in self.databases():
+                if self._stopping:
+                    break
+                try:
+                    processed += await self.drain_once(name)
+                except Exception as e:
+                    logger.error("Draining the outbox of %s failed: %s", name, e)
+            if processed:
+                continue  # more may be waiting behind a full batch
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self, database: str) -> int:
+        """Claim and deliver one batch of due events from `database`; returns how many were claimed."""
+        now = self._clock()
+        async with self.session_factory(shard=database) as db:
+            query = (
+                select(outbox_table)
+                .where(outbox_table.c.status == "pending", outbox_table.c.next_attempt_at <= now)
+                .order_by(outbox_table.c.next_attempt_at.asc())
+                .limit(self.batch_size)
+            )
+            due = (await db.execute(query)).mappings().all()
+            claimed = []
+            for event in due:
+                result = await db.execute(
+                    update(outbox_table)
+                    .where(outbox_table.c.id == event["id"], outbox_table.c.next_attempt_at == event["next_attempt_at"])
+                    .values(next_attempt_at=now + timedelta(seconds=self.lease), attempts=event["attempts"] + 1)
+                )
+                if result.rowcount == 1:
+                    claimed.append(event)
+            await db.commit()
+        if not claimed:
+            return 0
+
+        errors = await asyncio.gather(*(self._deliver(event) for event in claimed))
+
+        now = self._clock()
+        async with self.session_factory(shard=database) as db:
+            for event, error in zip(claimed, errors):
+                await self._record(db, event, error, now)
+            await db.commit()
+        logger.debug("Outbox of %s: %s event(s) processed", database, len(claimed))
+        return len(claimed)
+
+    async def _deliver(self, event) -> Exception | None:
+        payload = json.loads(event["payload"])
+        channel = CHANNELS.get(event["kind"])
+        sender = self.senders.get(channel)
+        if sender is None:
+            return SendFailed(f"No sender for event kind {event['kind']}")
+        recipient = payload.get("cellulare") if channel == "sms" else payload.get("Email")
+        async with self._semaphore:
+            try:
+                await sender.send(recipient, event["kind"], payload)
+            except Exception as e:
+                return e
+        return None
+
+    async def _record(self, db, event, error: Exception | None, now: datetime):
+        attempts = event["attempts"] + 1
+        row = outbox_table.c.id == event["id"]
+        if error is None:
+            self.counts["sent"] += 1
+            self.sent_by_kind[event["kind"]] = self.sent_by_kind.get(event["kind"], 0) + 1
+            # Only a sender that really delivers (not the log/fake ones) counts as having reached the member
+            delivered = getattr(self.senders.get(CHANNELS.get(event["kind"])), "delivers", False)
+            await db.execute(update(outbox_table).where(row).values(
+                status="sent" if delivered else "logged", sent_at=now, last_error=None,
+            ))
+            return
+
+        message = f"{type(error).__name__}: {error}"[:500]
+        if isinstance(error, SendFailed) or attempts >= self.max_attempts:
+            self.counts["dead"] += 1
+            logger.error("Outbox event %s (%s, IDvip %s) dead-lettered after %s attempt(s): %s",
+                         event["id"], event["kind"], event["IDvip"], attempts, message)
+            values = {"status": "dead", "last_error": message}
+        else:
+            self.counts["retried"] += 1
+            logger.warning("Outbox event %s (%s) failed, retry %s: %s", event["id"], event["kind"], attempts, message)
+            values = {"next_attempt_at": now + timedelta(seconds=self.backoff(attempts)), "last_error": message}
+        await db.execute(update(outbox_table).where(row).values(values))
+
+    async def requeue_dead(self, database: str) -> int:
+        """Give dead events of `database` a fresh set of attempts."""
+        async with self.session_factory(shard=database) as db:
+            result = await db.execute(
+                update(outbox_table).where(outbox_table.c.status == "dead")
+                .values(status="pending", attempts=0, next_attempt_at=self._clock())
+            )
+            await db.commit()
+        self.notify()
+        return result.rowcount
+
+    async def backlog(self) -> dict:
+        """Pending and dead events per database."""
+        report = {}
+        for name in self.databases():
+            async with self.session_factory(shard=name) as db:
+                query = select(outbox_table.c.status, func.count()).group_by(outbox_table.c.status)
+                report[name] = dict((await db.execute(query)).all())
+        return report
+
+    def stats(self) -> dict:
+        return {**self.counts, "sent_by_kind": dict(self.sent_by_kind),
+                "running": self._task is not None and not self._task.done()}
+
+    async def aclose(self, timeout: float = 5.0):
+        """Stop the drain loop, letting an in-flight batch finish (up to `timeout`) so its results are recorded."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Outbox worker did not stop within %ss, cancelling it", timeout)
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for sender in self.senders.values():
+            await sender.aclose()
+
+
+def create_outbox_worker(session_factory, databases) -> OutboxWorker | None:
+    """Build the worker from environment settings; None when OUTBOX_ENABLED=0."""
+    if not OUTBOX_ENABLED:
+        return None
+    senders = {channel: create_sender(channel) for channel in set(CHANNELS.values())}
+    return OutboxWorker(session_factory, databases, senders)
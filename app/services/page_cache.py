@@ -0,0 +1,97 @@
+# app/services/page_cache.py
+from collections import OrderedDict
+from fastapi import Request
+from fastapi.responses import Response
+from app.services.compression import accepted_encoding, compress, etag_matches
+import hashlib
+import logging
+import os
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+REGISTER_FORM_CACHE_SIZE = int(os.getenv("REGISTER_FORM_CACHE_SIZE", "4096"))
+# Browsers and proxies may reuse the form this long, then revalidate with If-None-Match
+REGISTER_FORM_MAX_AGE = int(os.getenv("REGISTER_FORM_MAX_AGE", "60"))
+
+
+class CachedPage:
+    """A rendered page with its ETag and precompressed bodies."""
+
+    __slots__ = ("body", "etag", "encoded")
+
+    def __init__(self, html: str):
+        self.body = html.encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.encoded = compress(self.body)
+
+    def response(self, request: Request, cacheable: bool = True, max_age: int = REGISTER_FORM_MAX_AGE) -> Response:
+        headers = {"Vary": "Accept-Encoding"}
+        if cacheable:
+            headers.update({"ETag": self.etag, "Cache-Control": f"public, max-age={max_age}"})
+            if etag_matches(request.headers.get("if-none-match"), self.etag):
+                return Response(status_code=304, headers=headers)
+        encoding = accepted_encoding(request.headers.get("accept-encoding"), self.encoded)
+        body = self.body
+        if encoding is not None:
+            body = self.encoded[encoding]
+            headers["Content-Encoding"] = encoding
+        return Response(body, headers=headers, media_type="text/html")
+
+
+class PageCache:
+    """Bounded LRU of rendered pages.
+
+    Pages only depend on the key (store token, warning variant) and on settings that
+    are fixed for the life of the process, so entries never expire; whether a token
+    is still valid is decided before the cache is consulted.
+    """
+
+    def __init__(self, maxsize: int = REGISTER_FORM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._pages: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> CachedPage | None:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def set(self, key, page: CachedPage) -> CachedPage:
+        if self.maxsize <= 0:
+            return page
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+        return page
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._pages)
+            self._pages.clear()
+        return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._pages)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+page_cache = PageCache()
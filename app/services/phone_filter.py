@@ -0,0 +1,242 @@
+# app/services/phone_filter.py
+from sqlalchemy import func, select
+from app.services.store_tables import store_table
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import shlex
+import sys
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PHONE_FILTER_ENABLED = os.getenv("PHONE_FILTER_ENABLED", "0").lower() in ("1", "true", "yes")
+PHONE_FILTER_ERROR_RATE = float(os.getenv("PHONE_FILTER_ERROR_RATE", "0.001"))
+PHONE_FILTER_RECONCILE_SECONDS = float(os.getenv("PHONE_FILTER_RECONCILE_SECONDS", "300"))
+# Rows read per keyset page while building a filter
+BUILD_PAGE_SIZE = 5000
+MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for `capacity` items at `error_rate`."""
+
+    def __init__(self, capacity: int, error_rate: float = PHONE_FILTER_ERROR_RATE):
+        self.capacity = max(capacity, 1)
+        self.num_bits = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def false_positive_rate(self) -> float:
+        """Expected false-positive rate at the current fill."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+
+class PhoneFilterRegistry:
+    """Per-store Bloom filters of registered phone numbers.
+
+    `might_contain` answers False only for numbers definitely not in the store
+    table, letting callers skip the database; True means "possibly registered" and
+    must be confirmed with a query. Filters are built lazily in the background on
+    first use (callers query the database meanwhile), updated on every successful
+    registration in this worker, and periodically rebuilt from the table. A rebuild
+    that was running when its table was invalidated is dropped, not installed.
+
+    The filters live in one process and only see that process's registrations, so a
+    negative is only trustworthy when a single worker serves the app: with several,
+    a number registered through another worker is missed until the next rebuild.
+    Use create_phone_filters(), which refuses to enable them in that case.
+    """
+
+    def __init__(self, session_factory, error_rate: float = PHONE_FILTER_ERROR_RATE,
+                 reconcile_seconds: float = PHONE_FILTER_RECONCILE_SECONDS, clock=time.monotonic):
+        self.session_factory = session_factory  # session_factory(table_name): a session on the table's database
+        self.error_rate = error_rate
+        self.reconcile_seconds = reconcile_seconds
+        self._clock = clock
+        self.filters: dict[str, BloomFilter] = {}
+        self.built_at: dict[str, float] = {}
+        self._building: dict[str, list] = {}  # table -> numbers added while a rebuild is running
+        # Bumped by invalidate(): a rebuild that started before is dropped instead of installed
+        self._generations: dict[str, int] = {}
+        self._generation = 0
+        self._tasks = set()
+        self.skipped_queries = 0
+        self.confirmations = 0
+
+    def might_contain(self, table_name: str, number: str) -> bool:
+        bloom = self.filters.get(table_name)
+        self._schedule_build_if_needed(table_name, bloom)
+        if bloom is None:
+            return True
+        if number in bloom:
+            self.confirmations += 1
+            return True
+        self.skipped_queries += 1
+        return False
+
+    def add(self, table_name: str, number: str) -> None:
+        bloom = self.filters.get(table_name)
+        if bloom is not None:
+            bloom.add(number)
+        if table_name in self._building:
+            self._building[table_name].append(number)
+
+    def _schedule_build_if_needed(self, table_name: str, bloom: BloomFilter | None):
+        if table_name in self._building:
+            return
+        stale = bloom is None or bloom.count > bloom.capacity or (
+            self._clock() - self.built_at.get(table_name, 0.0) > self.reconcile_seconds
+        )
+        if not stale:
+            return
+        self._building[table_name] = []
+        task = asyncio.create_task(self._build_in_background(table_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _build_in_background(self, table_name: str):
+        try:
+            async with self.session_factory(table_name) as db:
+                await self.build(db, table_name)
+        except Exception as e:
+            logger.error("Building phone filter for %s failed: %s", table_name, e)
+        finally:
+            self._building.pop(table_name, None)
+
+    async def build(self, db, table_name: str) -> BloomFilter:
+        """(Re)build the filter of `table_name` from the table and swap it in."""
+        self._building.setdefault(table_name, [])
+        try:
+            return await self._build(db, table_name)
+        finally:
+            self._building.pop(table_name, None)
+
+    def _generation_of(self, table_name: str) -> tuple[int, int]:
+        return self._generation, self._generations.get(table_name, 0)
+
+    async def _build(self, db, table_name: str) -> BloomFilter:
+        started = self._clock()
+        generation = self._generation_of(table_name)
+        table = store_table(table_name)
+        count_query = select(func.count()).select_from(table).where(table.c.cellulare != "")
+        count = (await db.execute(count_query)).scalar() or 0
+        bloom = BloomFilter(max(MIN_CAPACITY, 2 * count), self.error_rate)
+        query = (
+            select(table.c.IDvip, table.c.cellulare).where(table.c.cellulare != "")
+            .order_by(table.c.IDvip.asc()).limit(BUILD_PAGE_SIZE)
+        )
+        after = 0
+        while True:
+            rows = (await db.execute(query.where(table.c.IDvip > after))).fetchall()
+            for row in rows:
+                bloom.add(row.cellulare)
+            if len(rows) < BUILD_PAGE_SIZE:
+                break
+            after = rows[-1].IDvip
+        await db.rollback()
+
+        # Registrations that happened while we were scanning may sit behind the keyset cursor
+        for number in self._building.get(table_name, []):
+            bloom.add(number)
+        if self._generation_of(table_name) != generation:
+            # Invalidated mid-scan (e.g. an import): the rows read may predate it, so the next lookup rebuilds
+            logger.info("Discarded phone filter for %s: invalidated while it was being built", table_name)
+            return bloom
+        self.filters[table_name] = bloom
+        self.built_at[table_name] = self._clock()
+        logger.info(
+            "Built phone filter for %s: %s number(s), %s bytes, in %.3fs",
+            table_name, bloom.count, bloom.memory_bytes, self._clock() - started,
+        )
+        return bloom
+
+    def invalidate(self, table_name: str | None = None):
+        if table_name is None:
+            self._generation += 1
+            self.filters.clear()
+            self.built_at.clear()
+        else:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            self.filters.pop(table_name, None)
+            self.built_at.pop(table_name, None)
+
+    def stats(self) -> dict:
+        stores = {
+            name: {
+                "numbers": bloom.count,
+                "capacity": bloom.capacity,
+                "memory_bytes": bloom.memory_bytes,
+                "hashes": bloom.num_hashes,
+                "false_positive_rate": bloom.false_positive_rate(),
+                "age_seconds": self._clock() - self.built_at.get(name, 0.0),
+            }
+            for name, bloom in self.filters.items()
+        }
+        return {"skipped_queries": self.skipped_queries, "confirmations": self.confirmations, "stores": stores}
+
+    async def aclose(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def worker_count(argv: list[str] | None = None, environ=None) -> int:
+    """Worker processes serving the app, as far as this process can tell.
+
+    WEB_CONCURRENCY, then `-w`/`--workers` on the server's command line (uvicorn,
+    gunicorn) or in GUNICORN_CMD_ARGS. Workers set only in a gunicorn config file
+    are invisible here: set WEB_CONCURRENCY as well in that case.
+    """
+    environ = os.environ if environ is None else environ
+    argv = sys.argv if argv is None else argv
+    counts = [int(environ.get("WEB_CONCURRENCY", "1"))]
+    for args in (argv[1:], shlex.split(environ.get("GUNICORN_CMD_ARGS", ""))):
+        for i, arg in enumerate(args):
+            value = None
+            if arg in ("-w", "--workers") and i + 1 < len(args):
+                value = args[i + 1]
+            elif arg.startswith("--workers="):
+                value = arg.partition("=")[2]
+            elif arg.startswith("-w") and arg[2:].isdigit():
+                value = arg[2:]
+            if value is not None and value.isdigit():
+                counts.append(int(value))
+    return max(counts)
+
+
+def create_phone_filters(session_factory, workers: int | None = None) -> PhoneFilterRegistry | None:
+    """Build the registry from environment settings; None when disabled or when several workers serve the app."""
+    if not PHONE_FILTER_ENABLED:
+        return None
+    workers = worker_count() if workers is None else workers
+    if workers > 1:
+        logger.warning(
+            "PHONE_FILTER_ENABLED ignored: %s workers would each answer from their own filter "
+            "and miss numbers registered through the others", workers,
+        )
+        return None
+    return PhoneFilterRegistry(session_factory)
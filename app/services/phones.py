@@ -0,0 +1,85 @@
+# app/services/phones.py
+from sqlalchemy import inspect, select, text
+from app.services.shards import InvalidStoreTable, validate_table_name
+from app.services.store_tables import store_table
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PHONE_LOOKUP_CHUNK = int(os.getenv("PHONE_LOOKUP_CHUNK", "500"))
+
+
+def chunked(items, size: int):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def find_existing_phones(db, table_name: str, numbers, chunk_size: int = PHONE_LOOKUP_CHUNK) -> set[str]:
+    """Return the subset of normalized `numbers` already registered in `table_name`.
+
+    Numbers are resolved in chunks of IN (...) lookups, which use the cellulare index
+    when the table has one.
+    """
+    table = store_table(table_name)
+    existing = set()
+    for chunk in chunked(numbers, chunk_size):
+        # IN with an expanding parameter: one cached statement whatever the chunk length
+        query = select(table.c.cellulare).where(table.c.cellulare.in_(chunk))
+        existing.update((await db.execute(query)).scalars().all())
+    return existing
+
+
+async def phone_exists(db, table_name: str, number: str) -> bool:
+    """Whether the normalized `number` is already registered in `table_name`."""
+    table = store_table(table_name)
+    query = select(table.c.IDvip).where(table.c.cellulare == number).limit(1)
+    return (await db.execute(query)).first() is not None
+
+
+def _phone_indexed(session, table_name: str) -> bool:
+    inspector = inspect(session.connection())
+    indexes = inspector.get_indexes(table_name)
+    indexes += inspector.get_unique_constraints(table_name)
+    pk = inspector.get_pk_constraint(table_name)
+    leading = [index["column_names"][0] for index in indexes if index["column_names"]]
+    leading += pk["constrained_columns"][:1]
+    return "cellulare" in leading
+
+
+async def has_phone_index(db, table_name: str) -> bool:
+    """Whether some index of `table_name` starts with cellulare, so phone lookups avoid a full scan."""
+    return await db.run_sync(_phone_indexed, table_name)
+
+
+async def check_phone_indexes(db, store_session=None) -> dict[str, bool]:
+    """Check every active store table for a cellulare index, logging a warning for each one missing.
+
+    `store_session(db, table_name)` gives a session on the database holding the table;
+    without it every table is looked for on `db`'s database.
+    """
+    table_names = (await db.execute(text("SELECT DISTINCT dbnome FROM cliente WHERE active = 1"))).scalars().all()
+    report = {}
+    for table_name in table_names:
+        try:
+            validate_table_name(table_name)
+            if store_session is None:
+                report[table_name] = await has_phone_index(db, table_name)
+            else:
+                async with store_session(db, table_name) as store_db:
+                    report[table_name] = await has_phone_index(store_db, table_name)
+        except InvalidStoreTable as e:
+            logger.error("Skipping store table: %s", e)
+            continue
+        except Exception as e:
+            logger.error("Could not inspect indexes of store table %s: %s", table_name, e)
+            continue
+        if not report[table_name]:
+            logger.warning(
+                "Store table %s has no index on cellulare; phone checks will scan the whole table. "
+                "Consider: CREATE INDEX idx_%s_cellulare ON %s (cellulare)",
+                table_name, table_name, table_name,
+            )
+    return report
@@ -0,0 +1,161 @@
+# app/services/rate_limit.py
+from collections import OrderedDict
+from typing import NamedTuple
+import logging
+import os
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Off by default. Limits are per worker process with the memory backend, so the
+# effective limit is the configured one times the number of workers. In-store
+# registrations share one address (store WiFi, carrier NAT) and cost a few limited
+# requests each (check-phone, register, barcode), so the per-IP default leaves room
+# for a busy store; no per-token limit unless configured, so campaign bursts pass.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "0").lower() not in ("0", "false", "no")
+RATE_LIMIT_PER_IP = os.getenv("RATE_LIMIT_PER_IP", "300/60")
+RATE_LIMIT_PER_TOKEN = os.getenv("RATE_LIMIT_PER_TOKEN", "0")
+
+
+class RateLimit(NamedTuple):
+    """Token bucket: up to `capacity` requests at once, refilled evenly over `period` seconds."""
+
+    capacity: int
+    period: float
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.period
+
+
+def parse_rate(spec: str) -> RateLimit | None:
+    """Parse "20/60" (20 requests per 60 seconds); empty or "0" disables the limit."""
+    spec = spec.strip()
+    if not spec or spec == "0":
+        return None
+    capacity, _, period = spec.partition("/")
+    return RateLimit(int(capacity), float(period or 60))
+
+
+class MemoryRateLimitBackend:
+    """Token buckets kept in this worker's memory.
+
+    Each worker process limits on its own, so the effective limit is roughly the
+    configured one times the number of workers. A shared backend (e.g. Redis) only
+    needs the same `hit`/`aclose` methods.
+    """
+
+    def __init__(self, max_keys: int = 100_000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: OrderedDict = OrderedDict()  # key -> (tokens, updated_at)
+
+    async def hit(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        """Take `cost` tokens from the bucket; returns 0 if allowed, else seconds until it would be."""
+        now = self._clock()
+        tokens, updated_at = self._buckets.get(key, (float(limit.capacity), now))
+        tokens = min(float(limit.capacity), tokens + (now - updated_at) * limit.refill_rate)
+        if tokens >= cost:
+            retry_after = 0.0
+            tokens -= cost
+        else:
+            retry_after = (cost - tokens) / limit.refill_rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        # Least recently seen keys go first; a forgotten key just starts again with a full bucket
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def aclose(self):
+        pass
+
+
+class FakeRateLimitBackend:
+    """Local stand-in for tests and load tests: allows everything unless told otherwise."""
+
+    def __init__(self, retry_after: float = 0.0, error: Exception | None = None):
+        self.retry_after = retry_after
+        self.error = error
+        self.calls = []
+
+    async def hit(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        self.calls.append(key)
+        if self.error is not None:
+            raise self.error
+        return self.retry_after
+
+    async def aclose(self):
+        pass
+
+
+class RateLimiter:
+    """Applies the per-IP and per-store-token limits on top of a backend.
+
+    The IP bucket is checked first, so a single abusive client is turned away without
+    draining the store's bucket for everyone else. If the backend fails, requests are
+    let through (and counted) rather than taking the registration flow down with it.
+    """
+
+    def __init__(self, backend, per_ip: RateLimit | None = None, per_token: RateLimit | None = None):
+        self.backend = backend
+        self.per_ip = per_ip
+        self.per_token = per_token
+        self.allowed = 0
+        self.limited = {"ip": 0, "token": 0}
+        self.backend_errors = 0
+
+    async def check(self, ip: str | None, token: str | None) -> float:
+        """Seconds the client should wait before retrying; 0 if the request may proceed."""
+        for scope, key, limit in (("ip", ip, self.per_ip), ("token", token, self.per_token)):
+            if limit is None or key is None:
+                continue
+            try:
+                retry_after = await self.backend.hit(f"{scope}:{key}", limit)
+            except Exception as e:
+                self.backend_errors += 1
+                logger.warning("Rate limit backend failed, letting request through: %s", e)
+                return 0.0
+            if retry_after > 0:
+                self.limited[scope] += 1
+                return retry_after
+        self.allowed += 1
+        return 0.0
+
+    def stats(self) -> dict:
+        stats = {
+            "allowed": self.allowed,
+            "limited_ip": self.limited["ip"],
+            "limited_token": self.limited["token"],
+            "backend_errors": self.backend_errors,
+        }
+        if isinstance(self.backend, MemoryRateLimitBackend):
+            stats["tracked_keys"] = len(self.backend)
+        return stats
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+
+def create_rate_limiter() -> RateLimiter | None:
+    """Build the limiter from environment settings; None unless RATE_LIMIT_ENABLED=1."""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    backend_name = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+    if backend_name == "fake":
+        logger.warning("Using fake rate limit backend: no request is ever limited")
+        backend = FakeRateLimitBackend()
+    elif backend_name == "memory":
+        backend = MemoryRateLimitBackend(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend_name}")
+
+    return RateLimiter(
+        backend,
+        per_ip=parse_rate(RATE_LIMIT_PER_IP),
+        per_token=parse_rate(RATE_LIMIT_PER_TOKEN),
+    )
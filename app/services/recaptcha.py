@@ -0,0 +1,149 @@
+# app/services/recaptcha.py
+import asyncio
+import logging
+import os
+
+from app.settings import get_settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+VERIFICATION_URL = "https://www.google.com/recaptcha/api/siteverify"
+
+
+class RecaptchaUnavailable(Exception):
+    """The verification backend could not give an answer (timeout, network error)."""
+
+
+class RecaptchaOverloaded(Exception):
+    """This worker already has the maximum number of verifications in flight; never fails open."""
+
+
+class GoogleRecaptchaBackend:
+    """Calls Google's siteverify endpoint over a pooled keep-alive HTTP client."""
+
+    def __init__(self, secret_key: str, timeout: float = 3.0, max_connections: int = 20, url: str = VERIFICATION_URL):
+        import httpx  # only needed with the google backend; keeps it out of app import time
+
+        self.secret_key = secret_key
+        self.url = url
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 2.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def verify(self, response_token: str, remote_ip: str | None = None) -> dict:
+        payload = {"secret": self.secret_key, "response": response_token}
+        if remote_ip:
+            payload["remoteip"] = remote_ip
+        response = await self.client.post(self.url, data=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class FakeRecaptchaBackend:
+    """Local stand-in for tests and load tests: answers without any network I/O."""
+
+    def __init__(self, success: bool = True, score: float = 0.9, error: Exception | None = None, delay: float = 0.0):
+        self.success = success
+        self.score = score
+        self.error = error
+        self.delay = delay
+        self.calls = []
+
+    async def verify(self, response_token: str, remote_ip: str | None = None) -> dict:
+        self.calls.append(response_token)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"success": self.success, "score": self.score}
+
+    async def aclose(self):
+        pass
+
+
+class RecaptchaVerifier:
+    """Applies the score threshold, concurrency limit and failure policy on top of a backend.
+
+    With fail_open=True a backend failure lets the registration through (logged as a
+    warning); otherwise RecaptchaUnavailable is raised and the request is rejected.
+    Waiting too long for a concurrency slot is local overload, not a backend failure:
+    it raises RecaptchaOverloaded whatever the policy, so a flood cannot bypass the check.
+    """
+
+    def __init__(self, backend, threshold: float = 0.3, max_concurrency: int = 50,
+                 acquire_timeout: float = 1.0, timeout: float = 5.0, fail_open: bool = False):
+        self.backend = backend
+        self.threshold = threshold
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        self.fail_open = fail_open
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.passed = 0
+        self.rejected = 0
+        self.failures = 0
+        self.overloaded = 0
+
+    async def verify(self, response_token: str, remote_ip: str | None = None) -> bool:
+        # Bound the number of in-flight verifications so a slow Google doesn't pile up requests
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.overloaded += 1
+            raise RecaptchaOverloaded(f"no verification slot within {self.acquire_timeout}s") from None
+        try:
+            result = await asyncio.wait_for(self.backend.verify(response_token, remote_ip), timeout=self.timeout)
+        except Exception as e:
+            self.failures += 1
+            if self.fail_open:
+                logger.warning("reCAPTCHA backend unavailable, failing open: %s", e)
+                return True
+            raise RecaptchaUnavailable(str(e) or type(e).__name__) from e
+        finally:
+            self._semaphore.release()
+
+        logger.debug("reCAPTCHA response: %s", result)
+        if not result.get("success") or result.get("score", 0) < self.threshold:
+            self.rejected += 1
+            logger.warning("reCAPTCHA rejected: success=%s, score=%s", result.get('success'), result.get('score'))
+            return False
+        self.passed += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"passed": self.passed, "rejected": self.rejected, "failures": self.failures,
+                "overloaded": self.overloaded}
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+
+def create_recaptcha_verifier() -> RecaptchaVerifier:
+    """Build the verifier from environment settings; RECAPTCHA_BACKEND=fake needs no network."""
+    settings = get_settings()
+    backend_name = settings.recaptcha_backend
+    timeout = float(os.getenv("RECAPTCHA_TIMEOUT", "3.0"))
+    if backend_name == "fake":
+        logger.warning("Using fake reCAPTCHA backend: every submission is accepted")
+        backend = FakeRecaptchaBackend()
+    elif backend_name == "google":
+        backend = GoogleRecaptchaBackend(
+            settings.recaptcha_secret_key or "",
+            timeout=timeout,
+            max_connections=int(os.getenv("RECAPTCHA_MAX_CONNECTIONS", "20")),
+        )
+    else:
+        raise ValueError(f"Unknown RECAPTCHA_BACKEND: {backend_name}")
+
+    return RecaptchaVerifier(
+        backend,
+        threshold=float(os.getenv("RECAPTCHA_THRESHOLD", "0.3")),
+        max_concurrency=int(os.getenv("RECAPTCHA_MAX_CONCURRENCY", "50")),
+        acquire_timeout=float(os.getenv("RECAPTCHA_ACQUIRE_TIMEOUT", "1.0")),
+        timeout=timeout + 1.0,
+        fail_open=os.getenv("RECAPTCHA_FAIL_OPEN", "0").lower() in ("1", "true", "yes"),
+    )
@@ -0,0 +1,174 @@
+# app/services/shards.py
+from fnmatch import fnmatchcase
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app.settings import get_settings
+from typing import NamedTuple
+import logging
+import re
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Name of the primary database (DATABASE_URL): the cliente table, and every store table not routed elsewhere
+DEFAULT_SHARD = "default"
+
+class InvalidStoreTable(ValueError):
+    """A cliente.dbnome that is not an allowed store table identifier."""
+
+
+class ShardRoute(NamedTuple):
+    """Store tables whose name matches the glob `pattern` live on shard `shard`."""
+
+    pattern: str
+    shard: str
+
+
+def validate_table_name(table_name: str, pattern: str | None = None) -> str:
+    """Return `table_name` if it is an allowed store table identifier, else raise InvalidStoreTable.
+
+    `pattern` defaults to the STORE_TABLE_PATTERN setting, read on each call rather than
+    at import so a value set only in .env is honoured.
+    """
+    pattern = pattern or get_settings().store_table_pattern
+    if not isinstance(table_name, str) or not re.fullmatch(pattern, table_name):
+        raise InvalidStoreTable(f"Not an allowed store table name: {table_name!r}")
+    return table_name
+
+
+def parse_shards(spec: str) -> dict[str, str]:
+    """Parse "eu1=mysql+pymysql://...;eu2=..." into {name: url}."""
+    shards = {}
+    for item in spec.split(";"):
+        if not item.strip():
+            continue
+        name, sep, url = item.partition("=")
+        name = name.strip()
+        if not sep or not name or not url.strip():
+            raise ValueError(f"Invalid DB_SHARDS entry: {item.strip()!r} (expected name=url)")
+        if name == DEFAULT_SHARD:
+            raise ValueError(f"Shard name {DEFAULT_SHARD!r} is reserved for DATABASE_URL")
+        shards[name] = url.strip()
+    return shards
+
+
+def parse_routes(spec: str) -> list[ShardRoute]:
+    """Parse "vip1=eu1;vip2*=eu2" into routes, tried in order."""
+    routes = []
+    for item in spec.split(";"):
+        if not item.strip():
+            continue
+        pattern, sep, shard = item.partition("=")
+        if not sep or not pattern.strip() or not shard.strip():
+            raise ValueError(f"Invalid DB_SHARD_ROUTES entry: {item.strip()!r} (expected pattern=shard)")
+        routes.append(ShardRoute(pattern.strip(), shard.strip()))
+    return routes
+
+
+class _Shard:
+    __slots__ = ("url", "engine", "async_engine", "session_factory", "async_session_factory")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = None
+        self.async_engine = None
+        self.session_factory = None
+        self.async_session_factory = None
+
+
+class ShardRouter:
+    """Maps store tables (cliente.dbnome) to the database holding them.
+
+    Tables not matched by any route stay on the primary database, so with no shards
+    configured every table is served by the existing engines. Engines of the other
+    shards are created on first use, each with its own pool, sized by the
+    `engine_factory`/`async_engine_factory` passed in. Every table name is checked
+    against the allow-list pattern before it is routed, which is what makes it safe
+    to interpolate into SQL afterwards.
+    """
+
+    def __init__(self, shards: dict[str, str] | None = None, routes: list[ShardRoute] | None = None,
+                 engine_factory=None, async_engine_factory=None, table_pattern: str | None = None):
+        self.shards = {name: _Shard(url) for name, url in (shards or {}).items()}
+        self.routes = list(routes or [])
+        for route in self.routes:
+            if route.shard != DEFAULT_SHARD and route.shard not in self.shards:
+                raise ValueError(f"Route {route.pattern!r} points to unknown shard {route.shard!r}")
+        self.engine_factory = engine_factory
+        self.async_engine_factory = async_engine_factory
+        self.table_pattern = table_pattern
+        self._resolved: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def shard_for(self, table_name: str) -> str:
+        shard = self._resolved.get(table_name)
+        if shard is None:
+            validate_table_name(table_name, self.table_pattern)
+            shard = next((r.shard for r in self.routes if fnmatchcase(table_name, r.pattern)), DEFAULT_SHARD)
+            self._resolved[table_name] = shard
+        return shard
+
+    def is_default(self, table_name: str) -> bool:
+        return self.shard_for(table_name) == DEFAULT_SHARD
+
+    def _shard(self, name: str) -> _Shard:
+        try:
+            return self.shards[name]
+        except KeyError:
+            raise ValueError(f"Unknown shard: {name}") from None
+
+    def session_factory(self, name: str):
+        """sessionmaker bound to shard `name`, creating its engine on first use."""
+        shard = self._shard(name)
+        with self._lock:
+            if shard.engine is None:
+                shard.engine = self.engine_factory(shard.url)
+                shard.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=shard.engine)
+                logger.info("Database engine created for shard %s", name)
+        return shard.session_factory
+
+    def async_session_factory(self, name: str):
+        """async_sessionmaker bound to shard `name`, creating its engine on first use."""
+        shard = self._shard(name)
+        with self._lock:
+            if shard.async_engine is None:
+                shard.async_engine = self.async_engine_factory(shard.url)
+                shard.async_session_factory = async_sessionmaker(shard.async_engine, autoflush=False,
+                                                                 expire_on_commit=False)
+                logger.info("Async database engine created for shard %s", name)
+        return shard.async_session_factory
+
+    def engines(self):
+        """(shard, kind, sync Engine) of every engine created so far, for pool reporting."""
+        for name, shard in self.shards.items():
+            if shard.engine is not None:
+                yield name, "sync", shard.engine
+            if shard.async_engine is not None:
+                yield name, "async", shard.async_engine.sync_engine
+
+    def stats(self) -> dict:
+        tables: dict[str, list] = {}
+        for table_name, shard in sorted(self._resolved.items()):
+            tables.setdefault(shard, []).append(table_name)
+        return {
+            "shards": {
+                name: {"open": shard.engine is not None or shard.async_engine is not None,
+                       "tables": tables.get(name, [])}
+                for name, shard in self.shards.items()
+            },
+            "default_tables": tables.get(DEFAULT_SHARD, []),
+            "routes": [list(route) for route in self.routes],
+        }
+
+    def reset_after_fork(self):
+        for _, _, engine in self.engines():
+            engine.dispose(close=False)
+
+    async def dispose(self):
+        for name, shard in self.shards.items():
+            if shard.async_engine is not None:
+                await shard.async_engine.dispose()
+            if shard.engine is not None:
+                shard.engine.dispose()
+            shard.engine = shard.async_engine = shard.session_factory = shard.async_session_factory = None
@@ -0,0 +1,190 @@
+# app/services/slot_pool.py
+from collections import deque
+from sqlalchemy import select
+from app.models.vip import vip_columns
+from app.services.slots import ClaimedCard, NoFreeSlot, claim_params, claim_slot, try_claim
+from app.services.store_tables import store_table
+import asyncio
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Off by default: every worker process prefetches the same ascending IDs, so with several
+# busy workers the pools keep colliding and claim_slot's SKIP LOCKED scan does better
+SLOT_POOL_ENABLED = os.getenv("SLOT_POOL_ENABLED", "0").lower() not in ("0", "false", "no")
+SLOT_POOL_BATCH = int(os.getenv("SLOT_POOL_BATCH", "200"))
+SLOT_POOL_LOW_WATERMARK = int(os.getenv("SLOT_POOL_LOW_WATERMARK", "50"))
+# Stale candidates tolerated per claim before falling back to claim_slot
+SLOT_POOL_MAX_STALE = int(os.getenv("SLOT_POOL_MAX_STALE", "3"))
+SLOT_LOW_STOCK_THRESHOLD = int(os.getenv("SLOT_LOW_STOCK_THRESHOLD", "100"))
+
+
+class StoreSlotPool:
+    """Free cards (IDvip, code) of one store table, prefetched in IDvip order.
+
+    The pool is refilled in batches with a keyset scan (IDvip > last seen), so a
+    registration pops a candidate in O(1) instead of scanning for stato = 1. Popped
+    IDs are still claimed with the conditional UPDATE from app.services.slots. A card
+    taken by another worker since the refill means the rest of the batch is probably
+    gone too, so the pool drops it and rescans from that card (one SELECT) instead of
+    trying each stale ID; after `max_stale` such misses in one claim it falls back to
+    claim_slot, which never raises SlotContention while free cards exist.
+    """
+
+    def __init__(self, table_name: str, batch_size: int = SLOT_POOL_BATCH,
+                 low_watermark: int = SLOT_POOL_LOW_WATERMARK, low_stock_threshold: int = SLOT_LOW_STOCK_THRESHOLD,
+                 max_stale: int = SLOT_POOL_MAX_STALE):
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.low_stock_threshold = low_stock_threshold
+        self.max_stale = max_stale
+        self.free = deque()
+        self.last_id = 0  # keyset cursor of the refill scan
+        self.scan_complete = False  # the scan reached the end of the table
+        self.low_stock = False
+        self._lock = asyncio.Lock()
+        self.claims = 0
+        self.stale = 0
+        self.refills = 0
+        self.fallbacks = 0
+
+    async def refill(self, db) -> int | None:
+        """Fetch the next batch of free cards; wraps around once the end of the table is reached.
+
+        Returns the number of IDs added, or None if another coroutine already refilled the pool.
+        """
+        async with self._lock:
+            if len(self.free) >= self.low_watermark or (self.scan_complete and self.free):
+                return None
+            if self.scan_complete:
+                # Everything we knew about is gone; rescan from the start to pick up freed or skipped cards
+                self.last_id = 0
+                self.scan_complete = False
+            table = store_table(self.table_name)
+            query = (
+                select(*vip_columns(table, "IDvip", "code"))
+                .where(table.c.stato == 1, table.c.IDvip > self.last_id)
+                .order_by(table.c.IDvip.asc())
+                .limit(self.batch_size)
+            )
+            from_start = self.last_id == 0
+            cards = (await db.execute(query)).fetchall()
+            self.refills += 1
+            if cards:
+                self.free.extend((card.IDvip, card.code) for card in cards)
+                self.last_id = cards[-1].IDvip
+            if len(cards) < self.batch_size:
+                self.scan_complete = True
+            self._check_low_stock()
+            logger.debug("Refilled slot pool for %s with %s card(s), depth %s", self.table_name, len(cards), len(self.free))
+            if from_start and not cards:
+                raise NoFreeSlot(self.table_name)
+            return len(cards)
+
+    def needs_prefetch(self) -> bool:
+        return not self.scan_complete and len(self.free) < self.low_watermark and not self._lock.locked()
+
+    async def claim(self, db, values: dict, before_commit=None) -> ClaimedCard:
+        """Pop free cards until one is successfully claimed; commits on success (see claim_slot for before_commit)."""
+        params = claim_params(values)
+        misses = 0
+        for _ in range(self.batch_size * 2):
+            if not self.free:
+                # Raises NoFreeSlot once a scan from the start of the table finds nothing
+                await self.refill(db)
+                continue
+
+            id_vip, code = self.free.popleft()
+            card = await try_claim(db, self.table_name, id_vip, code, params)
+            if card is not None:
+                if before_commit is not None:
+                    await before_commit(db, card)
+                await db.commit()
+                self.claims += 1
+                self._check_low_stock()
+                return card
+            await db.rollback()
+            self.stale += 1
+            misses += 1
+            if misses >= self.max_stale:
+                break
+            self._resync(id_vip)
+
+        # Another worker is claiming from the same range: let the SKIP LOCKED scan pick a card
+        self.fallbacks += 1
+        self.free.clear()
+        return await claim_slot(db, self.table_name, values, before_commit=before_commit)
+
+    def _resync(self, id_vip: int):
+        """Forget the queued cards and continue the scan after `id_vip`, which another worker took."""
+        self.free.clear()
+        self.last_id = id_vip
+        self.scan_complete = False
+
+    def _check_low_stock(self):
+        # Only the tail of the table is known once the scan is complete, so depth is then a remaining-cards estimate
+        low = self.scan_complete and len(self.free) <= self.low_stock_threshold
+        if low and not self.low_stock:
+            logger.warning("Store table %s is running out of VIP cards: about %s left", self.table_name, len(self.free))
+        self.low_stock = low
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self.free),
+            "scan_complete": self.scan_complete,
+            "low_stock": self.low_stock,
+            "claims": self.claims,
+            "stale": self.stale,
+            "refills": self.refills,
+            "fallbacks": self.fallbacks,
+        }
+
+
+class SlotPoolManager:
+    """Per-store slot pools plus background prefetching when a pool runs low."""
+
+    def __init__(self, session_factory=None, **pool_options):
+        self.session_factory = session_factory  # session_factory(table_name): a session on the table's database
+        self.pool_options = pool_options
+        self.pools: dict[str, StoreSlotPool] = {}
+        self._tasks = set()
+
+    def pool(self, table_name: str) -> StoreSlotPool:
+        pool = self.pools.get(table_name)
+        if pool is None:
+            pool = self.pools[table_name] = StoreSlotPool(table_name, **self.pool_options)
+        return pool
+
+    async def claim(self, db, table_name: str, values: dict, before_commit=None) -> ClaimedCard:
+        pool = self.pool(table_name)
+        card = await pool.claim(db, values, before_commit)
+        if self.session_factory is not None and pool.needs_prefetch():
+            task = asyncio.create_task(self._prefetch(pool))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return card
+
+    async def _prefetch(self, pool: StoreSlotPool):
+        try:
+            async with self.session_factory(pool.table_name) as db:
+                await pool.refill(db)
+                await db.rollback()
+        except Exception as e:
+            logger.error("Background refill of slot pool %s failed: %s", pool.table_name, e)
+
+    def invalidate(self, table_name: str | None = None):
+        if table_name is None:
+            self.pools.clear()
+        else:
+            self.pools.pop(table_name, None)
+
+    def stats(self) -> dict:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    async def aclose(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
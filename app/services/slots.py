@@ -0,0 +1,135 @@
+# app/services/slots.py
+from sqlalchemy import bindparam, select, update
+from typing import NamedTuple
+from app.models.vip import vip_columns
+from app.services.store_tables import store_table
+import logging
+import os
+import random
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Dialects whose SELECT ... FOR UPDATE SKIP LOCKED lets concurrent workers pick different rows
+SKIP_LOCKED_DIALECTS = {"mysql", "postgresql"}
+
+SLOT_CLAIM_ATTEMPTS = int(os.getenv("SLOT_CLAIM_ATTEMPTS", "10"))
+SLOT_SKIP_LOCKED = os.getenv("SLOT_SKIP_LOCKED", "auto").lower()
+
+# After losing a race, pick at random among this many free cards per attempt so
+# contending workers stop piling onto the same lowest IDvip
+RETRY_WINDOW = 4
+
+# Columns written when a pre-printed card is handed to a new member
+CLAIM_FIELDS = ["nascita", "cellulare", "Nome", "cognome", "Email", "Indirizzo", "Citta", "Prov", "Cap"]
+# Marketing opt-ins, written only when the caller collected them (the registration form)
+OPT_IN_FIELDS = ["sms", "omail"]
+
+
+class ClaimedCard(NamedTuple):
+    IDvip: int
+    code: str | None
+
+
+class NoFreeSlot(Exception):
+    """The store table has no card left with stato = 1."""
+
+
+class SlotContention(Exception):
+    """Every attempt to claim a card lost the race to another registration."""
+
+
+def claim_update_query(table_name: str, returning: bool = False):
+    """UPDATE filling in card :card_id; it only matches while the card is still free.
+
+    The CLAIM_FIELDS columns are SET from the parameters the statement is executed
+    with (see claim_params), so one compiled statement serves single claims and
+    executemany batches alike.
+    """
+    table = store_table(table_name)
+    query = update(table).where(table.c.IDvip == bindparam("card_id"), table.c.stato == 1).values(stato=0)
+    return query.returning(table.c.code) if returning else query
+
+
+def claim_params(values: dict, card_id: int | None = None) -> dict:
+    params = {field: values.get(field) for field in CLAIM_FIELDS}
+    params.update({field: bool(values[field]) for field in OPT_IN_FIELDS if field in values})
+    if card_id is not None:
+        params["card_id"] = card_id
+    return params
+
+
+async def try_claim(db, table_name: str, id_vip: int, code: str | None, params: dict) -> ClaimedCard | None:
+    """Run the conditional UPDATE for one candidate card; None if someone else took it.
+
+    Where the backend supports UPDATE ... RETURNING the card's code comes back with
+    the update; otherwise the code read together with the candidate IDvip is used
+    (pre-printed codes never change), so the row is never read back.
+    """
+    returning = db.bind.dialect.update_returning
+    result = await db.execute(claim_update_query(table_name, returning), {**params, "card_id": id_vip})
+    if returning:
+        row = result.fetchone()
+        if row is None:
+            return None
+        code = row._mapping["code"]
+    elif result.rowcount != 1:
+        return None
+    return ClaimedCard(id_vip, code)
+
+
+async def claimed_card_exists(db, table_name: str, code: str) -> bool:
+    """Whether `code` is the code of a card of `table_name` that has been handed to a member."""
+    table = store_table(table_name)
+    query = select(table.c.IDvip).where(table.c.code == code, table.c.stato == 0).limit(1)
+    return (await db.execute(query)).first() is not None
+
+
+def use_skip_locked(dialect_name: str) -> bool:
+    if SLOT_SKIP_LOCKED == "auto":
+        return dialect_name in SKIP_LOCKED_DIALECTS
+    return SLOT_SKIP_LOCKED in ("1", "true", "yes")
+
+
+async def claim_slot(db, table_name: str, values: dict, max_attempts: int = SLOT_CLAIM_ATTEMPTS,
+                     before_commit=None) -> ClaimedCard:
+    """Atomically assign the first free card of `table_name` and return its IDvip and code.
+
+    The UPDATE only matches while the row still has stato = 1, so a card can never be
+    handed out twice even without row locks: if another worker took the candidate
+    first, the UPDATE touches no rows and we retry with the next free card. Where the
+    backend supports it, FOR UPDATE SKIP LOCKED makes concurrent workers pick
+    different candidates in the first place. Commits on success, after awaiting
+    `before_commit(db, card)` so its writes (outbox events) share the claim's transaction.
+    """
+    table = store_table(table_name)
+    select_query = (
+        select(*vip_columns(table, "IDvip", "code")).where(table.c.stato == 1).order_by(table.c.IDvip.asc())
+    )
+    if use_skip_locked(db.bind.dialect.name):
+        select_query = select_query.with_for_update(skip_locked=True)
+    params = claim_params(values)
+
+    for attempt in range(1, max_attempts + 1):
+        # First attempt keeps handing out cards in IDvip order; retries spread out
+        limit = 1 if attempt == 1 else RETRY_WINDOW * attempt
+        candidates = (await db.execute(select_query.limit(limit))).fetchall()
+        if not candidates:
+            await db.rollback()
+            raise NoFreeSlot(table_name)
+
+        candidate = random.choice(candidates)._mapping
+        id_vip = candidate["IDvip"]
+        card = await try_claim(db, table_name, id_vip, candidate["code"], params)
+        if card is not None:
+            if before_commit is not None:
+                await before_commit(db, card)
+            await db.commit()
+            logger.debug("Claimed IDvip %s in %s on attempt %s", id_vip, table_name, attempt)
+            return card
+
+        # Lost the race: end the transaction so the next SELECT sees the other worker's commit
+        await db.rollback()
+        logger.info("IDvip %s in %s was taken concurrently, retrying (attempt %s)", id_vip, table_name, attempt)
+
+    raise SlotContention(table_name)
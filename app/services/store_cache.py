@@ -0,0 +1,135 @@
+# app/services/store_cache.py
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def token_expires_in(cliente, now: datetime | None = None) -> float | None:
+    """Seconds until the store's registration token expires, or None if it never does.
+
+    MySQL zero dates ("0000-00-00 00:00:00") come back from the driver as strings
+    or None, and are treated as "no expiry".
+    """
+    scadenza = getattr(cliente, "data_scadenza_token", None)
+    if not isinstance(scadenza, datetime):
+        return None
+    now = now or datetime.now()
+    return (scadenza - now).total_seconds()
+
+
+class StoreCache:
+    """Bounded LRU/TTL cache mapping registration tokens to Cliente rows.
+
+    Unknown or inactive tokens are cached as negatives (value None) with a shorter
+    TTL, so random tokens sent by bots don't reach the database on every request.
+    Positive entries never outlive the token's data_scadenza_token. Each worker
+    process has its own cache, so invalidation only reaches the worker it runs in;
+    the TTL is what bounds staleness everywhere else.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, negative_ttl: float = 30.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()  # token -> (expires_at, cliente or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str):
+        """Return (found, cliente). cliente is None for a cached negative."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            if entry[1] is None:
+                self.negative_hits += 1
+            return True, entry[1]
+
+    def set(self, token: str, cliente) -> None:
+        ttl = self.ttl
+        remaining = token_expires_in(cliente)
+        if remaining is not None:
+            ttl = min(ttl, max(remaining, 0.0))
+        self._store(token, cliente, ttl)
+
+    def set_missing(self, token: str) -> None:
+        self._store(token, None, self.negative_ttl)
+
+    def _store(self, token: str, value, ttl: float) -> None:
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (self._clock() + ttl, value)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, token: str) -> bool:
+        with self._lock:
+            removed = self._entries.pop(token, None) is not None
+            if removed:
+                self.invalidations += 1
+        if removed:
+            logger.info("Invalidated cached store for token: %s", token)
+        return removed
+
+    def invalidate_store(self, id_negozio: int) -> int:
+        """Drop every cached token that resolves to the given store."""
+        with self._lock:
+            tokens = [
+                token for token, (_, cliente) in self._entries.items()
+                if cliente is not None and cliente.id_negozio == id_negozio
+            ]
+            for token in tokens:
+                del self._entries[token]
+            self.invalidations += len(tokens)
+        logger.info("Invalidated %s cached token(s) for store %s", len(tokens), id_negozio)
+        return len(tokens)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self.invalidations += count
+        logger.info("Cleared store cache (%s entries)", count)
+        return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+store_cache = StoreCache(
+    maxsize=int(os.getenv("STORE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("STORE_CACHE_TTL", "60")),
+    negative_ttl=float(os.getenv("STORE_CACHE_NEGATIVE_TTL", "30")),
+)
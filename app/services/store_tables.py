@@ -0,0 +1,106 @@
+# app/services/store_tables.py
+from collections import OrderedDict
+from sqlalchemy import MetaData, Table, inspect, text
+from app.models.vip import Vip
+from app.services.shards import InvalidStoreTable, validate_table_name
+import logging
+import os
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Store tables (one per dbnome) kept as Table objects; least recently used ones are dropped first
+STORE_TABLE_CACHE_SIZE = int(os.getenv("STORE_TABLE_CACHE_SIZE", "1024"))
+# Compare every active store table with the Vip columns at startup
+STORE_TABLE_REFLECT = os.getenv("STORE_TABLE_REFLECT", "0").lower() in ("1", "true", "yes")
+
+
+class StoreTableRegistry:
+    """Table objects with the Vip column layout, one per store table, in a bounded LRU.
+
+    Queries are built as Core constructs on these tables, so SQLAlchemy compiles each
+    statement shape once per table and reuses it from its compiled cache. Each table
+    gets its own MetaData, so an evicted table (a store that went away) is freed
+    along with it; one that is asked for again is simply recreated.
+    """
+
+    def __init__(self, maxsize: int = STORE_TABLE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._tables: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evictions = 0
+
+    def get(self, table_name: str) -> Table:
+        with self._lock:
+            table = self._tables.get(table_name)
+            if table is not None:
+                self._tables.move_to_end(table_name)
+                return table
+        # The name is validated before it can reach any SQL
+        table = Vip.__table__.to_metadata(MetaData(), name=validate_table_name(table_name))
+        with self._lock:
+            table = self._tables.setdefault(table_name, table)
+            self._tables.move_to_end(table_name)
+            self.created += 1
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+                self.evictions += 1
+        return table
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._tables)
+            self._tables.clear()
+        return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._tables)
+        return {"size": size, "maxsize": self.maxsize, "created": self.created, "evictions": self.evictions}
+
+
+store_tables = StoreTableRegistry()
+
+
+def store_table(table_name: str) -> Table:
+    """The Table for a store's dbnome, with the Vip columns."""
+    return store_tables.get(table_name)
+
+
+def _missing_columns(session, table_name: str) -> list[str]:
+    existing = {column["name"] for column in inspect(session.connection()).get_columns(table_name)}
+    return [column.name for column in Vip.__table__.columns if column.name not in existing]
+
+
+async def load_store_tables(db, store_session=None, reflect: bool = STORE_TABLE_REFLECT) -> dict[str, list[str]]:
+    """Create the Table of every active store up front; with `reflect`, check each against the database.
+
+    Returns the Vip columns missing from each reflected table (logged as errors, since
+    registrations into such a table fail). `store_session(db, table_name)` gives a
+    session on the table's database, as for check_phone_indexes.
+    """
+    table_names = (await db.execute(text("SELECT DISTINCT dbnome FROM cliente WHERE active = 1"))).scalars().all()
+    missing = {}
+    for table_name in table_names[:store_tables.maxsize]:
+        try:
+            store_table(table_name)
+        except InvalidStoreTable as e:
+            logger.error("Skipping store table: %s", e)
+            continue
+        if not reflect:
+            continue
+        try:
+            if store_session is None:
+                missing[table_name] = await db.run_sync(_missing_columns, table_name)
+            else:
+                async with store_session(db, table_name) as store_db:
+                    missing[table_name] = await store_db.run_sync(_missing_columns, table_name)
+        except Exception as e:
+            logger.error("Could not reflect store table %s: %s", table_name, e)
+            continue
+        if missing[table_name]:
+            logger.error("Store table %s lacks columns %s", table_name, ", ".join(missing[table_name]))
+    logger.info("Loaded %s store table(s)", min(len(table_names), store_tables.maxsize))
+    return missing
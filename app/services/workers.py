@@ -0,0 +1,103 @@
+# app/services/workers.py
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+WORKER_POOL_KIND = os.getenv("WORKER_POOL_KIND", "thread").lower()
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+WORKER_POOL_MAX_PENDING = int(os.getenv("WORKER_POOL_MAX_PENDING", "64"))
+
+
+class WorkerPoolSaturated(Exception):
+    """Too many CPU-bound jobs are already queued; the request should be retried later."""
+
+
+def _timed_call(fn, args):
+    # Monotonic readings are only compared within one process, so this also holds for process pools
+    started = time.monotonic()
+    result = fn(*args)
+    return time.monotonic() - started, result
+
+
+class WorkerPool:
+    """Bounded executor for CPU-heavy steps (barcode rendering, template rendering).
+
+    At most `max_pending` jobs may be queued or running; further submissions fail
+    fast with WorkerPoolSaturated (answered with a 503) instead of growing an
+    unbounded backlog that would delay every other request on the worker.
+
+    With kind="process", jobs that can't be pickled (template rendering needs the
+    request) pass thread_only=True and run on a small thread pool instead.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 4, max_pending: int = 64):
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            self._thread_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        elif kind == "thread":
+            self._executor = self._thread_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        else:
+            raise ValueError(f"Unknown worker pool kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, fn, *args, thread_only: bool = False):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning("Worker pool saturated (%s jobs pending), rejecting %s", self.pending, getattr(fn, '__name__', fn))
+            raise WorkerPoolSaturated()
+
+        executor = self._thread_executor if thread_only else self._executor
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        queued_at = time.monotonic()
+        try:
+            ran, result = await loop.run_in_executor(executor, _timed_call, fn, args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.run_seconds += ran
+        self.wait_seconds += max(time.monotonic() - queued_at - ran, 0.0)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "peak_pending": self.peak_pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "avg_wait_ms": 1000 * self.wait_seconds / self.completed if self.completed else 0.0,
+            "avg_run_ms": 1000 * self.run_seconds / self.completed if self.completed else 0.0,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        if self._thread_executor is not self._executor:
+            self._thread_executor.shutdown(wait=wait, cancel_futures=True)
+        logger.info("Worker pool shut down")
+
+
+def create_worker_pool() -> WorkerPool:
+    return WorkerPool(WORKER_POOL_KIND, max_workers=WORKER_POOL_SIZE, max_pending=WORKER_POOL_MAX_PENDING)
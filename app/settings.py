@@ -0,0 +1,90 @@
+# app/settings.py
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import functools
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() not in ("0", "false", "no")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Application-wide settings, read from the environment (and .env) once per process.
+
+    Feature-specific tuning knobs (caches, pools, rate limits, ...) stay next to the
+    code using them; this holds what several modules share and what the app cannot
+    run without. Nothing is validated at import: create_app() calls validate().
+    """
+
+    database_url: str | None
+    async_database_url: str | None
+    db_async: bool
+    db_echo: bool
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_timeout: float
+    db_pool_recycle: int
+    db_pool_pre_ping: bool
+    db_pool_warmup: int
+    db_shards: str
+    db_shard_routes: str
+    recaptcha_site_key: str | None
+    recaptcha_secret_key: str | None
+    recaptcha_backend: str
+    admin_api_key: str | None
+    metrics_token: str | None
+    check_phone_indexes: bool
+    store_table_pattern: str
+
+    def validate(self) -> None:
+        """Raise ValueError naming every required setting that is missing."""
+        missing = []
+        if not self.database_url:
+            missing.append("DATABASE_URL")
+        # The fake backend never calls Google, so it needs no secret (tests, load tests)
+        if not self.recaptcha_site_key or (self.recaptcha_backend != "fake" and not self.recaptcha_secret_key):
+            missing.append("RECAPTCHA_SITE_KEY and RECAPTCHA_SECRET_KEY")
+        if missing:
+            for name in missing:
+                logger.error("%s not found in environment variables", name)
+            raise ValueError(f"{' and '.join(missing)} required")
+
+
+def load_settings() -> Settings:
+    load_dotenv()
+    db_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+    return Settings(
+        database_url=os.getenv("DATABASE_URL"),
+        async_database_url=os.getenv("ASYNC_DATABASE_URL"),
+        db_async=env_flag("DB_ASYNC", "1"),
+        db_echo=env_flag("DB_ECHO", "0"),
+        db_pool_size=db_pool_size,
+        db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        db_pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        db_pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        db_pool_pre_ping=env_flag("DB_POOL_PRE_PING", "1"),
+        db_pool_warmup=int(os.getenv("DB_POOL_WARMUP", str(min(db_pool_size, 2)))),
+        db_shards=os.getenv("DB_SHARDS", ""),
+        db_shard_routes=os.getenv("DB_SHARD_ROUTES", ""),
+        recaptcha_site_key=os.getenv("RECAPTCHA_SITE_KEY"),
+        recaptcha_secret_key=os.getenv("RECAPTCHA_SECRET_KEY"),
+        recaptcha_backend=os.getenv("RECAPTCHA_BACKEND", "google").lower(),
+        admin_api_key=os.getenv("ADMIN_API_KEY"),
+        metrics_token=os.getenv("METRICS_TOKEN"),
+        # Off by default: it inspects every store table before the app serves traffic
+        check_phone_indexes=env_flag("CHECK_PHONE_INDEXES", "0"),
+        # Store table names are interpolated into SQL, so only identifiers matching this are ever used
+        store_table_pattern=os.getenv("STORE_TABLE_PATTERN", r"vip[A-Za-z0-9_]{0,60}"),
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """The process-wide settings; .env is loaded on the first call, before any module reads its own knobs."""
+    return load_settings()
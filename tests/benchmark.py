@@ -0,0 +1,283 @@
+# tests/benchmark.py
+"""Load test: drive concurrent check-phone and register traffic through the ASGI app.
+
+    python -m tests.benchmark --stores 4 --cards 200 --registrations 400 --checks 800 --output run.json
+
+Seeds `--stores` stores (cliente rows plus vip_benchN tables) with `--cards` pre-printed cards
+each, stubs reCAPTCHA, and reports throughput and p50/p95/p99 latency per operation as
+JSON, together with correctness checks (no card handed out twice, no phone registered
+twice). Point DATABASE_URL (or --database-url) at a disposable MySQL database to run it
+against MySQL; by default it uses a throwaway SQLite file.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+CODE_PATTERN = re.compile(r"Membership Code:</strong>\s*([0-9A-Za-z-]+)")
+
+
+def percentile(samples, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(samples)), 1)
+    return samples[rank - 1]
+
+
+def summarize(latencies: list[float], failures: int) -> dict:
+    samples = sorted(latencies)
+    return {
+        "count": len(samples),
+        "failures": failures,
+        "mean_ms": round(1000 * sum(samples) / len(samples), 3) if samples else 0.0,
+        "p50_ms": round(1000 * percentile(samples, 50), 3),
+        "p95_ms": round(1000 * percentile(samples, 95), 3),
+        "p99_ms": round(1000 * percentile(samples, 99), 3),
+        "max_ms": round(1000 * samples[-1], 3) if samples else 0.0,
+    }
+
+
+# Seeded stores get their own table prefix and id_negozio range, so they never collide with real stores
+BENCH_TABLE_PREFIX = "vip_bench"
+BENCH_ID_BASE = 900_000
+
+
+def use_benchmark_defaults() -> None:
+    """Stub reCAPTCHA and default to a throwaway SQLite file; every other setting keeps its production default."""
+    if not os.getenv("DATABASE_URL"):
+        os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='registraction-bench-')}/bench.db"
+    os.environ.setdefault("RECAPTCHA_SITE_KEY", "bench-site-key")
+    os.environ["RECAPTCHA_BACKEND"] = "fake"
+    os.environ.setdefault("LOG_FILE", "")
+
+
+def effective_settings() -> dict:
+    """The feature switches the run was made with, as the app read them."""
+    from app.services import idempotency, outbox, phone_filter, rate_limit, slot_pool, workers
+    from app.settings import get_settings
+
+    return {
+        "SLOT_POOL_ENABLED": slot_pool.SLOT_POOL_ENABLED,
+        "OUTBOX_ENABLED": outbox.OUTBOX_ENABLED,
+        "PHONE_FILTER_ENABLED": phone_filter.PHONE_FILTER_ENABLED,
+        "RATE_LIMIT_ENABLED": rate_limit.RATE_LIMIT_ENABLED,
+        "IDEMPOTENCY_ENABLED": idempotency.IDEMPOTENCY_ENABLED,
+        "WORKER_POOL_KIND": workers.WORKER_POOL_KIND,
+        "WORKER_POOL_SIZE": workers.WORKER_POOL_SIZE,
+        "DB_POOL_SIZE": get_settings().db_pool_size,
+    }
+
+
+def seed_stores(engine, stores: int, cards: int) -> list[dict]:
+    from sqlalchemy import or_, select
+    from app.models.cliente import Cliente
+    from tests.seeding import seed_store
+
+    seeded = [
+        {"token": f"bench-{n}", "table": f"{BENCH_TABLE_PREFIX}{n}", "id_negozio": BENCH_ID_BASE + n}
+        for n in range(1, stores + 1)
+    ]
+    # seed_store replaces the cliente row with the same id: never let that be a real store
+    Cliente.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        taken = conn.execute(select(Cliente.id_negozio, Cliente.dbnome).where(or_(
+            Cliente.id_negozio.in_([store["id_negozio"] for store in seeded]),
+            Cliente.token_registrazione.in_([store["token"] for store in seeded]),
+        ))).all()
+    foreign = [row.id_negozio for row in taken if not row.dbnome.startswith(BENCH_TABLE_PREFIX)]
+    if foreign:
+        raise RuntimeError(f"Refusing to seed: cliente rows {foreign} belong to stores not created by the benchmark")
+    for store in seeded:
+        seed_store(engine, table_name=store["table"], token=store["token"], id_negozio=store["id_negozio"], cards=cards)
+    return seeded
+
+
+def drop_stores(engine, stores: list[dict]) -> None:
+    from sqlalchemy import delete, text
+    from app.models.cliente import Cliente
+
+    with engine.begin() as conn:
+        for store in stores:
+            conn.execute(delete(Cliente.__table__).where(Cliente.id_negozio == store["id_negozio"]))
+            conn.execute(text(f"DROP TABLE IF EXISTS {store['table']}"))
+
+
+def check_correctness(engine, stores: list[dict], registered: list[tuple]) -> dict:
+    """Compare what the clients were told with what ended up in the store tables."""
+    from sqlalchemy import text
+
+    double_allocated = sum(count - 1 for count in Counter((s, code) for s, code, _ in registered).values() if count > 1)
+    duplicate_phones = mismatched = 0
+    claimed_rows = 0
+    with engine.connect() as conn:
+        for store in stores:
+            table = store["table"]
+            duplicate_phones += conn.execute(text(
+                f"SELECT COUNT(*) FROM (SELECT cellulare FROM {table} WHERE cellulare IS NOT NULL "
+                f"GROUP BY cellulare HAVING COUNT(*) > 1) AS dup"
+            )).scalar()
+            rows = dict(conn.execute(text(f"SELECT code, cellulare FROM {table} WHERE stato = 0")).all())
+            claimed_rows += len(rows)
+            mismatched += sum(1 for s, code, phone in registered if s == table and rows.get(code) != phone)
+    return {
+        "registrations": len(registered),
+        "claimed_rows": claimed_rows,
+        "double_allocated": double_allocated,
+        "duplicate_phones": duplicate_phones,
+        "mismatched_cards": mismatched,
+        "ok": double_allocated == 0 and duplicate_phones == 0 and mismatched == 0 and claimed_rows == len(registered),
+    }
+
+
+async def run_load(app, stores: list[dict], registrations: int, checks: int, duplicates: int,
+                   concurrency: int, seed: int) -> dict:
+    import httpx
+
+    rng = random.Random(seed)
+    operations = ["register"] * registrations + ["check_phone"] * checks + ["duplicate"] * duplicates
+    rng.shuffle(operations)
+    queue = asyncio.Queue()
+    for op in operations:
+        queue.put_nowait(op)
+
+    latencies = {"register": [], "check_phone": [], "duplicate": []}
+    failures = Counter()
+    statuses = Counter()
+    registered = []  # (table, code, cellulare) as reported to the client
+    phones = iter(range(10_000_000))
+
+    async def worker(client):
+        while True:
+            try:
+                op = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            store = rng.choice(stores)
+            done = [entry for entry in registered if entry[0] == store["table"]]
+            if op == "duplicate" and not done:
+                op = "check_phone"
+            if op == "check_phone":
+                phone = rng.choice(done)[2] if done and rng.random() < 0.5 else f"34{next(phones):08d}"
+                request = client.post(f"/vip/{store['token']}/check-phone", json={"cellulare": phone})
+            else:
+                original = rng.choice(done) if op == "duplicate" else None
+                phone = original[2] if original else f"33{next(phones):08d}"
+                form = {"cellulare": phone, "Nome": "Bench", "cognome": "Mark", "recaptcha_response": "bench"}
+                request = client.post(f"/vip/{store['token']}/register", data=form)
+
+            started = time.perf_counter()
+            response = await request
+            latencies[op].append(time.perf_counter() - started)
+            statuses[f"{op}:{response.status_code}"] += 1
+
+            if op == "register":
+                match = CODE_PATTERN.search(response.text)
+                if response.status_code == 200 and match:
+                    registered.append((store["table"], match.group(1), phone))
+                else:
+                    failures[op] += 1
+            elif op == "duplicate":
+                # Completed registrations resubmitted without the form's idempotency key are refused
+                if "already registered" not in response.text:
+                    failures[op] += 1
+            elif response.status_code != 200:
+                failures[op] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(operations) / elapsed, 2) if elapsed else 0.0,
+        "operations": {op: summarize(samples, failures[op]) for op, samples in latencies.items()},
+        "status_codes": dict(sorted(statuses.items())),
+        "registered": registered,
+    }
+
+
+async def benchmark(stores: int = 2, cards: int = 50, registrations: int = 50, checks: int = 100,
+                    duplicates: int = 10, concurrency: int = 16, seed: int = 0, db_async: bool = True,
+                    keep_data: bool = False) -> dict:
+    """Seed, run the traffic mix against the app and return the machine-readable report."""
+    use_benchmark_defaults()
+    from app import dependencies
+    from app.main import app
+    from app.services.store_cache import store_cache
+
+    engine = dependencies.get_engine()
+    seeded = seed_stores(engine, stores, cards)
+    store_cache.clear()
+
+    previous_mode, dependencies.DB_ASYNC = dependencies.DB_ASYNC, db_async
+    await app.router.startup()
+    try:
+        result = await run_load(app, seeded, registrations, checks, duplicates, concurrency, seed)
+    finally:
+        await app.router.shutdown()
+        dependencies.DB_ASYNC = previous_mode
+        store_cache.clear()
+
+    registered = result.pop("registered")
+    correctness = check_correctness(engine, seeded, registered)
+    if not keep_data:
+        drop_stores(engine, seeded)
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "database": engine.dialect.name,
+        "config": {
+            "stores": stores, "cards": cards, "registrations": registrations, "checks": checks,
+            "duplicates": duplicates, "concurrency": concurrency, "seed": seed, "db_async": db_async,
+        },
+        "settings": effective_settings(),
+        **result,
+        "correctness": correctness,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to DATABASE_URL, else a throwaway SQLite file")
+    parser.add_argument("--stores", type=int, default=4)
+    parser.add_argument("--cards", type=int, default=200, help="pre-printed cards per store")
+    parser.add_argument("--registrations", type=int, default=400)
+    parser.add_argument("--checks", type=int, default=800)
+    parser.add_argument("--duplicates", type=int, default=40, help="re-registrations of already registered phones")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sync", action="store_true", help="use sync sessions (DB_ASYNC=0)")
+    parser.add_argument("--keep-data", action="store_true", help="leave the seeded stores in place for inspection")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    report = asyncio.run(benchmark(
+        stores=args.stores, cards=args.cards, registrations=args.registrations, checks=args.checks,
+        duplicates=args.duplicates, concurrency=args.concurrency, seed=args.seed, db_async=not args.sync,
+        keep_data=args.keep_data,
+    ))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if report["correctness"]["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
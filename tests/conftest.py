@@ -0,0 +1,42 @@
+# tests/conftest.py
+import os
+import tempfile
+
+# The app reads its configuration at import time, so point it at a throwaway
+# SQLite database before anything under app/ is imported.
+_DB_DIR = tempfile.mkdtemp(prefix="registraction-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_DB_DIR}/test.db")
+os.environ.setdefault("RECAPTCHA_SITE_KEY", "test-site-key")
+os.environ.setdefault("RECAPTCHA_SECRET_KEY", "test-secret-key")
+os.environ.setdefault("ADMIN_API_KEY", "test-admin-key")
+os.environ.setdefault("RECAPTCHA_BACKEND", "fake")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "fake")
+os.environ.setdefault("LOG_FILE", "")
+# Off by default in production; the app tests exercise the pooled claim path and the outbox
+os.environ.setdefault("SLOT_POOL_ENABLED", "1")
+os.environ.setdefault("OUTBOX_ENABLED", "1")
+
+import pytest
+
+from tests.seeding import REGISTRATION_FORM, STORE_TOKEN, seed_store  # noqa: F401  (re-exported for the tests)
+
+
+@pytest.fixture
+def store_table():
+    from app.dependencies import get_engine
+    from app.services.store_cache import store_cache
+
+    store_cache.clear()
+    yield seed_store(get_engine())
+    store_cache.clear()
+
+
+@pytest.fixture(params=["async", "sync"])
+def client(request, store_table, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import dependencies
+    from app.main import app
+
+    monkeypatch.setattr(dependencies, "DB_ASYNC", request.param == "async")
+    with TestClient(app) as test_client:
+        yield test_client
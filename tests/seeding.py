@@ -0,0 +1,55 @@
+# tests/seeding.py
+"""Store fixtures shared by the tests and the benchmark.
+
+Importing this module leaves the environment alone; tests/conftest.py is what
+points the app at its test defaults.
+"""
+from datetime import datetime
+
+from sqlalchemy import MetaData, delete, insert
+
+
+STORE_TOKEN = "tok-vip1"
+
+REGISTRATION_FORM = {
+    "cellulare": "+39 333 123 4567",
+    "Nome": "Mario",
+    "cognome": "Rossi",
+    "nascita": "1990-01-01",
+    "recaptcha_response": "token-from-browser",
+}
+
+
+def seed_store(engine, table_name="vip1", token=STORE_TOKEN, id_negozio=1, cards=5, active=True, store_engine=None):
+    """Create the cliente table plus a store table holding `cards` free pre-printed cards.
+
+    The store table goes on `store_engine` when given (a shard), else next to cliente.
+    """
+    from app.models.cliente import Cliente
+    from app.models.vip import Vip
+    from app.services.outbox import outbox_table
+
+    store_engine = store_engine or engine
+    Cliente.__table__.create(engine, checkfirst=True)
+    # Stands in for `python -m app.cli create-outbox-tables`, which deployments run once
+    outbox_table.create(store_engine, checkfirst=True)
+    store_table = Vip.__table__.to_metadata(MetaData(), name=table_name)
+    store_table.drop(store_engine, checkfirst=True)
+    store_table.create(store_engine)
+    with engine.begin() as conn:
+        conn.execute(delete(Cliente.__table__).where(Cliente.id_negozio == id_negozio))
+        conn.execute(insert(Cliente.__table__).values(
+            id_negozio=id_negozio,
+            nome_negozio=f"Store {id_negozio}",
+            data_creazione=datetime(2025, 1, 1),
+            token_registrazione=token,
+            data_scadenza_token=datetime(2099, 1, 1),
+            active=active,
+            dbnome=table_name,
+        ))
+    with store_engine.begin() as conn:
+        conn.execute(insert(store_table), [
+            {"IDvip": i, "code": f"{2000000000000 + i}", "stato": True, "idata": datetime(2025, 1, 1)}
+            for i in range(1, cards + 1)
+        ])
+    return store_table
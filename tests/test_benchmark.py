@@ -0,0 +1,51 @@
+# tests/test_benchmark.py
+import asyncio
+import json
+
+import pytest
+
+from tests.benchmark import BENCH_ID_BASE, benchmark, drop_stores, percentile, seed_stores
+
+
+def test_percentile_nearest_rank():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([7.0], 95) == 7.0
+    assert percentile([], 50) == 0.0
+
+
+def test_seeding_leaves_real_stores_alone(tmp_path):
+    from sqlalchemy import create_engine, inspect
+
+    from tests.seeding import seed_store
+
+    engine = create_engine(f"sqlite:///{tmp_path}/bench.db")
+    seed_store(engine, table_name="vip1", token="real-1", id_negozio=1)
+    seeded = seed_stores(engine, stores=1, cards=3)
+    assert seeded == [{"token": "bench-1", "table": "vip_bench1", "id_negozio": BENCH_ID_BASE + 1}]
+    drop_stores(engine, seeded)
+    assert "vip1" in inspect(engine).get_table_names()
+
+    # A real store in the benchmark's id range is never overwritten
+    seed_store(engine, table_name="vip2", token="real-2", id_negozio=BENCH_ID_BASE + 1)
+    with pytest.raises(RuntimeError, match="Refusing to seed"):
+        seed_stores(engine, stores=1, cards=3)
+    engine.dispose()
+
+
+@pytest.mark.parametrize("db_async", [True, False], ids=["async", "sync"])
+def test_benchmark_smoke(db_async):
+    report = asyncio.run(benchmark(stores=2, cards=30, registrations=30, checks=30, duplicates=6,
+                                   concurrency=8, db_async=db_async))
+    json.dumps(report)  # machine-readable as is
+
+    assert report["correctness"]["ok"], report["correctness"]
+    assert report["correctness"]["registrations"] == 30
+    register = report["operations"]["register"]
+    assert register["count"] == 30 and register["failures"] == 0
+    assert register["p50_ms"] <= register["p95_ms"] <= register["p99_ms"] <= register["max_ms"]
+    assert report["operations"]["duplicate"]["failures"] == 0
+    assert report["throughput_rps"] > 0
+    # Run under the test suite's environment, which turns these on
+    assert report["settings"]["SLOT_POOL_ENABLED"] and report["settings"]["OUTBOX_ENABLED"]
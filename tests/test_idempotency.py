@@ -0,0 +1,127 @@
+# tests/test_idempotency.py
+import asyncio
+
+from app.services.idempotency import IdempotencyStore, fingerprint
+from tests.conftest import REGISTRATION_FORM, STORE_TOKEN
+
+
+def test_store_coalesces_in_flight_duplicates_and_replays():
+    async def scenario():
+        store = IdempotencyStore(maxsize=10, ttl=60)
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(store.run("k", "fp", fn, keep=lambda v: v) for _ in range(3)))
+        assert len(calls) == 1
+        assert sorted(replayed for _, replayed in results) == [False, True, True]
+        assert all(value == "result" for value, _ in results)
+
+        assert await store.run("k", "fp", fn, keep=lambda v: v) == ("result", True)
+        assert len(calls) == 1
+        assert store.stats()["coalesced"] == 2 and store.stats()["replayed"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_store_does_not_replay_mismatched_or_unkept_results():
+    async def scenario():
+        store = IdempotencyStore(maxsize=10, ttl=60)
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            return len(calls)
+
+        # Rejected outcomes are not stored, so the next attempt runs again
+        assert await store.run("k", "fp", fn, keep=lambda v: None) == (1, False)
+        assert await store.run("k", "fp", fn, keep=lambda v: v) == (2, False)
+        # A different submission under the same key is never answered from the store
+        assert await store.run("k", "other", fn, keep=lambda v: v) == (3, False)
+        assert store.stats()["mismatched"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiters_on_a_failed_submission_take_over_one_at_a_time():
+    async def scenario():
+        store = IdempotencyStore(maxsize=10, ttl=60)
+        running, calls = [], []
+
+        async def fn():
+            running.append(1)
+            assert len(running) == 1, "duplicates ran concurrently"
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            running.pop()
+            return len(calls)
+
+        # The first attempt is rejected; exactly one waiter retries, the others get its result
+        keep = lambda v: v if v > 1 else None
+        results = await asyncio.gather(*(store.run("k", "fp", fn, keep=keep) for _ in range(4)))
+        assert len(calls) == 2
+        assert sorted(results) == [(1, False), (2, False), (2, True), (2, True)]
+
+    asyncio.run(scenario())
+
+
+def test_store_entries_expire_and_are_bounded():
+    async def scenario():
+        now = [0.0]
+        store = IdempotencyStore(maxsize=2, ttl=10, clock=lambda: now[0])
+
+        async def fn():
+            return "v"
+
+        for key in ("a", "b", "c"):
+            await store.run(key, "fp", fn, keep=lambda v: v)
+        assert store.stats()["entries"] == 2
+        assert await store.run("c", "fp", fn, keep=lambda v: v) == ("v", True)
+        now[0] = 11
+        assert await store.run("c", "fp", fn, keep=lambda v: v) == ("v", False)
+
+    asyncio.run(scenario())
+
+
+def test_fingerprint_distinguishes_values():
+    assert fingerprint("a", None) == fingerprint("a", "")
+    assert fingerprint("ab", "c") != fingerprint("a", "bc")
+
+
+def test_identical_resubmission_replays_the_first_card(client):
+    recaptcha_calls = client.app.state.recaptcha.backend.calls
+    form = {**REGISTRATION_FORM, "idempotency_key": "key-1"}
+    first = client.post(f"/vip/{STORE_TOKEN}/register", data=form)
+    assert "2000000000001" in first.text
+    verified = len(recaptcha_calls)
+
+    again = client.post(f"/vip/{STORE_TOKEN}/register", data=form)
+    assert again.status_code == 200
+    assert again.text == first.text
+    assert len(recaptcha_calls) == verified
+
+    changed = client.post(f"/vip/{STORE_TOKEN}/register", data={**form, "Nome": "Luigi"})
+    assert "already registered" in changed.text
+    stats = client.get("/admin/idempotency", headers={"X-Admin-Key": "test-admin-key"}).json()
+    assert stats["replayed"] >= 1 and stats["mismatched"] == 1
+
+
+def test_resubmission_without_key_is_not_replayed(client):
+    # Anyone knowing a member's phone and name could otherwise fetch their card
+    first = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    again = client.post(f"/vip/{STORE_TOKEN}/register", data={**REGISTRATION_FORM, "cellulare": "333 123 4567"})
+    assert "2000000000001" in first.text
+    assert "already registered" in again.text and "2000000000001" not in again.text
+
+
+def test_failed_submission_is_not_replayed(client):
+    client.app.state.recaptcha.backend.score = 0.1
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert "CAPTCHA verification failed" in response.text
+
+    client.app.state.recaptcha.backend.score = 0.9
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert "Welcome, Mario Rossi!" in response.text
@@ -0,0 +1,33 @@
+# tests/test_logging.py
+import json
+import logging
+
+from app.logging_config import JsonFormatter, SamplingFilter, parse_levels
+
+
+def make_record(msg, *args, **extra):
+    record = logging.makeLogRecord({"name": "app.test", "levelname": "INFO", "msg": msg, "args": args})
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_fields():
+    line = JsonFormatter().format(make_record("Resolved token %s to table name: %s", "tok", "vip1", store=1))
+    entry = json.loads(line)
+    assert entry["message"] == "Resolved token tok to table name: vip1"
+    assert entry["logger"] == "app.test" and entry["level"] == "INFO"
+    assert entry["store"] == 1
+
+
+def test_sampling_filter_only_thins_listed_templates():
+    sampler = SamplingFilter({"Resolved token %s to table name: %s"}, every=10)
+    sampled = [sampler.filter(make_record("Resolved token %s to table name: %s", "t", "v")) for _ in range(100)]
+    assert sum(sampled) == 10
+    assert all(sampler.filter(make_record("Updated VIP row in %s with IDvip: %s", "v", 1)) for _ in range(5))
+
+
+def test_parse_levels():
+    assert parse_levels("app.routers.vip=debug, sqlalchemy.engine=WARNING,") == {
+        "app.routers.vip": "DEBUG",
+        "sqlalchemy.engine": "WARNING",
+    }
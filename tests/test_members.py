@@ -0,0 +1,141 @@
+# tests/test_members.py
+import asyncio
+import csv
+import io
+import json
+
+from sqlalchemy import text
+
+from app.services.members import export_members, iter_csv_rows
+from tests.conftest import REGISTRATION_FORM, STORE_TOKEN
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+MEMBERS_CSV = (
+    "cellulare,nome,Cognome,nascita,email\n"
+    "3330000001,Anna,Bianchi,1980-02-03,anna@example.com\n"
+    "12345,Luca,Verdi,1985-01-01,\n"
+    "+39 333 000 0002,Marco,Neri,1990-05-06,\n"
+    "3330000001,Anna,Bianchi,1980-02-03,\n"
+    "3331234567,Mario,Rossi,1990-01-01,\n"
+    "3330000003,P4olo,Gialli,1975-07-08,\n"
+)
+
+
+async def collect(agen):
+    return [item async for item in agen]
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def claimed_rows():
+    from app.dependencies import get_engine
+
+    engine = get_engine()
+
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT IDvip, cellulare, Nome FROM vip1 WHERE stato = 0 ORDER BY IDvip")).all()
+
+
+def test_csv_rows_survive_chunk_boundaries_and_quoted_newlines():
+    stream = chunks(b"\xef\xbb\xbfcellulare,Indirizzo\n3330000001,\"Via Roma 1\n", b"Scala B\"\n33300", b"00002,x")
+    assert asyncio.run(collect(iter_csv_rows(stream))) == [
+        (3, {"cellulare": "3330000001", "Indirizzo": "Via Roma 1\nScala B"}),
+        (4, {"cellulare": "3330000002", "Indirizzo": "x"}),
+    ]
+
+
+def test_multibyte_characters_split_across_chunks_are_decoded():
+    data = "\ufeffcellulare,Citta\n3330000001,Città\n".encode()
+    split = data.index("à".encode()) + 1  # between the two bytes of "à"
+    for stream in (chunks(data[:split], data[split:]), chunks(*(data[i:i + 1] for i in range(len(data))))):
+        assert asyncio.run(collect(iter_csv_rows(stream))) == [(2, {"cellulare": "3330000001", "Citta": "Città"})]
+
+
+def test_import_members_validates_and_claims_from_the_top(client):
+    client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+
+    response = client.post(f"/admin/stores/{STORE_TOKEN}/members/import", content=MEMBERS_CSV,
+                           headers={**ADMIN, "Content-Type": "text/csv"})
+    assert response.status_code == 200
+    report = response.json()
+    assert report["imported"] == 2 and report["rejected"] == 4 and report["stopped"] is None
+    assert report["rows_done"] == 7
+    assert {(r["line"], r["error"].split(":")[0]) for r in report["rejects"]} == {
+        (3, "cellulare"), (5, "Phone number repeated in the input"),
+        (6, "Phone number already registered"), (7, "Nome"),
+    }
+    # The form registration took card 1; the import filled cards from the top
+    assert claimed_rows() == [(1, "3331234567", "Mario"), (4, "3330000002", "Marco"), (5, "3330000001", "Anna")]
+
+
+def test_import_stops_when_cards_run_out_and_resumes(client):
+    ndjson = "".join(json.dumps({"cellulare": f"33300000{i:02d}", "Nome": "Anna", "cognome": "Bianchi",
+                                 "nascita": "1980-02-03"}) + "\n" for i in range(1, 8))
+    headers = {**ADMIN, "Content-Type": "application/x-ndjson"}
+    report = client.post(f"/admin/stores/{STORE_TOKEN}/members/import", content=ndjson, headers=headers).json()
+    assert report["imported"] == 5
+    assert report["stopped"] == "No available VIP slots"
+    assert report["rows_done"] == 5
+
+    from app.dependencies import get_engine
+    with get_engine().begin() as conn:
+        conn.execute(text("INSERT INTO vip1 (IDvip, code, stato) VALUES (6, '2000000000006', 1), (7, '2000000000007', 1)"))
+    resumed = client.post(f"/admin/stores/{STORE_TOKEN}/members/import?skip={report['rows_done']}",
+                          content=ndjson, headers=headers).json()
+    assert resumed["imported"] == 2 and resumed["rejected"] == 0 and resumed["stopped"] is None
+    assert len(claimed_rows()) == 7
+
+
+def test_rejects_are_reported_when_a_batch_finds_no_free_card(client):
+    from app.dependencies import get_engine
+    with get_engine().begin() as conn:
+        conn.execute(text("UPDATE vip1 SET stato = 0"))
+
+    ndjson = "not json\n" + json.dumps({"cellulare": "3330000001", "Nome": "Anna", "cognome": "Bianchi", "nascita": "1980-02-03"}) + "\n"
+    headers = {**ADMIN, "Content-Type": "application/x-ndjson"}
+    report = client.post(f"/admin/stores/{STORE_TOKEN}/members/import", content=ndjson, headers=headers).json()
+    assert report["stopped"] == "No available VIP slots"
+    assert report["imported"] == 0 and report["rows_done"] == 1
+    assert report["rejected"] == 1 and [r["line"] for r in report["rejects"]] == [1]
+
+
+def test_export_pages_by_keyset_without_blobs(client):
+    from app.dependencies import session_scope
+
+    client.post(f"/admin/stores/{STORE_TOKEN}/members/import", content=MEMBERS_CSV,
+                headers={**ADMIN, "Content-Type": "text/csv"})
+
+    async def export_all():
+        async with session_scope() as db:
+            return await collect(export_members(db, "vip1", batch_size=2, claimed_only=False))
+
+    rows = asyncio.run(export_all())
+    assert [row["IDvip"] for row in rows] == [1, 2, 3, 4, 5]
+    assert "img" not in rows[0]
+
+    response = client.get(f"/admin/stores/{STORE_TOKEN}/members/export", headers=ADMIN)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    exported = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["cellulare"] for row in exported] == ["3331234567", "3330000002", "3330000001"]
+
+
+def test_cli_import_is_resumable(tmp_path, store_table):
+    from app.cli import main
+
+    source = tmp_path / "members.csv"
+    source.write_text(MEMBERS_CSV)
+    assert main(["import-members", STORE_TOKEN, str(source), "--batch-size", "1"]) == 0
+    progress = json.loads((tmp_path / "members.csv.progress").read_text())
+    assert progress["rows_done"] == 7 and progress["imported"] == 3
+    rejects = [json.loads(line) for line in (tmp_path / "members.csv.rejects.ndjson").read_text().splitlines()]
+    assert [r["line"] for r in rejects] == [3, 5, 7]
+
+    # Running it again picks up after the last committed row: nothing is imported twice
+    assert main(["import-members", STORE_TOKEN, str(source)]) == 0
+    assert len(claimed_rows()) == 3
+    assert len((tmp_path / "members.csv.rejects.ndjson").read_text().splitlines()) == 3
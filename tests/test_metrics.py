@@ -0,0 +1,62 @@
+# tests/test_metrics.py
+from app.services.metrics import REQUEST_QUERIES, STAGE_LATENCY, Counter, Histogram
+from tests.conftest import REGISTRATION_FORM, STORE_TOKEN
+
+ADMIN_HEADERS = {"X-Admin-Key": "test-admin-key"}
+
+
+def test_histogram_exposition_is_cumulative():
+    histogram = Histogram("demo_seconds", "Demo.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "render")
+    lines = histogram.expose()
+    assert 'demo_seconds_bucket{stage="render",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="render",le="1.0"} 2' in lines
+    assert 'demo_seconds_bucket{stage="render",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{stage="render"} 3' in lines
+
+
+def test_counter_escapes_label_values():
+    counter = Counter("demo_total", "Demo.", ("kind",))
+    counter.inc('say "hi"')
+    assert 'demo_total{kind="say \\"hi\\""} 1' in counter.expose()
+
+
+def test_register_records_stages_and_queries(client):
+    before = {stage: STAGE_LATENCY.count("register_vip", stage) for stage in ("store", "claim", "render")}
+    queries_before = REQUEST_QUERIES.count("register_vip")
+
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert response.status_code == 200
+
+    for stage, count in before.items():
+        assert STAGE_LATENCY.count("register_vip", stage) == count + 1
+    assert REQUEST_QUERIES.count("register_vip") == queries_before + 1
+
+
+def test_metrics_endpoint(client):
+    client.get(f"/vip/{STORE_TOKEN}/register")
+    client.get("/vip/unknown-token/barcode/123.svg")
+
+    response = client.get("/metrics", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'http_requests_total{method="GET",endpoint="get_register_form",status="200"}' in body
+    assert 'http_requests_total{method="GET",endpoint="get_barcode",status="404"}' in body
+    assert "http_request_duration_seconds_bucket" in body
+    assert 'cache_hits_total{cache="store"}' in body
+    assert "db_queries_total" in body
+    # Tokens stay out of the labels
+    assert STORE_TOKEN not in body
+
+
+def test_metrics_endpoint_requires_a_token(client, monkeypatch):
+    from app import dependencies
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"X-Admin-Key": "wrong"}).status_code == 401
+
+    monkeypatch.setattr(dependencies, "METRICS_TOKEN", "scrape-token")
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-token"}).status_code == 200
+    assert client.get("/metrics", headers={"Authorization": "Bearer other"}).status_code == 401
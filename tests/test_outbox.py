@@ -0,0 +1,261 @@
+# tests/test_outbox.py
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.dependencies import SyncSessionAdapter
+from app.services.notifications import FakeSender, LogSender, SendFailed, WebhookSender
+from app.services.outbox import (
+    OutboxWorker, create_outbox_tables, outbox_ddl, outbox_table, registration_events, write_events,
+)
+from app.services.slots import claim_slot
+from tests.conftest import REGISTRATION_FORM, STORE_TOKEN, seed_store
+
+START = datetime(2025, 6, 1, 12, 0, 0)
+
+
+class Clock:
+    def __init__(self):
+        self.now = START
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def outbox_db(tmp_path):
+    """A database with store table vip_out (3 free cards) and a session factory shaped like session_scope."""
+    engine = create_engine(f"sqlite:///{tmp_path}/outbox.db", connect_args={"check_same_thread": False})
+    table = seed_store(engine, table_name="vip_out", cards=3)
+    Session = sessionmaker(bind=engine)
+
+    @asynccontextmanager
+    async def session_factory(shard=None):
+        db = SyncSessionAdapter(Session())
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    yield engine, table, session_factory
+    engine.dispose()
+
+
+def make_worker(session_factory, sms=None, email=None, **options):
+    senders = {"sms": sms or FakeSender(), "email": email or FakeSender()}
+    options.setdefault("backoff", lambda attempts: 10 * attempts)
+    return OutboxWorker(session_factory, lambda: ["default"], senders, **options)
+
+
+def outbox_rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(outbox_table).order_by(outbox_table.c.id)).mappings().all()
+
+
+def queue(engine, session_factory, card_id=1, **member):
+    member = {"cellulare": "3331234567", "Nome": "Mario", "sms": True, "omail": True, **member}
+
+    async def scenario():
+        async with session_factory() as db:
+            await write_events(db, registration_events("vip_out", card_id, member, "2000000000001", "tok", now=START))
+            await db.commit()
+
+    asyncio.run(scenario())
+
+
+def test_registration_events_cover_the_channels_opted_in_to():
+    member = {"cellulare": "333", "Email": "m@example.com", "sms": True, "omail": True}
+    events = registration_events("vip1", 3, member, "200", "tok", now=START)
+    assert [e["kind"] for e in events] == ["welcome_sms", "welcome_email"]
+    assert all(e["status"] == "pending" and e["next_attempt_at"] == START for e in events)
+    assert [e["kind"] for e in registration_events("vip1", 3, {**member, "Email": None}, "200", "tok")] == ["welcome_sms"]
+    assert [e["kind"] for e in registration_events("vip1", 3, {**member, "sms": False}, "200", "tok")] == ["welcome_email"]
+    assert registration_events("vip1", 3, {"cellulare": "333", "Email": "m@example.com"}, "200", "tok") == []
+
+
+def test_outbox_ddl_is_printable_per_dialect():
+    from sqlalchemy.dialects import mysql
+
+    statements = outbox_ddl(mysql.dialect())
+    assert statements[0].startswith("CREATE TABLE registration_outbox")
+    assert any(s.startswith("CREATE INDEX idx_registration_outbox_due") for s in statements)
+
+
+def test_delivered_events_are_kept_as_sent_without_touching_the_card(outbox_db):
+    engine, table, session_factory = outbox_db
+    sms, email = FakeSender(delivers=True), FakeSender(delivers=True)
+    worker = make_worker(session_factory, sms, email, clock=Clock())
+    asyncio.run(create_outbox_tables(session_factory, ["default"]))
+    queue(engine, session_factory, card_id=2, Email="mario@example.com", sms=True, omail=False)
+
+    # Only the channel the member opted in to
+    assert asyncio.run(worker.drain_once("default")) == 1
+    assert [recipient for recipient, _, _ in sms.sent] == ["3331234567"]
+    assert email.sent == []
+    [row] = outbox_rows(engine)
+    assert row["status"] == "sent" and row["sent_at"] == START and row["kind"] == "welcome_sms"
+    # The card's sms/omail columns are opt-ins, not delivery state
+    with engine.connect() as conn:
+        assert conn.execute(select(table.c.sms, table.c.omail).where(table.c.IDvip == 2)).one() in ((None, None), (False, False))
+    assert worker.stats()["sent_by_kind"] == {"welcome_sms": 1}
+    # Sent events are never claimed again
+    assert asyncio.run(worker.drain_once("default")) == 0
+
+
+def test_log_sender_marks_events_logged_without_personal_data(outbox_db, caplog):
+    engine, table, session_factory = outbox_db
+    worker = OutboxWorker(session_factory, lambda: ["default"], {"sms": LogSender("sms")}, clock=Clock())
+    asyncio.run(create_outbox_tables(session_factory, ["default"]))
+    queue(engine, session_factory, card_id=2)
+
+    with caplog.at_level("INFO", logger="app.services.notifications"):
+        assert asyncio.run(worker.drain_once("default")) == 1
+    assert "3331234567" not in caplog.text and "Mario" not in caplog.text and "***567" in caplog.text
+    assert [row["status"] for row in outbox_rows(engine)] == ["logged"]
+
+
+@pytest.mark.parametrize("status, permanent", [(400, True), (408, False), (429, False), (503, False)])
+def test_webhook_sender_retries_throttling_and_timeouts(status, permanent):
+    sender = WebhookSender("https://gateway.example/send")
+    sender.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(status)))
+
+    async def scenario():
+        try:
+            await sender.send("3331234567", "welcome_sms", {})
+        finally:
+            await sender.aclose()
+
+    with pytest.raises(SendFailed if permanent else httpx.HTTPStatusError):
+        asyncio.run(scenario())
+
+
+def test_failed_events_are_retried_with_backoff_then_dead_lettered(outbox_db):
+    engine, _, session_factory = outbox_db
+    clock = Clock()
+    sms = FakeSender(fail_times=10)
+    worker = make_worker(session_factory, sms, clock=clock, max_attempts=3)
+    asyncio.run(create_outbox_tables(session_factory, ["default"]))
+    queue(engine, session_factory)
+
+    assert asyncio.run(worker.drain_once("default")) == 1
+    [row] = outbox_rows(engine)
+    assert row["status"] == "pending" and row["attempts"] == 1
+    assert row["next_attempt_at"] == START + timedelta(seconds=10)
+    assert "gateway unavailable" in row["last_error"]
+
+    # Not due yet: nothing is claimed until the backoff has passed
+    assert asyncio.run(worker.drain_once("default")) == 0
+    for attempt in (2, 3):
+        clock.now = outbox_rows(engine)[0]["next_attempt_at"]
+        assert asyncio.run(worker.drain_once("default")) == 1
+    [row] = outbox_rows(engine)
+    assert row["status"] == "dead" and row["attempts"] == 3
+    assert worker.stats()["retried"] == 2 and worker.stats()["dead"] == 1
+
+    clock.now += timedelta(days=1)
+    assert asyncio.run(worker.drain_once("default")) == 0
+    assert asyncio.run(worker.requeue_dead("default")) == 1
+    sms.fail_times = 0
+    assert asyncio.run(worker.drain_once("default")) == 1
+    assert [row["status"] for row in outbox_rows(engine)] == ["logged"]
+
+
+def test_permanent_failure_is_dead_lettered_at_once(outbox_db):
+    engine, _, session_factory = outbox_db
+    worker = make_worker(session_factory, FakeSender(fail_times=1, error=SendFailed("invalid number")), clock=Clock())
+    asyncio.run(create_outbox_tables(session_factory, ["default"]))
+    queue(engine, session_factory)
+
+    asyncio.run(worker.drain_once("default"))
+    [row] = outbox_rows(engine)
+    assert row["status"] == "dead" and row["attempts"] == 1
+    assert row["last_error"] == "SendFailed: invalid number"
+
+
+def test_claimed_events_are_leased_from_other_workers(outbox_db):
+    engine, _, session_factory = outbox_db
+    clock = Clock()
+    slow = FakeSender(delay=0.05)
+    first = make_worker(session_factory, slow, clock=clock)
+    second_sms = FakeSender()
+    second = make_worker(session_factory, second_sms, clock=clock)
+    asyncio.run(create_outbox_tables(session_factory, ["default"]))
+    queue(engine, session_factory)
+
+    async def scenario():
+        return await asyncio.gather(first.drain_once("default"), second.drain_once("default"))
+
+    assert sorted(asyncio.run(scenario())) == [0, 1]
+    assert len(slow.sent) + len(second_sms.sent) == 1
+
+
+def test_events_are_written_in_the_claims_transaction(outbox_db):
+    engine, table, session_factory = outbox_db
+    asyncio.run(create_outbox_tables(session_factory, ["default"]))
+    member = {"cellulare": "3331234567", "Nome": "Mario", "sms": True}
+
+    async def failing(db, card):
+        await write_events(db, registration_events("vip_out", card.IDvip, member, card.code, "tok"))
+        raise RuntimeError("crash before commit")
+
+    async def scenario():
+        async with session_factory() as db:
+            with pytest.raises(RuntimeError):
+                await claim_slot(db, "vip_out", member, before_commit=failing)
+            await db.rollback()
+        async with session_factory() as db:
+            async def queue_events(db, card):
+                await write_events(db, registration_events("vip_out", card.IDvip, member, card.code, "tok"))
+            return await claim_slot(db, "vip_out", member, before_commit=queue_events)
+
+    card = asyncio.run(scenario())
+    assert [(row["IDvip"], row["kind"]) for row in outbox_rows(engine)] == [(card.IDvip, "welcome_sms")]
+    with engine.connect() as conn:
+        assert conn.execute(select(table.c.IDvip).where(table.c.stato == False)).scalars().all() == [card.IDvip]
+
+
+def test_registration_sends_welcome_sms_in_the_background(client):
+    sms = FakeSender()
+    outbox = client.app.state.outbox
+    outbox.senders = {**outbox.senders, "sms": sms}
+
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data={**REGISTRATION_FORM, "sms": "1"})
+    assert response.status_code == 200
+
+    deadline = time.monotonic() + 5
+    while not sms.sent and time.monotonic() < deadline:
+        time.sleep(0.02)
+    [(recipient, template, data)] = sms.sent
+    assert template == "welcome_sms" and data["Nome"] == "Mario" and data["code"]
+
+    stats = client.get("/admin/outbox", headers={"X-Admin-Key": "test-admin-key"}).json()
+    assert stats["running"] and stats["sent"] >= 1
+    assert "default" in stats["backlog"]
+
+
+def test_registration_without_opt_in_queues_nothing(client):
+    from app.dependencies import get_engine
+
+    def queued():
+        with get_engine().connect() as conn:
+            return conn.execute(select(func.count()).select_from(outbox_table)).scalar()
+
+    before = queued()
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert response.status_code == 200
+    assert queued() == before
+
+
+def test_registration_stores_the_opt_ins(client, store_table):
+    from app.dependencies import get_engine
+
+    client.post(f"/vip/{STORE_TOKEN}/register", data={**REGISTRATION_FORM, "omail": "1"})
+    with get_engine().connect() as conn:
+        row = conn.execute(select(store_table.c.sms, store_table.c.omail).where(store_table.c.stato == False)).one()
+    assert tuple(row) == (False, True)
@@ -0,0 +1,82 @@
+# tests/test_page_cache.py
+from app.services.compression import PrecompressedStaticFiles, accepted_encoding, etag_matches, precompress_directory
+from app.services.page_cache import page_cache
+from tests.conftest import STORE_TOKEN
+
+
+def test_accepted_encoding():
+    assert accepted_encoding("gzip, deflate, br", {"gzip": b"", "br": b""}) == "br"
+    assert accepted_encoding("gzip, deflate, br", {"gzip": b""}) == "gzip"
+    assert accepted_encoding("br;q=0, gzip;q=0.5", {"gzip": b"", "br": b""}) == "gzip"
+    assert accepted_encoding("identity", {"gzip": b""}) is None
+    assert accepted_encoding(None, {"gzip": b""}) is None
+
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches('"a"', 'W/"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b", "c"', '"a"')
+    assert not etag_matches(None, '"a"')
+
+
+def test_register_form_is_served_from_the_page_cache(client):
+    page_cache.clear()
+    first = client.get(f"/vip/{STORE_TOKEN}/register")
+    assert first.status_code == 200
+    assert first.headers["content-encoding"] == "gzip"
+    assert first.headers["cache-control"] == "public, max-age=60"
+
+    # A repeat GET needs neither a render nor the worker pool
+    client.app.state.workers.max_pending = 0
+    second = client.get(f"/vip/{STORE_TOKEN}/register")
+    assert second.status_code == 200 and second.text == first.text
+    assert page_cache.stats()["hits"] >= 1
+
+    revalidated = client.get(f"/vip/{STORE_TOKEN}/register", headers={"If-None-Match": first.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+
+def test_invalid_token_page_is_prerendered_and_shared(client):
+    client.app.state.workers.max_pending = 0
+    response = client.get("/vip/no-such-token/register")
+    assert response.status_code == 200
+    assert "Invalid or inactive store token" in response.text
+
+    posted = client.post("/vip/other-token/register", data={
+        "cellulare": "3331234567", "Nome": "Mario", "cognome": "Rossi", "recaptcha_response": "x",
+    })
+    assert "Invalid or inactive store token" in posted.text
+    assert "etag" not in posted.headers
+
+
+def test_precompressed_static_assets(tmp_path):
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from starlette.testclient import TestClient
+
+    (tmp_path / "app.js").write_text("console.log('registration');\n" * 50)
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG" * 10)
+    written = precompress_directory(str(tmp_path))
+    assert str(tmp_path / "app.js.gz") in written
+    assert not (tmp_path / "logo.png.gz").exists()
+
+    static = TestClient(Starlette(routes=[Mount("/static", PrecompressedStaticFiles(directory=str(tmp_path)))]))
+    response = static.get("/static/app.js", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("text/javascript")
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == len((tmp_path / "app.js.gz").read_bytes())
+    assert response.text.startswith("console.log")
+
+    plain = static.get("/static/app.js", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    etag = response.headers["etag"]
+    for if_none_match in (etag, f'"stale", W/{etag}', "*"):
+        revalidated = static.get("/static/app.js", headers={"Accept-Encoding": "gzip", "If-None-Match": if_none_match})
+        assert revalidated.status_code == 304
+    changed = static.get("/static/app.js", headers={"Accept-Encoding": "gzip", "If-None-Match": '"stale"'})
+    assert changed.status_code == 200
@@ -0,0 +1,193 @@
+# tests/test_phones.py
+import asyncio
+import json
+import time
+
+from sqlalchemy import text
+
+from app.services import phone_filter
+from app.services.phone_filter import BloomFilter, PhoneFilterRegistry, create_phone_filters, worker_count
+from tests.conftest import REGISTRATION_FORM, STORE_TOKEN
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_check_phones_json_body(client):
+    client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+
+    response = client.post(
+        f"/vip/{STORE_TOKEN}/check-phones",
+        json={"numbers": ["3331234567", "+39 333 123 4567", "3339999999", "12345"]},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert read_ndjson(response) == [
+        {"input": "12345", "error": "Cellulare must be a 10-digit Italian number"},
+        {"cellulare": "3331234567", "exists": True},
+        {"cellulare": "3339999999", "exists": False},
+    ]
+
+
+def test_check_phones_ndjson_stream(client, monkeypatch):
+    from app.services import phones
+
+    monkeypatch.setattr(phones, "PHONE_LOOKUP_CHUNK", 2)
+    lines = [json.dumps(f"333000000{i}") for i in range(5)] + [json.dumps({"cellulare": "3330000000"}), "not json"]
+    body = "\n".join(lines).encode()
+
+    def chunks():
+        # Split mid-line to exercise incremental parsing
+        yield body[:17]
+        yield body[17:]
+
+    response = client.post(
+        f"/vip/{STORE_TOKEN}/check-phones",
+        content=chunks(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    results = read_ndjson(response)
+    assert results[0] == {"input": "not json", "error": "Cellulare must be a 10-digit Italian number"}
+    assert [r["cellulare"] for r in results[1:]] == [f"333000000{i}" for i in range(5)]
+
+
+def test_check_phones_rejects_bad_requests(client, monkeypatch):
+    from app.routers import vip
+
+    assert client.post("/vip/unknown/check-phones", json={"numbers": []}).status_code == 404
+    assert client.post(f"/vip/{STORE_TOKEN}/check-phones", json={"nums": []}).status_code == 422
+
+    monkeypatch.setattr(vip, "BULK_CHECK_MAX", 1)
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phones", json={"numbers": ["3330000001", "3330000002"]})
+    assert response.status_code == 413
+    # Invalid entries are answered too, so they cannot be sent without limit
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phones", json={"numbers": ["12345", "67890"]})
+    assert response.status_code == 413
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phones", json={"numbers": ["3330000001", "+39 333 000 0001"]})
+    assert response.status_code == 200
+
+    # An NDJSON line is never buffered past the limit, even without a newline in sight
+    monkeypatch.setattr(vip, "BULK_CHECK_MAX_LINE", 32)
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phones", content=b"3330000001\n" + b"3" * 64,
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 413
+
+
+def test_phone_index_report(client, store_table):
+    from app.dependencies import get_engine
+
+    engine = get_engine()
+
+    assert client.get("/admin/stores/phone-indexes", headers=ADMIN).json() == {"vip1": False}
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX idx_vip1_cellulare ON vip1 (cellulare)"))
+    assert client.get("/admin/stores/phone-indexes", headers=ADMIN).json() == {"vip1": True}
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=2000, error_rate=0.01)
+    numbers = [f"333{i:07d}" for i in range(2000)]
+    for number in numbers:
+        bloom.add(number)
+    assert all(number in bloom for number in numbers)
+
+    false_positives = sum(f"334{i:07d}" in bloom for i in range(10000))
+    assert false_positives < 300
+    assert 0.005 < bloom.false_positive_rate() < 0.02
+    assert bloom.memory_bytes < 3000
+
+
+def test_phone_filter_registry_build_and_incremental_add():
+    from app.dependencies import get_engine, session_scope
+    from tests.conftest import seed_store
+
+    engine = get_engine()
+    seed_store(engine, table_name="vip_filter", cards=3)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE vip_filter SET cellulare = '3330000001', stato = 0 WHERE IDvip = 1"))
+
+    async def scenario():
+        registry = PhoneFilterRegistry(session_scope)
+        assert registry.might_contain("vip_filter", "3330000002")  # unknown until built
+        await asyncio.gather(*registry._tasks)
+
+        assert registry.might_contain("vip_filter", "3330000001")
+        assert not registry.might_contain("vip_filter", "3330000002")
+        registry.add("vip_filter", "3330000002")
+        assert registry.might_contain("vip_filter", "3330000002")
+
+        stats = registry.stats()
+        assert stats["skipped_queries"] == 1
+        assert stats["stores"]["vip_filter"]["numbers"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_phone_filters_are_single_worker_only(monkeypatch):
+    monkeypatch.setattr(phone_filter, "PHONE_FILTER_ENABLED", True)
+    assert isinstance(create_phone_filters(None, workers=1), PhoneFilterRegistry)
+    # Another worker's registrations would be missing from this process's filter
+    assert create_phone_filters(None, workers=4) is None
+    monkeypatch.setattr(phone_filter, "PHONE_FILTER_ENABLED", False)
+    assert create_phone_filters(None, workers=1) is None
+
+
+def test_worker_count_sees_server_command_lines():
+    assert worker_count(["uvicorn", "app.main:app"], {}) == 1
+    assert worker_count(["uvicorn", "app.main:app"], {"WEB_CONCURRENCY": "3"}) == 3
+    assert worker_count(["gunicorn", "-w", "4", "app.main:app"], {}) == 4
+    assert worker_count(["gunicorn", "-w4", "app.main:app"], {}) == 4
+    assert worker_count(["uvicorn", "--workers=2", "app.main:app"], {}) == 2
+    assert worker_count(["gunicorn", "app.main:app"], {"GUNICORN_CMD_ARGS": "--workers 5 -k uvicorn.workers.UvicornWorker"}) == 5
+
+
+def test_invalidation_during_a_rebuild_drops_its_result():
+    from app.dependencies import get_engine, session_scope
+    from tests.conftest import seed_store
+
+    seed_store(get_engine(), table_name="vip_filter_gen", cards=2)
+
+    async def scenario():
+        registry = PhoneFilterRegistry(session_scope)
+        async with session_scope() as db:
+            execute = db.execute
+
+            async def execute_then_invalidate(*args, **kwargs):
+                registry.invalidate("vip_filter_gen")  # an import committing while the scan runs
+                return await execute(*args, **kwargs)
+
+            db.execute = execute_then_invalidate
+            await registry.build(db, "vip_filter_gen")
+        assert "vip_filter_gen" not in registry.filters
+
+        async with session_scope() as db:
+            await registry.build(db, "vip_filter_gen")
+        assert "vip_filter_gen" in registry.filters
+
+    asyncio.run(scenario())
+
+
+def test_check_phone_skips_query_for_definite_negatives(client):
+    from app.dependencies import session_scope
+
+    registry = client.app.state.phone_filters = PhoneFilterRegistry(session_scope)
+    client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    client.post(f"/vip/{STORE_TOKEN}/check-phone", json={"cellulare": "3339999999"})
+    for _ in range(100):
+        if "vip1" in registry.filters:
+            break
+        time.sleep(0.01)
+
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phone", json={"cellulare": "3339999999"})
+    assert response.json() == {"exists": False}
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phone", json={"cellulare": "3331234567"})
+    assert response.json() == {"exists": True}
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phones", json={"numbers": ["3331234567", "3338888888"]})
+    assert [r["exists"] for r in read_ndjson(response)] == [True, False]
+
+    stats = client.get("/admin/phone-filters", headers=ADMIN).json()
+    assert stats["skipped_queries"] == 2
+    assert stats["stores"]["vip1"]["numbers"] == 1
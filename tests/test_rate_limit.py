@@ -0,0 +1,112 @@
+# tests/test_rate_limit.py
+import asyncio
+
+from app.services import rate_limit
+from app.services.rate_limit import (
+    FakeRateLimitBackend, MemoryRateLimitBackend, RateLimit, RateLimiter, create_rate_limiter, parse_rate,
+)
+from tests.conftest import REGISTRATION_FORM, STORE_TOKEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter_is_opt_in_without_a_per_token_limit(monkeypatch):
+    assert create_rate_limiter() is None
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    limiter = create_rate_limiter()
+    assert limiter.per_ip == RateLimit(300, 60.0) and limiter.per_token is None
+
+
+def test_parse_rate():
+    assert parse_rate("20/60") == RateLimit(20, 60.0)
+    assert parse_rate("5") == RateLimit(5, 60.0)
+    assert parse_rate("") is None and parse_rate("0") is None
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    backend = MemoryRateLimitBackend(clock=clock)
+    limit = RateLimit(3, 3.0)
+
+    async def scenario():
+        results = [await backend.hit("ip:1", limit) for _ in range(4)]
+        clock.now = 1.0
+        results.append(await backend.hit("ip:1", limit))
+        results.append(await backend.hit("ip:1", limit))
+        return results
+
+    assert asyncio.run(scenario()) == [0.0, 0.0, 0.0, 1.0, 0.0, 1.0]
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryRateLimitBackend(max_keys=2)
+    for key in ("a", "b", "c"):
+        asyncio.run(backend.hit(key, RateLimit(1, 60)))
+    assert len(backend) == 2
+    # "a" was forgotten, so it starts over with a full bucket
+    assert asyncio.run(backend.hit("a", RateLimit(1, 60))) == 0.0
+
+
+def test_ip_limit_does_not_drain_the_store_bucket():
+    limiter = RateLimiter(MemoryRateLimitBackend(), per_ip=RateLimit(1, 60), per_token=RateLimit(2, 60))
+
+    async def scenario():
+        return [await limiter.check(ip, "tok") for ip in ("1.1.1.1", "1.1.1.1", "1.1.1.1", "2.2.2.2", "3.3.3.3")]
+
+    allowed = [retry_after == 0 for retry_after in asyncio.run(scenario())]
+    assert allowed == [True, False, False, True, False]
+    assert limiter.stats()["limited_ip"] == 2 and limiter.stats()["limited_token"] == 1
+
+
+def test_backend_failure_lets_requests_through():
+    limiter = RateLimiter(FakeRateLimitBackend(error=ConnectionError("down")), per_ip=RateLimit(1, 60))
+    assert asyncio.run(limiter.check("1.1.1.1", "tok")) == 0.0
+    assert limiter.stats()["backend_errors"] == 1
+
+
+def test_register_is_limited_before_recaptcha_and_db(client, monkeypatch):
+    from app import dependencies
+
+    monkeypatch.setattr(dependencies, "RATE_LIMIT_TRUST_FORWARDED", True)
+    client.app.state.rate_limiter = RateLimiter(MemoryRateLimitBackend(), per_ip=RateLimit(1, 60))
+    recaptcha_calls = client.app.state.recaptcha.backend.calls
+    # Our proxy appends the address it saw; the client can only prepend (and rotate) fake ones
+    proxy = {"X-Forwarded-For": "10.9.9.1, 203.0.113.7"}
+    spoofed = {"X-Forwarded-For": "10.9.9.2, 203.0.113.7"}
+
+    assert client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM, headers=proxy).status_code == 200
+    calls = len(recaptcha_calls)
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM, headers=spoofed)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "60"
+    assert len(recaptcha_calls) == calls
+
+    # Barcode images and the form page are not limited
+    assert client.get(f"/vip/{STORE_TOKEN}/register").status_code == 200
+    stats = client.get("/admin/rate-limits", headers={"X-Admin-Key": "test-admin-key"}).json()
+    assert stats["limited_ip"] == 1 and stats["tracked_keys"] == 1
+    assert 'rate_limit_decisions_total{outcome="limited_ip"} 1' in client.get("/metrics", headers={"X-Admin-Key": "test-admin-key"}).text
+
+
+def test_client_ip_uses_the_entries_our_proxies_appended(monkeypatch):
+    from starlette.requests import Request
+    from app import dependencies
+
+    def request(forwarded):
+        headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+        return Request({"type": "http", "headers": headers, "client": ("10.0.0.1", 1234)})
+
+    monkeypatch.setattr(dependencies, "RATE_LIMIT_TRUST_FORWARDED", True)
+    assert dependencies.client_ip(request("6.6.6.6, 203.0.113.7")) == "203.0.113.7"
+    assert dependencies.client_ip(request("")) == "10.0.0.1"
+    monkeypatch.setattr(dependencies, "RATE_LIMIT_TRUSTED_HOPS", 2)
+    assert dependencies.client_ip(request("6.6.6.6, 203.0.113.7, 10.0.0.5")) == "203.0.113.7"
+    assert dependencies.client_ip(request("203.0.113.7")) == "203.0.113.7"
+    monkeypatch.setattr(dependencies, "RATE_LIMIT_TRUST_FORWARDED", False)
+    assert dependencies.client_ip(request("203.0.113.7")) == "10.0.0.1"
@@ -0,0 +1,112 @@
+# tests/test_shards.py
+import pytest
+from sqlalchemy import create_engine, select
+
+from app.services.shards import (
+    DEFAULT_SHARD, InvalidStoreTable, ShardRoute, ShardRouter, parse_routes, parse_shards, validate_table_name,
+)
+from tests.conftest import REGISTRATION_FORM, seed_store
+
+SHARD_TOKEN = "tok-shard"
+
+
+def remove_store(id_negozio):
+    from app.dependencies import get_engine
+
+    engine = get_engine()
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DELETE FROM cliente WHERE id_negozio = {id_negozio}")
+
+
+def test_parse_shards_and_routes():
+    assert parse_shards("eu1=sqlite:///a.db; eu2=mysql+pymysql://u:p@db/x?charset=utf8mb4") == {
+        "eu1": "sqlite:///a.db", "eu2": "mysql+pymysql://u:p@db/x?charset=utf8mb4",
+    }
+    assert parse_routes("vip1=eu1;vip2*=eu2") == [ShardRoute("vip1", "eu1"), ShardRoute("vip2*", "eu2")]
+    assert parse_shards("") == {} and parse_routes(" ") == []
+    with pytest.raises(ValueError):
+        parse_shards("default=sqlite:///a.db")
+    with pytest.raises(ValueError):
+        parse_routes("vip1")
+
+
+def test_router_routes_by_pattern_and_validates_names():
+    router = ShardRouter({"eu1": "sqlite://"}, parse_routes("vip1=eu1;vip2*=default;vip*=eu1"))
+    assert router.shard_for("vip1") == "eu1"
+    assert router.shard_for("vip20") == DEFAULT_SHARD
+    assert router.shard_for("vip3") == "eu1"
+
+    for bad in ("cliente", "other", "vip1; DROP TABLE cliente", "vip1 ", None):
+        with pytest.raises(InvalidStoreTable):
+            router.shard_for(bad)
+    assert validate_table_name("vip_race") == "vip_race"
+
+    with pytest.raises(ValueError):
+        ShardRouter({}, [ShardRoute("vip*", "missing")])
+
+
+def test_table_pattern_is_read_from_the_settings_when_called(monkeypatch):
+    from app.settings import get_settings
+
+    # As if set only in .env: the module is already imported when settings load
+    monkeypatch.setenv("STORE_TABLE_PATTERN", r"shop[0-9]+")
+    get_settings.cache_clear()
+    try:
+        assert validate_table_name("shop7") == "shop7"
+        with pytest.raises(InvalidStoreTable):
+            validate_table_name("vip1")
+    finally:
+        monkeypatch.undo()
+        get_settings.cache_clear()
+    assert validate_table_name("vip1") == "vip1"
+
+
+@pytest.fixture
+def shard_engine(tmp_path, monkeypatch):
+    """A second SQLite file standing in for another database server, holding table vip_shard."""
+    from app import dependencies
+
+    url = f"sqlite:///{tmp_path}/shard.db"
+    router = ShardRouter({"eu1": url}, parse_routes("vip_shard=eu1"),
+                         dependencies.create_shard_engine, dependencies.create_async_shard_engine)
+    monkeypatch.setattr(dependencies, "shard_router", router)
+    seeding_engine = create_engine(url)
+    table = seed_store(dependencies.get_engine(), table_name="vip_shard", token=SHARD_TOKEN, id_negozio=7, cards=3,
+                       store_engine=seeding_engine)
+    yield seeding_engine, table
+    seeding_engine.dispose()
+    remove_store(7)
+
+
+def test_store_on_a_shard_is_served_from_its_database(shard_engine, client):
+    from app import dependencies
+
+    seeding_engine, table = shard_engine
+    response = client.post(f"/vip/{SHARD_TOKEN}/register", data=REGISTRATION_FORM)
+    assert response.status_code == 200
+    assert "2000000000001" in response.text
+
+    with seeding_engine.connect() as conn:
+        assert conn.execute(select(table.c.cellulare).where(table.c.IDvip == 1)).scalar() == "3331234567"
+    with dependencies.get_engine().connect() as conn:
+        assert not conn.dialect.has_table(conn, "vip_shard")
+
+    response = client.post(f"/vip/{SHARD_TOKEN}/check-phone", json={"cellulare": "3331234567"})
+    assert response.json() == {"exists": True}
+
+    stats = client.get("/admin/shards", headers={"X-Admin-Key": "test-admin-key"}).json()
+    assert stats["shards"]["eu1"] == {"open": True, "tables": ["vip_shard"]}
+
+
+def test_store_with_disallowed_table_name_is_not_served(client):
+    from app import dependencies
+
+    seed_store(dependencies.get_engine(), table_name="vip2", token="tok-bad", id_negozio=8)
+    try:
+        with dependencies.get_engine().begin() as conn:
+            conn.exec_driver_sql("UPDATE cliente SET dbnome = 'cliente' WHERE id_negozio = 8")
+        response = client.post("/vip/tok-bad/check-phone", json={"cellulare": "3331234567"})
+        assert response.status_code == 404
+    finally:
+        remove_store(8)
@@ -0,0 +1,85 @@
+# tests/test_startup.py
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Generous default so slow CI machines pass; the measured times are printed either way (pytest -s)
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", "5.0"))
+
+# Modules only needed on first use (barcode rendering, outgoing HTTP), not to import or build the app
+LAZY_MODULES = ("barcode", "httpx")
+
+MEASURE = """
+import json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+loaded_at_import = sorted(m for m in sys.modules if m.startswith("app."))
+try:
+    app.main.create_app()
+    error = None
+except ValueError as e:
+    error = str(e)
+built = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "create_app_seconds": built - imported,
+    "app_modules_at_import": loaded_at_import,
+    "lazy_loaded": [m for m in %r if m in sys.modules],
+    "error": error,
+}))
+""" % (LAZY_MODULES,)
+
+
+def measure(**env_overrides) -> dict:
+    """Import app.main and call create_app() in a fresh interpreter, as a replica's cold start does."""
+    env = {**os.environ, "LOG_FILE": "", **env_overrides}
+    env = {name: value for name, value in env.items() if value is not None}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", MEASURE], env=env, cwd=root, capture_output=True, text=True,
+                            timeout=60, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_time_benchmark():
+    report = measure()
+    print(f"\nimport app.main: {report['import_seconds'] * 1000:.0f} ms, "
+          f"create_app(): {report['create_app_seconds'] * 1000:.0f} ms")
+    assert report["error"] is None
+    assert report["import_seconds"] + report["create_app_seconds"] < IMPORT_TIME_BUDGET
+    # Routers, services and the database layer are loaded by create_app(), not by the import
+    assert report["app_modules_at_import"] == ["app.main", "app.settings"]
+    assert report["lazy_loaded"] == []
+
+
+def test_missing_settings_fail_in_create_app_not_at_import():
+    report = measure(RECAPTCHA_SITE_KEY=None, RECAPTCHA_SECRET_KEY=None, RECAPTCHA_BACKEND="google")
+    assert report["error"] == "RECAPTCHA_SITE_KEY and RECAPTCHA_SECRET_KEY required"
+
+
+def test_settings_validation(monkeypatch):
+    from app.settings import load_settings
+
+    monkeypatch.delenv("DATABASE_URL")
+    monkeypatch.setenv("RECAPTCHA_BACKEND", "google")
+    monkeypatch.delenv("RECAPTCHA_SECRET_KEY")
+    with pytest.raises(ValueError, match="DATABASE_URL and RECAPTCHA_SITE_KEY"):
+        load_settings().validate()
+    monkeypatch.setenv("DATABASE_URL", "sqlite://")
+    monkeypatch.setenv("RECAPTCHA_BACKEND", "fake")
+    load_settings().validate()
+
+
+def test_warm_up_fills_the_pool(monkeypatch):
+    from app import dependencies
+
+    monkeypatch.setattr(dependencies, "DB_ASYNC", False)
+    engine = dependencies.get_engine()
+    engine.dispose()
+    asyncio.run(dependencies.warm_up_engines(2))
+    status = dependencies.pool_status(engine)
+    assert status["checkedin"] == 2 and status["checkedout"] == 0
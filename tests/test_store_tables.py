@@ -0,0 +1,62 @@
+# tests/test_store_tables.py
+import asyncio
+
+import pytest
+from sqlalchemy import MetaData, Column, Integer, String, Table, select
+
+from app.services.shards import InvalidStoreTable
+from app.services.slots import claim_update_query
+from app.services.store_tables import StoreTableRegistry, load_store_tables, store_table
+
+
+def test_registry_reuses_tables_and_stays_bounded():
+    registry = StoreTableRegistry(maxsize=2)
+    first = registry.get("vip1")
+    assert registry.get("vip1") is first
+    assert [c.name for c in first.primary_key] == ["IDvip"] and first.name == "vip1"
+
+    registry.get("vip2")
+    registry.get("vip1")
+    registry.get("vip3")
+    assert registry.stats() == {"size": 2, "maxsize": 2, "created": 3, "evictions": 1}
+    # vip2 was the least recently used; asking again recreates it
+    assert registry.get("vip1") is first
+    registry.get("vip2")
+    assert registry.stats()["created"] == 4
+
+    with pytest.raises(InvalidStoreTable):
+        registry.get("cliente; DROP TABLE cliente")
+
+
+def test_statements_share_a_cache_key_per_table():
+    # Same cache key means SQLAlchemy compiles the statement once and reuses it
+    assert claim_update_query("vip1")._generate_cache_key() == claim_update_query("vip1")._generate_cache_key()
+    table = store_table("vip1")
+    small = select(table.c.cellulare).where(table.c.cellulare.in_(["3330000001"])).limit(1)
+    large = select(table.c.cellulare).where(table.c.cellulare.in_(["3330000001", "3330000002"])).limit(5)
+    assert small._generate_cache_key() == large._generate_cache_key()
+
+
+@pytest.mark.usefixtures("store_table")
+def test_load_store_tables_reflects_and_reports_missing_columns():
+    from app.dependencies import get_engine, session_scope
+    from tests.conftest import seed_store
+
+    engine = get_engine()
+    seed_store(engine, table_name="vip_legacy", token="tok-legacy", id_negozio=9)
+    legacy = Table("vip_legacy", MetaData(), Column("IDvip", Integer, primary_key=True), Column("cellulare", String(20)))
+    legacy.drop(engine)
+    legacy.create(engine)
+
+    async def scenario():
+        async with session_scope() as db:
+            return await load_store_tables(db, reflect=True)
+
+    try:
+        missing = asyncio.run(scenario())
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM cliente WHERE id_negozio = 9")
+            conn.exec_driver_sql("DROP TABLE vip_legacy")
+    assert missing["vip1"] == []
+    assert "code" in missing["vip_legacy"] and "IDvip" not in missing["vip_legacy"]
@@ -0,0 +1,274 @@
+# tests/test_vip.py
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.recaptcha import FakeRecaptchaBackend, RecaptchaOverloaded, RecaptchaVerifier
+from app.services.store_cache import StoreCache
+from tests.conftest import REGISTRATION_FORM, STORE_TOKEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cliente(id_negozio=1, dbnome="vip1", scadenza=None):
+    return SimpleNamespace(id_negozio=id_negozio, dbnome=dbnome, data_scadenza_token=scadenza)
+
+
+def test_store_cache_hits_misses_and_ttl():
+    clock = FakeClock()
+    cache = StoreCache(maxsize=10, ttl=60, negative_ttl=5, clock=clock)
+    assert cache.get("tok") == (False, None)
+
+    cliente = make_cliente()
+    cache.set("tok", cliente)
+    assert cache.get("tok") == (True, cliente)
+
+    clock.now += 61
+    assert cache.get("tok") == (False, None)
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_store_cache_negative_entries_expire_sooner():
+    clock = FakeClock()
+    cache = StoreCache(ttl=60, negative_ttl=5, clock=clock)
+    cache.set_missing("bogus")
+    assert cache.get("bogus") == (True, None)
+    assert cache.stats()["negative_hits"] == 1
+    clock.now += 6
+    assert cache.get("bogus") == (False, None)
+
+
+def test_store_cache_is_bounded_lru():
+    cache = StoreCache(maxsize=2, ttl=60)
+    cache.set("a", make_cliente(1))
+    cache.set("b", make_cliente(2))
+    cache.get("a")
+    cache.set("c", make_cliente(3))
+    assert cache.get("b") == (False, None)
+    assert cache.get("a")[0] and cache.get("c")[0]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_store_cache_respects_token_expiry():
+    cache = StoreCache(ttl=300)
+    cache.set("expired", make_cliente(scadenza=datetime.now() - timedelta(minutes=1)))
+    assert cache.get("expired") == (False, None)
+
+
+def test_store_cache_invalidation():
+    cache = StoreCache()
+    cache.set("a", make_cliente(1))
+    cache.set("b", make_cliente(1))
+    cache.set("c", make_cliente(2))
+    assert cache.invalidate("c") is True
+    assert cache.invalidate("c") is False
+    assert cache.invalidate_store(1) == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_get_store_from_token_caches_lookups(monkeypatch):
+    from app.routers import vip
+
+    cache = StoreCache()
+    monkeypatch.setattr(vip, "store_cache", cache)
+    cliente = make_cliente()
+
+    class FakeResult:
+        def __init__(self, value):
+            self.value = value
+
+        def scalar_one_or_none(self):
+            return self.value
+
+    class FakeSession:
+        def __init__(self):
+            self.queries = 0
+
+        async def execute(self, query):
+            self.queries += 1
+            return FakeResult(cliente if self.queries == 1 else None)
+
+        def expunge(self, obj):
+            pass
+
+    async def scenario():
+        db = FakeSession()
+        assert await vip.get_table_name_from_token("tok", db) == "vip1"
+        assert await vip.get_table_name_from_token("tok", db) == "vip1"
+        assert db.queries == 1
+
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await vip.get_store_from_token("bogus", db)
+        assert db.queries == 2
+
+    asyncio.run(scenario())
+
+
+def test_check_phone(client):
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phone", json={"cellulare": "+39 333 123 4567"})
+    assert response.status_code == 200
+    assert response.json() == {"exists": False}
+
+    response = client.post("/vip/unknown/check-phone", json={"cellulare": "3331234567"})
+    assert response.status_code == 404
+
+
+def test_register_form_renders(client):
+    response = client.get(f"/vip/{STORE_TOKEN}/register")
+    assert response.status_code == 200
+    assert "test-site-key" in response.text
+    assert f"/vip/{STORE_TOKEN}/register" in response.text
+
+
+def test_register_assigns_first_free_card(client):
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert response.status_code == 200
+    assert "Welcome, Mario Rossi!" in response.text
+    assert "2000000000001" in response.text
+
+    response = client.post(f"/vip/{STORE_TOKEN}/check-phone", json={"cellulare": "3331234567"})
+    assert response.json() == {"exists": True}
+
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data={**REGISTRATION_FORM, "Nome": "Luigi"})
+    assert "already registered" in response.text
+
+
+def test_register_rejects_low_recaptcha_score(client):
+    client.app.state.recaptcha.backend.score = 0.1
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert response.status_code == 200
+    assert "CAPTCHA verification failed" in response.text
+
+
+def test_register_recaptcha_failure_policy(client):
+    verifier = client.app.state.recaptcha
+    verifier.backend.error = TimeoutError()
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert response.status_code == 500
+
+    verifier.fail_open = True
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert "Welcome, Mario Rossi!" in response.text
+
+
+def test_recaptcha_verifier_bounds_concurrency():
+    async def scenario():
+        backend = FakeRecaptchaBackend(delay=0.05)
+        verifier = RecaptchaVerifier(backend, max_concurrency=1, acquire_timeout=0.01)
+        results = await asyncio.gather(
+            verifier.verify("a"), verifier.verify("b"), return_exceptions=True
+        )
+        assert results.count(True) == 1
+        assert sum(isinstance(r, RecaptchaOverloaded) for r in results) == 1
+        assert verifier.stats() == {"passed": 1, "rejected": 0, "failures": 0, "overloaded": 1}
+
+    asyncio.run(scenario())
+
+
+def test_recaptcha_overload_never_fails_open(client):
+    verifier = client.app.state.recaptcha
+    verifier.fail_open = True
+    # Every verification slot is taken
+    verifier._semaphore = asyncio.Semaphore(0)
+    verifier.acquire_timeout = 0.01
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert verifier.stats()["overloaded"] == 1 and verifier.backend.calls == []
+
+
+def test_vip_columns_skip_heavy_columns():
+    from app.models.vip import HEAVY_COLUMNS, vip_columns
+    from app.services.store_tables import store_table
+
+    table = store_table("vip1")
+    assert HEAVY_COLUMNS == {"img"}
+    assert "img" not in [c.name for c in vip_columns(table)]
+    assert [c.name for c in vip_columns(table, "IDvip", "code")] == ["IDvip", "code"]
+    with pytest.raises(ValueError):
+        vip_columns(table, "IDvip; DROP TABLE vip1")
+
+
+def test_dashboard_links_cached_barcode(client):
+    response = client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert f'src="/vip/{STORE_TOKEN}/barcode/2000000000001.svg"' in response.text
+
+    response = client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000001.svg")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/svg+xml"
+    assert response.headers["cache-control"].startswith("private, max-age=")
+    etag = response.headers["etag"]
+
+    response = client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000001.svg", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.content == b""
+
+
+def test_barcode_png_without_pillow(client):
+    client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    response = client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000001.png")
+    assert response.status_code == 200
+    assert response.content.startswith(b"\x89PNG\r\n\x1a\n")
+
+    assert client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000001.gif").status_code == 404
+    assert client.get("/vip/unknown/barcode/2000000000001.png").status_code == 404
+
+
+def test_barcodes_are_only_served_for_the_stores_member_cards(client):
+    # 2000000000002 is a free card of the store, 2999999999999 no card at all
+    client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000002.svg").status_code == 404
+    assert client.get(f"/vip/{STORE_TOKEN}/barcode/2999999999999.svg").status_code == 404
+    assert client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000001.svg").status_code == 200
+
+
+def test_barcode_cache_is_checked_before_the_worker_pool(client):
+    from app.services.barcodes import barcode_cache
+
+    client.post(f"/vip/{STORE_TOKEN}/register", data=REGISTRATION_FORM)
+    assert client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000001.svg").status_code == 200
+    completed = client.app.state.workers.stats()["completed"]
+    hits = barcode_cache.stats()["hits"]
+    assert client.get(f"/vip/{STORE_TOKEN}/barcode/2000000000001.svg").status_code == 200
+    assert client.app.state.workers.stats()["completed"] == completed
+    assert barcode_cache.stats()["hits"] == hits + 1
+
+
+def test_barcode_cache_is_a_bounded_lru():
+    from app.services.barcodes import BarcodeCache, render_barcode
+
+    cache = BarcodeCache(maxsize=1)
+    first = cache.set("CACHE-1", "svg", render_barcode("CACHE-1", "svg"))
+    assert cache.get("CACHE-1", "svg") is first
+    assert cache.get("CACHE-1", "png") is None
+    cache.set("CACHE-2", "svg", render_barcode("CACHE-2", "svg"))
+    assert cache.get("CACHE-1", "svg") is None
+    assert cache.stats()["size"] == 1
+
+
+def test_health_db_reports_pool(client):
+    response = client.get("/health/db")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert "checkedout" in body["pools"]["sync"]
+
+
+def test_engine_options_from_settings(monkeypatch):
+    from app import dependencies
+
+    monkeypatch.setattr(dependencies, "DB_POOL_SIZE", 20)
+    options = dependencies.engine_options("mysql+pymysql://user:pw@db/registration")
+    assert options["echo"] is False
+    assert options["pool_pre_ping"] is True
+    assert options["pool_size"] == 20 and options["max_overflow"] == 10
+    assert "pool_size" not in dependencies.engine_options("sqlite:///test.db")
@@ -0,0 +1,72 @@
+# tests/test_workers.py
+import asyncio
+import threading
+
+import pytest
+
+from app.services.barcodes import render_barcode
+from app.services.workers import WorkerPool, WorkerPoolSaturated
+from tests.conftest import STORE_TOKEN
+
+
+def test_worker_pool_rejects_when_queue_is_full():
+    release = threading.Event()
+
+    async def scenario():
+        pool = WorkerPool("thread", max_workers=1, max_pending=2)
+        jobs = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(WorkerPoolSaturated):
+            await pool.run(sum, [1, 2])
+        release.set()
+        await asyncio.gather(*jobs)
+        assert await pool.run(sum, [1, 2]) == 3
+
+        stats = pool.stats()
+        assert stats["rejected"] == 1 and stats["completed"] == 3
+        assert stats["peak_pending"] == 2 and stats["pending"] == 0
+        pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_worker_pool_timings_ignore_wall_clock_jumps(monkeypatch):
+    import time
+
+    # A wall clock stepped back by an hour on every reading
+    readings = iter(range(10**6, 0, -3600))
+    monkeypatch.setattr(time, "time", lambda: float(next(readings)))
+
+    async def scenario():
+        pool = WorkerPool("thread", max_workers=1)
+        try:
+            assert await pool.run(sum, [1, 2]) == 3
+            stats = pool.stats()
+            assert 0 <= stats["avg_wait_ms"] < 60_000 and 0 <= stats["avg_run_ms"] < 60_000
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_process_pool_renders_barcodes():
+    async def scenario():
+        pool = WorkerPool("process", max_workers=1)
+        try:
+            barcode = await pool.run(render_barcode, "2000000000001", "png")
+            assert barcode.content.startswith(b"\x89PNG")
+            assert await pool.run(str.upper, "ok", thread_only=True) == "OK"
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_saturated_pool_answers_503(client):
+    from app.services.page_cache import page_cache
+
+    page_cache.clear()
+    client.app.state.workers.max_pending = 0
+    response = client.get(f"/vip/{STORE_TOKEN}/register")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"